@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DAT257.settings')
+# Serve the async views in NZC/async_views.py (see settings.ASYNC_VIEWS)
+os.environ.setdefault('NZC_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -13,9 +13,14 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 
+from dotenv import load_dotenv
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Settings and API keys (OPENAI_API_KEY) can also be given in a .env file next to manage.py
+load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -42,11 +47,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'NZC.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'NZC.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,13 +81,91 @@ WSGI_APPLICATION = 'DAT257.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite profile, chosen with the DB_PROFILE environment variable:
+#   "tuned" (default): a busy timeout instead of immediate "database is locked"
+#       errors, write transactions that take the lock up front, and connections kept
+#       open between requests.
+#   "default": SQLite's and Django's defaults, for comparison (see benchmarks/bench_db_concurrency.py).
+# The WAL journal, so reads don't block on the writer, is stored in the database file
+# and not set per connection: switch a database to it once with
+# `manage.py set_journal_mode wal`.
+DB_PROFILE = os.getenv('DB_PROFILE', 'tuned')
+
+# Set on every new connection; none of them change the database file
+SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',    # Safe with WAL, only the last commits can be lost on power failure
+    'busy_timeout': 5000,       # ms
+    'cache_size': -20000,       # Negative means KiB, i.e. 20 MB per connection
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv('NZC_DB_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+if DB_PROFILE == 'tuned':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Run by Django on every new connection
+            'init_command': ''.join(f'PRAGMA {name}={value};' for name, value in SQLITE_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+        },
+    })
+
+# Load the PDF analyzer, supplier data and templates when the app starts instead of
+# on first use (NZC/preload.py). Set NZC_PRELOAD=1 with pre-fork servers (e.g.
+# gunicorn --preload) so the workers start warm and share the loaded data instead of
+# each building it on its first requests. /ready reports what is loaded.
+PRELOAD_ON_STARTUP = os.getenv('NZC_PRELOAD') == '1'
+
+# Route /results and the calculation API to the async views in NZC/async_views.py.
+# DAT257/asgi.py turns this on; under WSGI the sync views are faster.
+ASYNC_VIEWS = os.getenv('NZC_ASYNC_VIEWS') == '1'
+
+# Outgoing email. Views only queue emails in the outbox table; `manage.py send_outbox`
+# sends them in the background (NZC/outbox.py), in batches of OUTBOX_BATCH_SIZE over
+# one SMTP connection. A failed email is retried after OUTBOX_RETRY_DELAY seconds,
+# doubling every time, at most OUTBOX_MAX_ATTEMPTS times. To try it locally, run
+# `python -m NZC.mock_smtp 1025` with NZC_EMAIL_HOST=localhost NZC_EMAIL_PORT=1025.
+EMAIL_HOST = os.getenv('NZC_EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('NZC_EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.getenv('NZC_EMAIL_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('NZC_EMAIL_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('NZC_EMAIL_USE_TLS') == '1'
+EMAIL_TIMEOUT = 30
+DEFAULT_FROM_EMAIL = os.getenv('NZC_EMAIL_FROM', 'Net Zero Calculator <noreply@localhost>')
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_DELAY = 30
+OUTBOX_POLL_INTERVAL = 5
+# Result emails a client (by IP address) may ask for, and an address may receive, per
+# seconds; beyond that the form answers with an error instead of queueing (NZC/admission.py)
+EMAIL_RATE_LIMIT = (int(os.getenv('NZC_EMAIL_RATE_LIMIT', 10)), 3600)
+EMAIL_RECIPIENT_RATE_LIMIT = (int(os.getenv('NZC_EMAIL_RECIPIENT_RATE_LIMIT', 5)), 3600)
+
+# Request profiling (NZC/profiling.py): staff profile a request with ?_profile=1 or
+# the header X-Profile-Request: 1, and this share of all requests (0-1) is profiled
+# as well
+PROFILING_SAMPLE_RATE = float(os.getenv('NZC_PROFILE_SAMPLE_RATE', 0))
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_FILES = 200
+
+# Admission control for PDF analysis (NZC/admission.py), per process
+ANALYSIS_MAX_CONCURRENT = int(os.getenv('NZC_ANALYSIS_MAX_CONCURRENT', 2))
+ANALYSIS_MAX_QUEUE = int(os.getenv('NZC_ANALYSIS_MAX_QUEUE', 4))
+ANALYSIS_QUEUE_TIMEOUT = 15             # Seconds an upload waits for a free slot
+ANALYSIS_RATE_LIMIT = (int(os.getenv('NZC_ANALYSIS_RATE_LIMIT', 5)), 600)   # Analyses per client, per seconds
+
+# Results older than this are moved to RESULT_ARCHIVE_DIR by `manage.py compact_results`
+RESULT_RETENTION_DAYS = int(os.getenv('RESULT_RETENTION_DAYS', 365))
+RESULT_ARCHIVE_DIR = BASE_DIR / 'archive'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
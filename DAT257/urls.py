@@ -17,7 +17,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from NZC import views as nzc_views
+
 urlpatterns = [
+    # Before admin.site.urls, which would otherwise take every admin/ URL
+    path('admin/profiles/', nzc_views.profile_list, name='profile_list'),
+    path('admin/results/export.<str:export_format>', nzc_views.export_results, name='export_results'),
+    path('admin/profiles/<str:name>', nzc_views.profile_download, name='profile_download'),
     path('admin/', admin.site.urls),
     path('', include('NZC.urls')),
 ]
@@ -1,5 +1,13 @@
 from django.contrib import admin
-from .models import Result
+from .models import OutgoingEmail, PeerStatistic, Result
 
 # Register your models here.
-admin.site.register(Result)
\ No newline at end of file
+admin.site.register(Result)
+admin.site.register(PeerStatistic)
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('to', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to', 'subject')
@@ -0,0 +1,222 @@
+"""
+admission.py
+
+Admission control for PDF analysis, which holds a worker for seconds to minutes.
+At most settings.ANALYSIS_MAX_CONCURRENT analyses run at once; up to
+settings.ANALYSIS_MAX_QUEUE more wait for a slot, each for at most
+settings.ANALYSIS_QUEUE_TIMEOUT seconds, and further uploads are turned away at
+once with 503. Every client (by IP address) may also start only
+settings.ANALYSIS_RATE_LIMIT analyses per period, beyond which it gets 429. Both
+answers carry a Retry-After.
+
+The same RateLimiter limits result emails: settings.EMAIL_RATE_LIMIT per client and
+settings.EMAIL_RECIPIENT_RATE_LIMIT per recipient address, so the email form can't
+be used to flood an inbox.
+
+The limits are per process: with several worker processes the site runs up to
+ANALYSIS_MAX_CONCURRENT analyses in each. Give every process more threads than
+ANALYSIS_MAX_CONCURRENT + ANALYSIS_MAX_QUEUE so some are always free for page views.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .metrics import ADMISSIONS
+
+
+class Rejected(Exception):
+    """An analysis that wasn't admitted; status is the HTTP status to answer with."""
+
+    def __init__(self, status, retry_after, message):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.message = message
+
+
+class RateLimiter:
+    """A token bucket per client: `requests` per `period` seconds, all of them at once at most."""
+
+    # Buckets kept before full ones are forgotten
+    MAX_CLIENTS = 10_000
+
+    def __init__(self, requests, period):
+        self.capacity = requests
+        self.rate = requests / period
+        self._buckets = {}   # client: (tokens, time of last update)
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        """
+        Use one of the client's tokens.
+
+        Returns:
+            int or None: None if the client had a token, otherwise the seconds until it has one.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(client, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[client] = (tokens - 1, now)
+                retry_after = None
+            else:
+                self._buckets[client] = (tokens, now)
+                retry_after = math.ceil((1 - tokens) / self.rate)
+            if len(self._buckets) > self.MAX_CLIENTS:
+                self._forget_full(now)
+        return retry_after
+
+    def _forget_full(self, now):
+        for client, (tokens, updated) in list(self._buckets.items()):
+            if tokens + (now - updated) * self.rate >= self.capacity:
+                del self._buckets[client]
+
+
+class ConcurrencyLimiter:
+    """A semaphore with a bounded number of waiters and a wait timeout."""
+
+    def __init__(self, max_concurrent, max_queue, timeout):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        # Moving average of how long a slot is held, for Retry-After
+        self.average_duration = 30.0
+        self._condition = threading.Condition()
+
+    def retry_after(self):
+        return max(1, math.ceil(self.average_duration * (self.waiting + 1) / self.max_concurrent))
+
+    def acquire(self):
+        """Take a slot, waiting if needed; raises Rejected if none is free in time."""
+        with self._condition:
+            if self.active >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    ADMISSIONS.inc('queue_full')
+                    raise Rejected(503, self.retry_after(),
+                                   "Too many reports are being analysed right now. Please try again shortly.")
+                self.waiting += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: self.active < self.max_concurrent, self.timeout)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    ADMISSIONS.inc('queue_timeout')
+                    raise Rejected(503, self.retry_after(),
+                                   "Too many reports are being analysed right now. Please try again shortly.")
+                ADMISSIONS.inc('queued')
+            else:
+                ADMISSIONS.inc('immediate')
+            self.active += 1
+        return time.monotonic()
+
+    def release(self, start):
+        """Give back a slot taken at `start` (the value acquire returned)."""
+        with self._condition:
+            self.active -= 1
+            self.average_duration += 0.2 * (time.monotonic() - start - self.average_duration)
+            self._condition.notify()
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot for the duration of the block; raises Rejected if none is free in time."""
+        start = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(start)
+
+    def _release_abandoned(self, acquiring):
+        # The request stopped waiting, but the thread may still have taken the slot
+        if not acquiring.cancelled() and acquiring.exception() is None:
+            self.release(acquiring.result())
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Async variant of slot; waiting for a slot happens in a thread, off the event loop."""
+        acquiring = asyncio.ensure_future(sync_to_async(self.acquire, thread_sensitive=False)())
+        try:
+            # The wait in the thread can't be interrupted: when the request is cancelled
+            # (e.g. the client disconnected), give the slot back once the thread has it
+            start = await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            acquiring.add_done_callback(self._release_abandoned)
+            raise
+        try:
+            yield
+        finally:
+            self.release(start)
+
+
+@lru_cache(maxsize=None)
+def analysis_limiters():
+    """The process's rate and concurrency limiters for PDF analysis, built from the settings."""
+    return (
+        RateLimiter(*settings.ANALYSIS_RATE_LIMIT),
+        ConcurrencyLimiter(settings.ANALYSIS_MAX_CONCURRENT, settings.ANALYSIS_MAX_QUEUE,
+                           settings.ANALYSIS_QUEUE_TIMEOUT),
+    )
+
+
+@lru_cache(maxsize=None)
+def email_limiters():
+    """The process's rate limiters for result emails, per client and per recipient."""
+    return RateLimiter(*settings.EMAIL_RATE_LIMIT), RateLimiter(*settings.EMAIL_RECIPIENT_RATE_LIMIT)
+
+
+def take_email_limit(request, recipient):
+    """
+    Use one email of the client's and the recipient's allowance.
+
+    Returns:
+        int or None: None if both had one left, otherwise the seconds until they have.
+    """
+    client_limiter, recipient_limiter = email_limiters()
+    retry_after = client_limiter.take(client_key(request))
+    if retry_after is None:
+        retry_after = recipient_limiter.take(recipient.lower())
+    return retry_after
+
+
+def client_key(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _take_rate_limit(request):
+    rate_limiter, _ = analysis_limiters()
+    retry_after = rate_limiter.take(client_key(request))
+    if retry_after is not None:
+        ADMISSIONS.inc('rate_limited')
+        raise Rejected(429, retry_after,
+                       f"You have uploaded many reports in a short time. Please try again in {retry_after} seconds.")
+
+
+@contextmanager
+def analysis_slot(request):
+    """
+    Admit one PDF analysis for the request's client, waiting for a free slot if needed.
+
+    Raises:
+        Rejected: With status 429 when the client is over its rate limit, or 503 when
+            the queue is full or the wait timed out.
+    """
+    _take_rate_limit(request)
+    with analysis_limiters()[1].slot():
+        yield
+
+
+@asynccontextmanager
+async def aanalysis_slot(request):
+    """Async variant of analysis_slot, for async views."""
+    _take_rate_limit(request)
+    async with analysis_limiters()[1].aslot():
+        yield
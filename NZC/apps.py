@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class NzcConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'NZC'
+
+    def ready(self):
+        if settings.PRELOAD_ON_STARTUP:
+            from .preload import preload
+            preload()
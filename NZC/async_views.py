@@ -0,0 +1,126 @@
+"""
+async_views.py
+
+Async variants of the results page and the calculation API, used under ASGI (see
+settings.ASYNC_VIEWS). While a PDF is being analysed the view awaits the embedding
+and GPT calls instead of holding a thread, so one worker can have many analyses in
+flight. Parsing the PDF is CPU-bound and runs in a thread pool (see
+pdf_analyzer.aextract_info_from_pdf), and the database is used through the async
+ORM. The results page follows the same flow as the sync view (views._results_flow);
+only the way its steps are run differs.
+
+The pages and the JSON look exactly like those of the sync views in views.py.
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from . import admission
+from .metrics import CACHE_LOOKUPS, timed
+from .models import PeerStatistic, Result, input_fingerprint
+from .outbox import aqueue_result_email
+from .views import (
+    _api_calculations, _api_response, _persist_calculations, _rejected_response, _render_results,
+    _results_flow, _stored_result_context, _stored_result_json,
+)
+
+
+async def _arun_flow(flow, steps):
+    """Async variant of views._run_flow, awaiting each step."""
+    value, error = None, None
+    while True:
+        try:
+            step = flow.send(value) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        name, *args = step
+        try:
+            value, error = await getattr(steps, name)(*args), None
+        except Exception as e:
+            value, error = None, e
+
+
+class AsyncResultSteps:
+    """The steps of views._results_flow for the async view."""
+
+    async def stored_result(self, result_id):
+        return await aget_object_or_404(Result, id=result_id)
+
+    async def stored_context(self, result_object):
+        return _stored_result_context(result_object, await result_object.aget_cost_snapshot())
+
+    async def pdf_fingerprint(self, pdf_file):
+        # Hashing a large upload would hold up every other request on the event loop
+        return await sync_to_async(input_fingerprint, thread_sensitive=False)(pdf_file=pdf_file)
+
+    async def find_result(self, fingerprint):
+        return await Result.objects.filter(input_fingerprint=fingerprint).afirst()
+
+    async def analyze(self, request, pdf_file):
+        # Imported here for the same reason as in views.ResultSteps.analyze
+        from .pdf_analyzer import aextract_info_from_pdf
+
+        async with admission.aanalysis_slot(request):
+            return await aextract_info_from_pdf(pdf_file)
+
+    async def rejected(self, request, rejected):
+        return await sync_to_async(_rejected_response)(request, rejected)
+
+    async def save_result(self, fingerprint, defaults):
+        with timed('db_save'):
+            result_object, created = await Result.objects.aget_or_create(input_fingerprint=fingerprint,
+                                                                         defaults=defaults)
+        CACHE_LOOKUPS.inc('result', 'miss' if created else 'hit')
+        return result_object
+
+    async def queue_email(self, result_object, email, link):
+        with timed('db_save'):
+            return await aqueue_result_email(result_object, email, link)
+
+    async def peer_comparison(self, data):
+        with timed('peers'):
+            return await PeerStatistic.acompare(data)
+
+    async def render(self, request, context, result_object):
+        # Rendering may touch the session and user, which are sync only
+        return await sync_to_async(_render_results)(request, context, result_object)
+
+
+async def results(request):
+    """
+    Handle requests to the results page; see views.results.
+    """
+    return await _arun_flow(_results_flow(request), AsyncResultSteps())
+
+
+@csrf_exempt
+@require_POST
+async def calculate_api(request):
+    """
+    Calculate net zero costs for one company or a batch of companies; see views.calculate_api.
+    """
+    # A batch can take a while to calculate; it doesn't use the database, so any thread will do
+    parsed = await sync_to_async(_api_calculations, thread_sensitive=False)(request)
+    if isinstance(parsed, JsonResponse):
+        return parsed
+    items, batch, calculations = parsed
+
+    result_ids = None
+    if request.GET.get('persist') == 'true':
+        with timed('db_save'):
+            result_ids = await sync_to_async(_persist_calculations)(calculations)
+    return _api_response(items, batch, calculations, result_ids)
+
+
+@require_GET
+async def result_api(request, result_id):
+    """
+    JSON variant of the results page for a saved result; see views.result_api.
+    """
+    result_object = await Result.objects.filter(id=result_id).afirst()
+    if result_object is None:
+        return JsonResponse({'error': f'Result {result_id} does not exist'}, status=404)
+    return JsonResponse(await sync_to_async(_stored_result_json)(result_object))
@@ -0,0 +1,220 @@
+"""
+context_compression.py
+
+Shrinks the chunks the similarity search finds into the text sent to GPT, within a
+budget of tokens (NZC_LLM_CONTEXT_TOKENS, default 1500):
+
+1. Chunks that overlap in the report (the splitter overlaps them by 400
+   characters) are merged by their character spans, so no text is sent twice.
+2. The merged text is split into lines (long lines into sentences) and repeated
+   ones, such as page headers, are dropped with a hash set.
+3. Every line is scored by the keywords of what we extract (scope, emissions,
+   profit before tax, ...) and how many numbers it has, and the best lines that fit
+   the budget are kept, in the order they appear in the report. A table row is kept
+   with its table's header (caption and year columns) and neighbouring rows, so
+   the model can tell which column is the reporting year and what the unit is.
+
+Tokens are counted with tiktoken for the model's encoding. When the encoding can't
+be loaded (tiktoken downloads it on first use) they are estimated from the words
+and punctuation instead, which is close for this kind of text.
+"""
+
+import hashlib
+import os
+import re
+from functools import lru_cache
+
+TOKEN_BUDGET = int(os.getenv('NZC_LLM_CONTEXT_TOKENS', 1500))
+
+ENCODING_MODEL = 'gpt-4-turbo'
+
+# Lines longer than this are split into sentences
+MAX_LINE_LENGTH = 400
+# Rows looked through above a table row for its header
+MAX_TABLE_ROWS = 12
+
+KEYWORDS = re.compile(
+    r'scope|utsläpp|emission|växthusgas|greenhouse|ghg|co2|co₂|ton|market[- ]based|marknadsbaserad'
+    r'|location[- ]based|resultat|före skatt|profit|before tax|vinst|msek|mkr|mnkr|sek m',
+    re.IGNORECASE)
+NUMBER = re.compile(r'\d[\d\s,.]*\d|\d')
+WORD = re.compile(r'\w+|[^\w\s]')
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+YEAR = re.compile(r'\b(?:19|20)\d{2}\b')
+# A number standing on its own, not the 2 of "CO2e"
+ROW_NUMBER = re.compile(r'(?<!\w)\d')
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    """The model's tiktoken encoding, or None if it can't be loaded."""
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(ENCODING_MODEL)
+    except Exception:
+        return None
+
+
+def count_tokens(text):
+    """Tokens in text for the analysis model, or an estimate without tiktoken's encoding."""
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Long numbers are split into several tokens, roughly one per three digits
+    return sum(1 + (len(word) - 1) // 3 if word.isdigit() else 1 for word in WORD.findall(text))
+
+
+def merge_spans(text, documents):
+    """
+    The text of the retrieved chunks with overlapping chunks merged.
+
+    Args:
+        text (str): The whole report text the chunks were split from.
+        documents (list): Retrieved langchain Documents; those with a 'start_index'
+            in their metadata are merged by span, others are kept as they are.
+
+    Returns:
+        list: The distinct passages, in report order.
+    """
+    spans = []
+    loose = []
+    for document in documents:
+        start = document.metadata.get('start_index')
+        if start is None or start < 0:
+            loose.append(document.page_content)
+        else:
+            spans.append((start, start + len(document.page_content)))
+
+    passages = []
+    for start, end in sorted(spans):
+        if passages and start <= passages[-1][1]:
+            passages[-1][1] = max(passages[-1][1], end)
+        else:
+            passages.append([start, end])
+
+    seen = set()
+    unique = []
+    for passage in [text[start:end] for start, end in passages] + loose:
+        digest = hashlib.sha1(' '.join(passage.split()).encode()).digest()
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(passage)
+    return unique
+
+
+def _units(passage):
+    for line in passage.splitlines():
+        line = line.strip()
+        if len(line) > MAX_LINE_LENGTH:
+            yield from (sentence for sentence in SENTENCE_END.split(line) if sentence)
+        elif line:
+            yield line
+
+
+def _digest(unit):
+    return hashlib.sha1(' '.join(unit.lower().split()).encode()).digest()
+
+
+def score(unit):
+    """How likely a line is to hold a figure we extract: keywords count double, numbers once (up to 6)."""
+    return 2 * len(KEYWORDS.findall(unit)) + min(len(NUMBER.findall(unit)), 6)
+
+
+def is_row(unit):
+    """Whether a line looks like a table row: it has a number and isn't a sentence."""
+    return ROW_NUMBER.search(unit) is not None and not unit.rstrip().endswith(('.', '!', '?'))
+
+
+def is_column_headings(unit):
+    """Whether a line holds years and no other numbers, like "tCO2e 2023 2022"."""
+    return YEAR.search(unit) is not None and not ROW_NUMBER.search(YEAR.sub('', unit))
+
+
+def table_header(units, index):
+    """
+    The header lines of the table row units[index]: the nearest line above it that
+    holds column headings (years) or isn't a row (a caption), and the caption above
+    column headings.
+
+    Returns:
+        list: Indices into units, possibly empty.
+    """
+    for j in range(index - 1, max(-1, index - MAX_TABLE_ROWS - 1), -1):
+        if is_column_headings(units[j]):
+            if j > 0 and not is_row(units[j - 1]):
+                return [j - 1, j]
+            return [j]
+        if not is_row(units[j]):
+            return [j]
+    return []
+
+
+def compress_contexts(passages, budget=None):
+    """
+    Pick the lines of the passages to send to GPT. A table row is kept with its
+    table's header when the budget allows, since a number without the column it is
+    in (which year, which unit) is easy to misread; the rows next to it are added
+    with whatever budget is left.
+
+    Args:
+        passages (list): Distinct passages, from merge_spans.
+        budget (int or None): Most tokens to keep, by default TOKEN_BUDGET.
+
+    Returns:
+        str: The kept lines in report order, passages separated by '---'.
+    """
+    budget = TOKEN_BUDGET if budget is None else budget
+    passage_units = [list(_units(passage)) for passage in passages]
+    candidates = []
+    seen = set()
+    for passage_index, units in enumerate(passage_units):
+        for index, unit in enumerate(units):
+            digest = _digest(unit)
+            if digest in seen:
+                continue
+            seen.add(digest)
+            unit_score = score(unit)
+            if unit_score:
+                candidates.append((unit_score, len(candidates), passage_index, index))
+
+    kept = set()
+    kept_digests = set()
+    used = 0
+
+    def keep(passage_index, indices):
+        """Keep the lines if they fit the budget; lines already kept cost nothing."""
+        nonlocal used
+        units = passage_units[passage_index]
+        new = [j for j in indices if (passage_index, j) not in kept and _digest(units[j]) not in kept_digests]
+        tokens = sum(count_tokens(units[j]) + 1 for j in new)
+        if used + tokens > budget:
+            return False
+        for j in new:
+            kept.add((passage_index, j))
+            kept_digests.add(_digest(units[j]))
+        used += tokens
+        return True
+
+    # Every line with its table's header if that fits, alone otherwise; then the
+    # rows next to the kept table rows with what is left of the budget
+    selected = sorted(candidates, key=lambda c: (-c[0], c[1]))
+    for _, _, passage_index, index in selected:
+        units = passage_units[passage_index]
+        header = table_header(units, index) if is_row(units[index]) else []
+        if not (header and keep(passage_index, header + [index])):
+            keep(passage_index, [index])
+    for _, _, passage_index, index in selected:
+        units = passage_units[passage_index]
+        if (passage_index, index) in kept and is_row(units[index]):
+            for j in (index - 1, index + 1):
+                if 0 <= j < len(units) and is_row(units[j]):
+                    keep(passage_index, [j])
+
+    blocks = []
+    last_passage = None
+    for passage_index, index in sorted(kept):
+        if passage_index != last_passage:
+            blocks.append([])
+            last_passage = passage_index
+        blocks[-1].append(passage_units[passage_index][index])
+    return "\n\n---\n\n".join("\n".join(block) for block in blocks)
@@ -0,0 +1,219 @@
+"""
+costs.py
+
+The price table for carbon removal methods and the cost calculation shown on the
+results page.
+
+A calculation is stored on its Result as a snapshot, so a result keeps the prices
+it was computed with and showing it again doesn't recompute anything. Bump
+PRICE_TABLE_VERSION whenever REMOVAL_METHODS changes.
+
+compute_cost_arrays does the same calculation for many companies at once with
+numpy, and compute_cost_snapshots uses it for batches of the API. Both give exactly
+the numbers of compute_cost_snapshot (NZC/tests.py checks this); keep them in step
+when the calculation changes.
+"""
+
+import math
+
+PRICE_TABLE_VERSION = 1
+
+REMOVAL_METHODS = {
+    'Direct Air Capture': (100, 345),      # Cost in U.S. dollars per ton of CO₂
+    'Biochar': (10, 345),
+    'Reforestation': (5, 240),
+    'Enhanced Weathering': (50, 200),
+    'BECCS': (15, 400),
+    'Soil carbon sequestration': (45, 100)
+}
+
+SEK_PER_USD = 10
+SCOPES = ('scope1', 'scope2', 'scope3')
+
+# Largest integer every float64 holds exactly. The array path computes in floats
+# like the scalar path does for numbers up to this size; beyond it Python divides
+# big ints exactly, so those companies go through compute_cost_snapshot.
+EXACT_FLOAT_INT = 2 ** 53
+
+# compute_cost_snapshots computes smaller batches one by one, which is faster than
+# setting up the arrays for them
+VECTORIZE_FROM = 50
+
+
+def _tsek(tons, sek_per_ton):
+    return math.ceil(tons * sek_per_ton / 1_000)
+
+
+def compute_cost_snapshot(data, methods=None, version=PRICE_TABLE_VERSION):
+    """
+    Calculate what offsetting the emissions costs with every removal method.
+
+    Args:
+        data (dict): "scope1", "scope2", "scope3" (tons CO₂e, ints) and "profit"
+            (MSEK, may be missing or "-" when a PDF didn't state it).
+        methods (dict or None): Method name to (low, high) USD per ton, by default
+            REMOVAL_METHODS.
+        version (int): Version of the price table, stored with the snapshot.
+
+    Returns:
+        dict: {'version': ..., 'methods': {method: {...}}} where every method has
+              'price_per_ton' (SEK, low/high), 'scope1' to 'scope3' and 'total'
+              (TSEK, low/high) and 'profit_total_percent' (low/high, "-" without a
+              profit). Pairs are lists so the snapshot round-trips through JSON.
+    """
+    profit = data.get('profit')
+    profit_tsek = profit * 1000 if isinstance(profit, (int, float)) and profit != 0 else None
+    total_tons = sum(data[scope] for scope in SCOPES)
+
+    snapshot = {}
+    for method, (low, high) in (methods or REMOVAL_METHODS).items():
+        price = [low * SEK_PER_USD, high * SEK_PER_USD]
+        total = [_tsek(total_tons, price[0]), _tsek(total_tons, price[1])]
+        if profit_tsek:
+            percent = [round((cost / profit_tsek) * 100, 1) if cost else "-" for cost in total]
+        else:
+            percent = ["-", "-"]
+        snapshot[method] = {
+            'price_per_ton': price,
+            **{scope: [_tsek(data[scope], price[0]), _tsek(data[scope], price[1])] for scope in SCOPES},
+            'total': total,
+            'profit_total_percent': percent,
+        }
+    return {'version': version, 'methods': snapshot}
+
+
+def cost_tables(snapshot):
+    """
+    Split a snapshot into the two tables results.html shows.
+
+    Returns:
+        tuple: (costs_per_method, price_per_ton)
+    """
+    costs_per_method = {}
+    price_per_ton = {}
+    for method, costs in snapshot['methods'].items():
+        costs_per_method[method] = {key: value for key, value in costs.items() if key != 'price_per_ton'}
+        price_per_ton[method] = costs['price_per_ton']
+    return costs_per_method, price_per_ton
+
+
+def _round1(np, values):
+    """round(value, 1) for every value, with the same result as Python's round()."""
+    # np.round rounds value * 10, which is itself rounded, so when that lands near
+    # a half it can round the other way than Python does; those few use round()
+    scaled = values * 10
+    rounded = np.round(values, 1)
+    with np.errstate(invalid='ignore'):
+        unsure = (np.abs(scaled - np.floor(scaled) - 0.5) <= 1e-12 * np.maximum(1, np.abs(scaled))) | (
+            np.abs(scaled) >= EXACT_FLOAT_INT)
+    for index in np.flatnonzero(unsure):
+        rounded[index] = round(float(values[index]), 1)
+    return rounded
+
+
+def compute_cost_arrays(scope1, scope2, scope3, profit, methods=None):
+    """
+    compute_cost_snapshot for many companies at once.
+
+    Args:
+        scope1, scope2, scope3 (array-like): Tons CO₂e per company, integers.
+        profit (array-like): Profit in MSEK per company, NaN where it is missing.
+        methods (dict or None): Method name to (low, high) USD per ton, by default
+            REMOVAL_METHODS.
+
+    Returns:
+        dict: {method: {...}} with the keys of a snapshot's method. 'price_per_ton'
+              is a (low, high) pair of ints, the others (low, high) pairs of numpy
+              arrays; 'profit_total_percent' is NaN where the snapshot has "-".
+
+    Raises:
+        ValueError: If a company's emissions times a price per ton exceed
+            EXACT_FLOAT_INT, or its profit in TSEK does.
+    """
+    import numpy as np
+
+    scopes = {'scope1': np.asarray(scope1, dtype=np.int64), 'scope2': np.asarray(scope2, dtype=np.int64),
+              'scope3': np.asarray(scope3, dtype=np.int64)}
+    scopes['total'] = scopes['scope1'] + scopes['scope2'] + scopes['scope3']
+    profit_tsek = np.asarray(profit, dtype=np.float64) * 1000
+    profit_tsek[profit_tsek == 0] = np.nan
+    methods = methods or REMOVAL_METHODS
+
+    highest = max(max(prices) for prices in methods.values()) * SEK_PER_USD
+    largest = np.abs(scopes['scope1']) + np.abs(scopes['scope2']) + np.abs(scopes['scope3'])
+    if len(profit_tsek) and (largest.max() > EXACT_FLOAT_INT // highest
+                             or np.nanmax(np.abs(profit_tsek), initial=0) > EXACT_FLOAT_INT):
+        raise ValueError("Emissions or profit too large for compute_cost_arrays")
+
+    arrays = {}
+    for method, (low, high) in methods.items():
+        price = (low * SEK_PER_USD, high * SEK_PER_USD)
+        arrays[method] = {'price_per_ton': price}
+        for key, tons in scopes.items():
+            arrays[method][key] = tuple(np.ceil(tons * sek_per_ton / 1_000).astype(np.int64) for sek_per_ton in price)
+        percent = []
+        for cost in arrays[method]['total']:
+            with np.errstate(invalid='ignore'):
+                value = cost / profit_tsek * 100
+            value[cost == 0] = np.nan
+            percent.append(_round1(np, value))
+        arrays[method]['profit_total_percent'] = tuple(percent)
+    return arrays
+
+
+def compute_cost_snapshots(rows, methods=None, version=PRICE_TABLE_VERSION):
+    """
+    compute_cost_snapshot for every dict in rows, vectorized with compute_cost_arrays.
+
+    Args:
+        rows (list): Dicts like compute_cost_snapshot's data, with integer scopes.
+        methods (dict or None): As for compute_cost_snapshot.
+        version (int): As for compute_cost_snapshot.
+
+    Returns:
+        list: The snapshots, in the order of rows.
+    """
+    if len(rows) < VECTORIZE_FROM:
+        return [compute_cost_snapshot(data, methods, version) for data in rows]
+
+    import numpy as np
+
+    methods = methods or REMOVAL_METHODS
+    highest = max(max(prices) for prices in methods.values()) * SEK_PER_USD
+    snapshots = [None] * len(rows)
+    fits = []
+    for index, data in enumerate(rows):
+        profit = data.get('profit')
+        if (sum(abs(data[scope]) for scope in SCOPES) <= EXACT_FLOAT_INT // highest
+                and (not isinstance(profit, (int, float)) or abs(profit) * 1000 <= EXACT_FLOAT_INT)):
+            fits.append(index)
+        else:
+            snapshots[index] = compute_cost_snapshot(data, methods, version)
+    if not fits:
+        return snapshots
+
+    arrays = compute_cost_arrays(
+        *([rows[index][scope] for index in fits] for scope in SCOPES),
+        [rows[index]['profit'] if isinstance(rows[index].get('profit'), (int, float)) else np.nan
+         for index in fits],
+        methods)
+    per_method = []
+    for method, costs in arrays.items():
+        price = costs['price_per_ton']
+        values = [values.tolist() for key in (*SCOPES, 'total', 'profit_total_percent') for values in costs[key]]
+        per_method.append([
+            {
+                'price_per_ton': list(price),
+                'scope1': [s1_low, s1_high],
+                'scope2': [s2_low, s2_high],
+                'scope3': [s3_low, s3_high],
+                'total': [total_low, total_high],
+                # NaN marks a percent the snapshot shows as "-"
+                'profit_total_percent': ["-" if low != low else low, "-" if high != high else high],
+            }
+            for s1_low, s1_high, s2_low, s2_high, s3_low, s3_high, total_low, total_high, low, high in zip(*values)
+        ])
+
+    for index, costs in zip(fits, zip(*per_method)):
+        snapshots[index] = {'version': version, 'methods': dict(zip(arrays, costs))}
+    return snapshots
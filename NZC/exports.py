@@ -0,0 +1,318 @@
+"""
+exports.py
+
+Downloadable versions of the results page's cost table, for one result or for
+every result in a date range, as CSV, XLSX or PDF.
+
+All three formats are written as a stream of chunks: rows are read from the
+database in batches and every chunk is sent as soon as it is full, so an export of
+many results never holds the whole file in memory. The XLSX and PDF writers are
+small hand-written ones: XLSX is a zip of XML files, written with inline strings so
+no shared string table is kept, and PDF is plain text drawn with a built-in font.
+"""
+
+import csv
+import io
+import zipfile
+from xml.sax.saxutils import escape
+
+from .costs import REMOVAL_METHODS, compute_cost_snapshot
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'pdf': 'application/pdf',
+}
+
+# Bytes collected before a chunk is sent
+CHUNK_SIZE = 64 * 1024
+
+# Result rows read from the database per query
+BATCH_SIZE = 2000
+
+RESULT_COLUMNS = [
+    'Method', 'Price/ton low (SEK)', 'Price/ton high (SEK)',
+    'Scope 1 low (TSEK)', 'Scope 1 high (TSEK)', 'Scope 2 low (TSEK)', 'Scope 2 high (TSEK)',
+    'Scope 3 low (TSEK)', 'Scope 3 high (TSEK)', 'Total low (TSEK)', 'Total high (TSEK)',
+    'Profit/Total cost low (%)', 'Profit/Total cost high (%)',
+]
+
+RANGE_COLUMNS = [
+    'ID', 'Created', 'PDF', 'Scope 1 (tCO2e)', 'Scope 2 (tCO2e)', 'Scope 3 (tCO2e)', 'Profit (MSEK)',
+    'Price table version',
+] + [f'{method} total {bound} (TSEK)' for method in REMOVAL_METHODS for bound in ('low', 'high')]
+
+
+def _snapshot(result_object):
+    # Exports only read: results saved before snapshots existed are computed, not saved
+    return result_object.cost_snapshot or compute_cost_snapshot(result_object.input_data())
+
+
+def result_rows(result_object):
+    """The cost table of one result, as in results.html, one method per row."""
+    for method, costs in _snapshot(result_object)['methods'].items():
+        yield [method, *costs['price_per_ton'], *costs['scope1'], *costs['scope2'], *costs['scope3'],
+               *costs['total'], *costs['profit_total_percent']]
+
+
+def range_rows(results):
+    """One row per result with its input and the total cost per method."""
+    for result_object in results:
+        snapshot = _snapshot(result_object)
+        row = [result_object.id, result_object.created_at.strftime('%Y-%m-%d %H:%M'), result_object.pdfname or '',
+               result_object.scope1, result_object.scope2, result_object.scope3, result_object.profit,
+               snapshot['version']]
+        for method in REMOVAL_METHODS:
+            row += snapshot['methods'].get(method, {}).get('total', ['', ''])
+        yield row
+
+
+def _chunks(buffer, pieces):
+    """Write pieces to buffer (having getvalue/truncate) and yield its contents every CHUNK_SIZE."""
+    for _ in pieces:
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def csv_chunks(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield from _chunks(buffer, (writer.writerow(row) for row in rows))
+
+
+class _ChunkBuffer:
+    """A write-only file for zipfile that hands out what was written so far."""
+
+    def __init__(self):
+        self._parts = []
+        self.size = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        self.size = 0
+        return data
+
+
+_XLSX_FILES = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="{sheet}" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'),
+}
+
+
+def _xlsx_row(row):
+    cells = []
+    for value in row:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c><v>{value}</v></c>')
+        else:
+            cells.append(f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+
+def xlsx_chunks(columns, rows, sheet='Net zero costs'):
+    """A one-sheet workbook, streamed as the rows come in."""
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in _XLSX_FILES.items():
+            workbook.writestr(name, content.replace('{sheet}', escape(sheet[:31])))
+        # The sheet's size isn't known in advance; zip64 allows it to exceed 4 GB
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet_file:
+            sheet_file.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            sheet_file.write(_xlsx_row(columns).encode())
+            for row in rows:
+                sheet_file.write(_xlsx_row(row).encode())
+                if buffer.size >= CHUNK_SIZE:
+                    yield buffer.take()
+            sheet_file.write(b'</sheetData></worksheet>')
+    yield buffer.take()
+
+
+def _pdf_string(text):
+    # The built-in fonts only have WinAnsi characters
+    text = str(text).replace('₂', '2').encode('cp1252', 'replace').decode('latin-1')
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+class PdfWriter:
+    """
+    Writes a landscape A4 PDF of text lines and tables, page by page. Every finished
+    page is available from take(), so a long document goes out as it is written.
+    """
+
+    WIDTH, HEIGHT = 842, 595
+    MARGIN = 36
+    LINE_HEIGHT = 12
+
+    # Object 1 is the font and 2 the page tree, written last when all pages are known
+    def __init__(self):
+        self._data = bytearray(b'%PDF-1.4\n')
+        self._offset = 0
+        self._offsets = {}
+        self._pages = []
+        self._next_object = 3
+        self._lines = []
+        self._header = None
+        self._write_object(1, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+
+    def _write_object(self, number, body):
+        self._offsets[number] = self._offset + len(self._data)
+        self._data += f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+
+    def _new_object(self):
+        number = self._next_object
+        self._next_object += 1
+        return number
+
+    @property
+    def lines_left(self):
+        return (self.HEIGHT - 2 * self.MARGIN) // self.LINE_HEIGHT - len(self._lines)
+
+    @property
+    def pending(self):
+        """Bytes written but not taken yet."""
+        return len(self._data)
+
+    def line(self, cells, columns=None, size=9):
+        """Add a line of text; with columns (x positions), every cell starts at its column."""
+        if self.lines_left <= 0:
+            self.end_page()
+        if not self._lines and self._header:
+            self._lines.append(self._header)
+        if isinstance(cells, str):
+            cells = [cells]
+        self._lines.append((cells, columns or [0], size))
+
+    def header(self, cells, columns=None, size=9):
+        """Add a line that is repeated at the top of every following page, e.g. table headings."""
+        self.line(cells, columns, size)
+        self._header = self._lines[-1]
+
+    def end_page(self):
+        if not self._lines:
+            return
+        operations = []
+        y = self.HEIGHT - self.MARGIN
+        for cells, columns, size in self._lines:
+            for x, cell in zip(columns, cells):
+                operations.append(f'BT /F1 {size} Tf {self.MARGIN + x} {y} Td ({_pdf_string(cell)}) Tj ET')
+            y -= self.LINE_HEIGHT
+        self._lines = []
+        stream = '\n'.join(operations).encode('latin-1')
+        content = self._new_object()
+        self._write_object(content, b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'\nendstream')
+        page = self._new_object()
+        self._write_object(page, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.WIDTH} {self.HEIGHT}] /Contents {content} 0 R '
+            f'/Resources << /Font << /F1 1 0 R >> >> >>').encode())
+        self._pages.append(page)
+
+    def take(self):
+        """The bytes written since the last call."""
+        data = bytes(self._data)
+        self._offset += len(self._data)
+        self._data.clear()
+        return data
+
+    def close(self):
+        """Finish the document; take() then returns the rest of it."""
+        self.end_page()
+        if not self._pages:
+            self.line('')
+            self.end_page()
+        kids = ' '.join(f'{page} 0 R' for page in self._pages)
+        self._write_object(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>'.encode())
+        catalog = self._new_object()
+        self._write_object(catalog, b'<< /Type /Catalog /Pages 2 0 R >>')
+        xref = self._offset + len(self._data)
+        self._data += f'xref\n0 {catalog + 1}\n0000000000 65535 f \n'.encode()
+        for number in range(1, catalog + 1):
+            self._data += f'{self._offsets[number]:010d} 00000 n \n'.encode()
+        self._data += f'trailer\n<< /Size {catalog + 1} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+
+
+def _range(low, high, suffix=''):
+    if low == '-' or high == '-' or low == '' or high == '':
+        return '-'
+    return f'{low}–{high}{suffix}'
+
+
+def result_pdf_chunks(result_object):
+    """A one-page report of a result: its input and the cost table of results.html."""
+    pdf = PdfWriter()
+    snapshot = _snapshot(result_object)
+    pdf.line(f'Net Zero Calculator – result {result_object.id}', size=16)
+    pdf.line('')
+    for label, value in (('Scope 1', f'{result_object.scope1} tCO2e'), ('Scope 2', f'{result_object.scope2} tCO2e'),
+                         ('Scope 3', f'{result_object.scope3} tCO2e'), ('Profit before tax', f'{result_object.profit} MSEK')):
+        pdf.line([f'{label}:', value], [0, 110])
+    if result_object.pdfname:
+        pdf.line(['Report:', result_object.pdfname], [0, 110])
+    pdf.line(['Calculated:', f'{result_object.created_at:%Y-%m-%d} (price table version {snapshot["version"]})'], [0, 110])
+    pdf.line('')
+    pdf.line('Net Zero Cost per Method in TSEK', size=12)
+    columns = [0, 150, 250, 350, 450, 550, 660]
+    pdf.line(['Method', 'Price/ton (SEK)', 'Scope 1', 'Scope 2', 'Scope 3', 'Total Cost', 'Profit/Total Cost (%)'], columns)
+    for method, costs in snapshot['methods'].items():
+        pdf.line([method, _range(*costs['price_per_ton']), _range(*costs['scope1']), _range(*costs['scope2']),
+                  _range(*costs['scope3']), _range(*costs['total']), _range(*costs['profit_total_percent'], '%')],
+                 columns)
+    pdf.close()
+    yield pdf.take()
+
+
+def range_pdf_chunks(results, title):
+    """A listing of many results with the lowest and highest total cost, sent page by page."""
+    columns = [0, 40, 120, 300, 370, 440, 530, 610, 690]
+    pdf = PdfWriter()
+    pdf.line(title, size=14)
+    pdf.header(['ID', 'Created', 'PDF', 'Scope 1', 'Scope 2', 'Scope 3', 'Profit (MSEK)',
+                'Lowest (TSEK)', 'Highest (TSEK)'], columns, size=8)
+    for row in range_rows(results):
+        totals = [value for value in row[8:] if value != '']
+        pdf.line([row[0], row[1], str(row[2])[:32], *row[3:7],
+                  min(totals, default='-'), max(totals, default='-')], columns, size=8)
+        if pdf.pending >= CHUNK_SIZE:
+            yield pdf.take()
+    pdf.close()
+    yield pdf.take()
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from NZC.pipeline import STAGES, PipelineRunner
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the supplier map data: scrape the leaderboard, company links and locations, "
+        "geocode them and write static/suppliers.json. Stages whose inputs are unchanged are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('stages', nargs='*',
+                            help=f"Only run these stages (default: all of {', '.join(s.name for s in STAGES)})")
+        parser.add_argument('--force', action='store_true', help="Run stages even if they are up to date")
+        parser.add_argument('--refresh', action='store_true', help="Scrape the leaderboard again")
+        parser.add_argument('--jobs', type=int, default=4, help="Maximum number of stages running at once")
+        parser.add_argument('--dry-run', action='store_true', help="Only show which stages would run")
+
+    def handle(self, *args, **options):
+        unknown = set(options['stages']) - {stage.name for stage in STAGES}
+        if unknown:
+            raise CommandError(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+        runner = PipelineRunner(settings.BASE_DIR, log=self.stdout.write)
+        report = runner.run(
+            only=options['stages'] or None,
+            force=options['force'],
+            refresh=options['refresh'],
+            jobs=options['jobs'],
+            dry_run=options['dry_run'],
+        )
+
+        self.stdout.write("\nStage             Status      Time")
+        for name, (status, duration) in report.items():
+            self.stdout.write(f"{name:<17} {status:<11} {duration:6.1f} s")
+
+        failed = [name for name, (status, _) in report.items() if status in ('failed', 'blocked')]
+        if failed:
+            raise CommandError(f"Stages did not complete: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS("Supplier data is up to date."))
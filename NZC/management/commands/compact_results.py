@@ -0,0 +1,180 @@
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from NZC.models import PeerStatistic, Result
+
+# Pages freed per incremental_vacuum step; each step holds the write lock only briefly
+VACUUM_STEP_PAGES = 1000
+
+
+class NdjsonArchive:
+    """Gzipped newline-delimited JSON, one result per line."""
+
+    extension = 'ndjson.gz'
+
+    def __init__(self, path):
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+
+    def write(self, rows):
+        for row in rows:
+            self._file.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+        # Make the batch durable before its rows are deleted
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetArchive:
+    """A Parquet file written one row group per batch. Needs pyarrow."""
+
+    extension = 'parquet'
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise CommandError("Parquet archives need pyarrow (pip install pyarrow), or use --format ndjson")
+        self._pa = pa
+        self._schema = pa.schema([
+            ('id', pa.int64()), ('scope1', pa.int64()), ('scope2', pa.int64()), ('scope3', pa.int64()),
+            ('profit', pa.int64()), ('pdfname', pa.string()), ('created_at', pa.timestamp('us', tz='UTC')),
+            ('email', pa.string()), ('cost_snapshot', pa.string()), ('input_fingerprint', pa.string()),
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema, compression='zstd')
+
+    def write(self, rows):
+        rows = [dict(row, cost_snapshot=json.dumps(row['cost_snapshot'])) for row in rows]
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+ARCHIVE_FORMATS = {'ndjson': NdjsonArchive, 'parquet': ParquetArchive}
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive results older than the retention period to compressed files, delete them "
+        "in small transactions, rebuild the peer statistics and reclaim the space. Safe to "
+        "run while the site is serving."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=settings.RESULT_RETENTION_DAYS,
+                            help="Age in days after which results are archived (default: %(default)s)")
+        parser.add_argument('--archive-dir', default=settings.RESULT_ARCHIVE_DIR)
+        parser.add_argument('--format', choices=sorted(ARCHIVE_FORMATS), default='ndjson')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Rows archived and deleted per transaction")
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help="Seconds to wait between batches so other writers get the lock")
+        parser.add_argument('--vacuum', choices=['incremental', 'full', 'none'], default='incremental',
+                            help="How to give freed pages back to the file system. 'full' rewrites the "
+                                 "database and blocks writers while it runs; it also switches the "
+                                 "database to incremental auto-vacuum for later runs")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the results that would be archived")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        old_results = Result.objects.filter(created_at__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write(f"{old_results.count()} results older than {cutoff:%Y-%m-%d} would be archived.")
+            return
+
+        archived = 0
+        if old_results.exists():
+            os.makedirs(options['archive_dir'], exist_ok=True)
+            archive_class = ARCHIVE_FORMATS[options['format']]
+            path = os.path.join(
+                options['archive_dir'],
+                f"results-before-{cutoff:%Y%m%d}-{timezone.now():%Y%m%dT%H%M%S}.{archive_class.extension}",
+            )
+            archive = archive_class(path)
+            try:
+                archived = self._archive_and_delete(old_results, archive, options['batch_size'], options['pause'])
+            finally:
+                archive.close()
+            self.stdout.write(f"Archived and deleted {archived} results to {path}")
+            # A quantile sketch can't forget values, so the peer statistics are
+            # recomputed from the results that are left
+            counts = PeerStatistic.rebuild()
+            self.stdout.write(f"Rebuilt peer statistics over {max(counts.values(), default=0)} results")
+        else:
+            self.stdout.write(f"No results older than {cutoff:%Y-%m-%d}.")
+
+        if connection.vendor == 'sqlite' and options['vacuum'] != 'none':
+            self._vacuum(options['vacuum'], options['pause'])
+        self.stdout.write(self.style.SUCCESS("Done."))
+
+    def _archive_and_delete(self, queryset, archive, batch_size, pause):
+        """
+        Walk the old results in id order, archiving each batch before deleting it in its
+        own short transaction. Reads happen outside any transaction, so live requests
+        only ever wait for one batch delete.
+        """
+        fields = [field.attname for field in Result._meta.concrete_fields]
+        last_id = 0
+        total = 0
+        while True:
+            rows = list(queryset.filter(id__gt=last_id).order_by('id').values(*fields)[:batch_size])
+            if not rows:
+                return total
+            archive.write(rows)
+            ids = [row['id'] for row in rows]
+            with transaction.atomic():
+                Result.objects.filter(id__in=ids).delete()
+            total += len(rows)
+            last_id = ids[-1]
+            self.stdout.write(f"  {total} results archived", ending='\r')
+            self.stdout.flush()
+            if pause:
+                time.sleep(pause)
+
+    def _vacuum(self, mode, pause):
+        with connection.cursor() as cursor:
+            size_before = self._database_size(cursor)
+            if mode == 'full':
+                # auto_vacuum can only be changed before a VACUUM
+                cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                cursor.execute("VACUUM")
+            else:
+                cursor.execute("PRAGMA auto_vacuum")
+                if cursor.fetchone()[0] != 2:
+                    self.stdout.write(
+                        "The database is not in incremental auto-vacuum mode; run once with "
+                        "--vacuum full (when traffic is low) to enable it. Freed pages are reused meanwhile."
+                    )
+                    return
+                while True:
+                    cursor.execute("PRAGMA freelist_count")
+                    if cursor.fetchone()[0] == 0:
+                        break
+                    cursor.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})")
+                    cursor.fetchall()
+                    if pause:
+                        time.sleep(pause)
+            cursor.execute("PRAGMA journal_mode")
+            if cursor.fetchone()[0] == 'wal':
+                cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            size_after = self._database_size(cursor)
+        self.stdout.write(f"Database size {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB")
+
+    @staticmethod
+    def _database_size(cursor):
+        cursor.execute("PRAGMA page_count")
+        page_count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_size")
+        return page_count * cursor.fetchone()[0]
@@ -0,0 +1,343 @@
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Scenario: (method, path, share of requests)
+SCENARIOS = {
+    'index': ('GET', '/', 20),
+    'manual': ('GET', '/manual', 10),
+    'results_manual': ('POST', '/results', 20),
+    'results_pdf': ('POST', '/results', 5),
+    'results_get': ('GET', '/results', 20),
+    'ccs_methods': ('GET', '/ccs_methods', 15),
+    'map': ('GET', '/map', 10),
+}
+
+RESULT_ID_RE = re.compile(rb'Analysis Results \(ID: (\d+)\)')
+CSRF_FIELD_RE = re.compile(rb'name="csrfmiddlewaretoken" value="([^"]+)"')
+CSRF_COOKIE_RE = re.compile(rb'csrftoken=([^;\s]+)')
+
+FILLER = (
+    "The group continued its work to reduce emissions across operations and the value chain, "
+    "with targets validated against a 1.5 degree pathway."
+)
+
+
+def _pdf_string(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def fixture_pdf(scope1, scope2, scope3, profit, pages=3, seed=0):
+    """
+    A small annual-report-like PDF with the given figures, for the PDF upload path.
+    Every page has a few paragraphs of filler; the figures are on the last page.
+    """
+    page_lines = []
+    for page in range(pages):
+        lines = [f"Annual and sustainability report, page {page + 1} (ref {seed})"]
+        lines += [FILLER] * 12
+        if page == pages - 1:
+            lines += [
+                "Greenhouse gas emissions (tonnes CO2e)",
+                f"Scope 1 emissions: {scope1} tonnes",
+                f"Scope 2 emissions market-based: {scope2} tonnes",
+                f"Scope 3 emissions: {scope3} tonnes",
+                f"Profit before tax MSEK: {profit}",
+            ]
+        page_lines.append(lines)
+
+    page_count = len(page_lines)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + b" ".join(f"{3 + 2 * i} 0 R".encode() for i in range(page_count))
+        + b"] /Count " + str(page_count).encode() + b" >>",
+    ]
+    font_id = 3 + 2 * page_count
+    for i, lines in enumerate(page_lines):
+        text = "BT /F1 9 Tf 12 TL 40 800 Td " + " ".join(f"({_pdf_string(line)}) Tj T*" for line in lines) + " ET"
+        stream = text.encode('latin-1')
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>".encode()
+        )
+        objects.append(b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(pdf)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+class HttpClient:
+    """A minimal HTTP/1.1 client on asyncio streams, one connection per request."""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.cookies = {}
+
+    async def request(self, method, path, body=b'', content_type=None):
+        """
+        Returns:
+            tuple: (status, headers as raw bytes, body).
+        """
+        return await asyncio.wait_for(self._request(method, path, body, content_type), self.timeout)
+
+    async def _request(self, method, path, body, content_type):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            headers = [
+                f"{method} {path} HTTP/1.1",
+                f"Host: {self.host}:{self.port}",
+                "Connection: close",
+                f"Content-Length: {len(body)}",
+            ]
+            if content_type:
+                headers.append(f"Content-Type: {content_type}")
+            if self.cookies:
+                headers.append("Cookie: " + "; ".join(f"{k}={v}" for k, v in self.cookies.items()))
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + body)
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+        head, _, content = response.partition(b"\r\n\r\n")
+        status = int(head.split(b" ", 2)[1])
+        cookie = CSRF_COOKIE_RE.search(head)
+        if cookie:
+            self.cookies['csrftoken'] = cookie.group(1).decode()
+        return status, head, content
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the web app: simulated users request the main pages, submit manual "
+        "input and fixture PDFs (analysed by a stand-in model) and look up results. "
+        "Reports requests/s, latency percentiles and error rates per endpoint and "
+        "writes them to a JSON report. By default a local server with a temporary "
+        "database is started for the run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Test a running server instead, e.g. http://127.0.0.1:8000. "
+                                          "It must have NZC_MOCK_LLM=1 for the PDF requests")
+        parser.add_argument('--concurrency', type=int, default=8, help="Simulated users")
+        parser.add_argument('--duration', type=float, default=20.0, help="Seconds to run")
+        parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+        parser.add_argument('--mock-latency', type=float, default=0.5,
+                            help="Seconds the stand-in model takes per answer (local server only)")
+        parser.add_argument('--pdf-pages', type=int, default=3, help="Pages per fixture PDF")
+        parser.add_argument('--timeout', type=float, default=60.0, help="Seconds before a request counts as failed")
+        parser.add_argument('--output', default='loadtest_report.json', help="Where to write the JSON report")
+        parser.add_argument('--compare', help="An earlier report to compare with")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        server = tmp = None
+        url = options['url']
+        if url is None:
+            tmp = tempfile.mkdtemp(prefix='nzc-loadtest-')
+            server, url = self._start_server(tmp, options['mock_latency'])
+        try:
+            self.stdout.write(f"{options['concurrency']} users for {options['duration']:.0f} s against {url}")
+            results, elapsed = asyncio.run(self._run(url, options))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        report = self._report(results, elapsed, url, options)
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        self._print(report, baseline)
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _start_server(self, tmp, mock_latency):
+        """Start runserver on a free port with a fresh database and the stand-in model."""
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        env = {
+            **os.environ,
+            'NZC_DB_PATH': os.path.join(tmp, 'loadtest.sqlite3'),
+            'NZC_MOCK_LLM': '1',
+            'NZC_MOCK_LLM_LATENCY': str(mock_latency),
+            # Every simulated user comes from 127.0.0.1
+            'NZC_ANALYSIS_RATE_LIMIT': '1000000',
+        }
+        manage = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py')]
+        subprocess.run(manage + ['migrate', '--verbosity', '0'], env=env, check=True)
+        server = subprocess.Popen(manage + ['runserver', f'127.0.0.1:{port}', '--noreload'], env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("The local server exited during startup")
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server, f'http://127.0.0.1:{port}'
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError("The local server didn't start within 30 s")
+
+    async def _run(self, url, options):
+        scenarios = [(name, SCENARIOS[name]) for name in options['scenarios']]
+        weights = [weight for _, (_, _, weight) in scenarios]
+        results = {name: {'latencies': [], 'errors': 0, 'statuses': {}} for name, _ in scenarios}
+        result_ids = []
+        counter = iter(range(10**9))
+
+        async def user(number):
+            client = HttpClient(url, options['timeout'])
+            rng = random.Random(number)
+            # The form pages set the CSRF cookie and carry the matching token
+            _, _, page = await client.request('GET', '/manual')
+            token = CSRF_FIELD_RE.search(page).group(1).decode()
+            while time.monotonic() < deadline:
+                name, (method, path, _) = rng.choices(scenarios, weights)[0]
+                body, content_type = b'', None
+                if name == 'results_manual':
+                    # Some repeated inputs, like users resubmitting
+                    values = [rng.randint(0, 50) if rng.random() < 0.2 else rng.randint(0, 10**6) for _ in range(4)]
+                    body = urlencode({'csrfmiddlewaretoken': token, 'scope1': values[0], 'scope2': values[1],
+                                      'scope3': values[2], 'profit': values[3] + 1}).encode()
+                    content_type = 'application/x-www-form-urlencoded'
+                elif name == 'results_pdf':
+                    pdf = fixture_pdf(*(rng.randint(1, 10**6) for _ in range(4)), pages=options['pdf_pages'],
+                                      seed=next(counter))
+                    body, content_type = self._multipart(token, pdf)
+                elif name == 'results_get':
+                    if not result_ids:
+                        continue
+                    path = f"/results?id={rng.choice(result_ids)}"
+
+                start = time.perf_counter()
+                try:
+                    status, _, content = await client.request(method, path, body, content_type)
+                except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                    status, content = 'failed', b''
+                elapsed = time.perf_counter() - start
+
+                stats = results[name]
+                stats['statuses'][str(status)] = stats['statuses'].get(str(status), 0) + 1
+                if status == 200:
+                    stats['latencies'].append(elapsed)
+                    match = RESULT_ID_RE.search(content) if method == 'POST' else None
+                    if match:
+                        result_ids.append(int(match.group(1)))
+                else:
+                    stats['errors'] += 1
+
+        deadline = time.monotonic() + options['duration']
+        start = time.monotonic()
+        await asyncio.gather(*(user(number) for number in range(options['concurrency'])))
+        return results, time.monotonic() - start
+
+    @staticmethod
+    def _multipart(token, pdf):
+        boundary = f'----nzc{random.getrandbits(64):x}'
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="csrfmiddlewaretoken"\r\n\r\n{token}\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="report.pdf"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n'
+        ).encode() + pdf + f'\r\n--{boundary}--\r\n'.encode()
+        return body, f'multipart/form-data; boundary={boundary}'
+
+    @staticmethod
+    def _summary(latencies, errors, statuses, elapsed):
+        count = len(latencies) + errors
+
+        def ms(q):
+            value = percentile(latencies, q)
+            return None if value is None else round(value * 1000, 1)
+
+        return {
+            'requests': count,
+            'errors': errors,
+            'error_rate': round(errors / count, 4) if count else 0.0,
+            'requests_per_s': round(count / elapsed, 2),
+            'p50_ms': ms(50),
+            'p95_ms': ms(95),
+            'p99_ms': ms(99),
+            'statuses': statuses,
+        }
+
+    def _report(self, results, elapsed, url, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                    capture_output=True, text=True).stdout.strip() or None
+        except OSError:
+            commit = None
+        scenarios = {
+            name: self._summary(stats['latencies'], stats['errors'], stats['statuses'], elapsed)
+            for name, stats in results.items()
+        }
+        statuses = {}
+        for stats in results.values():
+            for status, count in stats['statuses'].items():
+                statuses[status] = statuses.get(status, 0) + count
+        total = self._summary([latency for stats in results.values() for latency in stats['latencies']],
+                              sum(stats['errors'] for stats in results.values()), statuses, elapsed)
+        return {
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': commit,
+            'target': url if options['url'] else 'local',
+            'concurrency': options['concurrency'],
+            'duration_s': round(elapsed, 1),
+            'mock_latency_s': None if options['url'] else options['mock_latency'],
+            'scenarios': scenarios,
+            'total': total,
+        }
+
+    def _print(self, report, baseline):
+        def fmt(value):
+            return f"{value:9.1f}" if value is not None else f"{'-':>9}"
+
+        self.stdout.write(f"\n{'endpoint':<15} {'requests':>8} {'req/s':>8} {'errors':>7} "
+                          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        rows = list(report['scenarios'].items()) + [('total', report['total'])]
+        for name, s in rows:
+            line = (f"{name:<15} {s['requests']:8d} {s['requests_per_s']:8.1f} {s['error_rate']:7.1%} "
+                    f"{fmt(s['p50_ms'])} {fmt(s['p95_ms'])} {fmt(s['p99_ms'])}")
+            old = baseline['total'] if baseline and name == 'total' else (baseline or {}).get('scenarios', {}).get(name)
+            if old and old.get('requests_per_s') and s['p95_ms'] is not None and old.get('p95_ms'):
+                line += (f"   vs {baseline.get('commit') or 'baseline'}: "
+                         f"{s['requests_per_s'] / old['requests_per_s'] - 1:+.0%} req/s, "
+                         f"{s['p95_ms'] / old['p95_ms'] - 1:+.0%} p95")
+            self.stdout.write(line)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from NZC.models import PeerStatistic
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the peer statistics shown on the results page from all stored results. "
+        "Run after importing results with bulk_create or deleting results by hand "
+        "(compact_results rebuilds them itself)."
+    )
+
+    def handle(self, *args, **options):
+        counts = PeerStatistic.rebuild()
+        for metric, count in counts.items():
+            self.stdout.write(f"{metric:<10} {count:8d} results")
+        self.stdout.write(self.style.SUCCESS("Peer statistics rebuilt."))
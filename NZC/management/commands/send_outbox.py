@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from NZC.outbox import OutboxSender
+
+
+class Command(BaseCommand):
+    help = (
+        "Send the emails queued in the outbox (see NZC/outbox.py). Runs until stopped, "
+        "checking for due emails every --interval seconds; --once sends what is due and exits, "
+        "e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Send what is due now and exit.")
+        parser.add_argument('--interval', type=float, default=settings.OUTBOX_POLL_INTERVAL,
+                            help="Seconds between checks for due emails (default: %(default)s).")
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE,
+                            help="Emails sent per batch over one connection (default: %(default)s).")
+
+    def handle(self, *args, **options):
+        sender = OutboxSender(batch_size=options['batch_size'])
+        try:
+            while True:
+                if sender.send_due():
+                    self.stdout.write(f"sent {sender.sent}, retrying {sender.retried}, failed {sender.failed}")
+                if options['once']:
+                    break
+                # Nothing to send for a while: don't keep the SMTP connection open
+                sender.close()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sender.close()
+        self.stdout.write(self.style.SUCCESS(
+            f"Outbox: {sender.sent} sent, {sender.retried} to retry, {sender.failed} failed."))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+MODES = ['wal', 'delete']
+
+
+class Command(BaseCommand):
+    help = (
+        "Switch the SQLite database to another journal mode. The mode is stored in the "
+        "database file, so this is run once per database (e.g. when deploying), not on "
+        "every connection. WAL lets readers run while a write is in progress; 'delete' "
+        "is SQLite's default."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('mode', nargs='?', default='wal', choices=MODES)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("Journal modes are a SQLite setting")
+        with connection.cursor() as cursor:
+            # Can't run inside a transaction; Django's connection is in autocommit here
+            cursor.execute(f"PRAGMA journal_mode={options['mode']}")
+            mode = cursor.fetchone()[0]
+        if mode != options['mode']:
+            raise CommandError(f"SQLite kept journal mode {mode} (is another process using the database?)")
+        if options['verbosity'] > 0:
+            self.stdout.write(self.style.SUCCESS(f"Journal mode of {connection.settings_dict['NAME']} is now {mode}."))
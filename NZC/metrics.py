@@ -0,0 +1,157 @@
+"""
+metrics.py
+
+Lightweight in-process instrumentation: latency histograms and counters kept in
+memory and exposed in the Prometheus text format at /metrics, plus the timings of
+the stages of the current request for the Server-Timing header (see
+middleware.ServerTimingMiddleware).
+
+Wrap a stage with timed, as a context manager or a decorator:
+
+    with timed('render'):
+        ...
+
+Every process keeps its own numbers, so with several workers each scrape of
+/metrics shows the worker that answered it.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds in seconds; LLM calls and PDF analysis can take tens of seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels: [count per bucket (last is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'nzc_request_duration_seconds', 'Time to handle a request, by view.', ('view', 'method'))
+REQUESTS = Counter(
+    'nzc_requests_total', 'Handled requests, by view and status code.', ('view', 'method', 'status'))
+STAGE_DURATION = Histogram(
+    'nzc_stage_duration_seconds', 'Time spent in a stage of request handling.', ('stage',))
+CACHE_LOOKUPS = Counter(
+    'nzc_cache_lookups_total', 'Lookups of stored results and other caches, by outcome (hit or miss).',
+    ('cache', 'outcome'))
+LLM_CALLS = Counter(
+    'nzc_llm_calls_total', 'Calls to the language model, by outcome (ok or error).', ('outcome',))
+LLM_PROMPT_TOKENS = Histogram(
+    'nzc_llm_prompt_tokens', 'Tokens of report text sent to the language model per analysis.', (),
+    buckets=(250, 500, 1000, 1500, 2000, 4000, 8000, 16000))
+ADMISSIONS = Counter(
+    'nzc_analysis_admissions_total',
+    'PDF analyses by admission outcome (immediate, queued, rate_limited, queue_full, queue_timeout).',
+    ('outcome',))
+
+METRICS = [REQUEST_DURATION, REQUESTS, STAGE_DURATION, CACHE_LOOKUPS, LLM_CALLS, LLM_PROMPT_TOKENS, ADMISSIONS]
+
+# (stage, seconds) of the request being handled, or None outside a request
+_request_stages = ContextVar('request_stages', default=None)
+
+
+@contextmanager
+def timed(stage):
+    """Time a stage, for the stage histogram and the current request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_DURATION.observe(duration, stage)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((stage, duration))
+
+
+def start_request():
+    """Start collecting stage timings; returns a token for finish_request."""
+    return _request_stages.set([])
+
+
+def finish_request(token):
+    """
+    Stop collecting stage timings.
+
+    Returns:
+        list: (stage, seconds) pairs, a stage that ran several times summed, in the
+              order the stages first ran.
+    """
+    stages = _request_stages.get() or []
+    _request_stages.reset(token)
+    totals = {}
+    for stage, duration in stages:
+        totals[stage] = totals.get(stage, 0) + duration
+    return list(totals.items())
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,151 @@
+import cProfile
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from . import profiling
+from .metrics import REQUEST_DURATION, REQUESTS, finish_request, start_request
+
+
+class ServerTimingMiddleware:
+    """
+    Record how long every request takes, per view, and add a Server-Timing header
+    with the time of each stage (see metrics.timed) and the total, so the browser's
+    developer tools show where a slow request spent its time. Works both under WSGI
+    and, without a thread per request, under ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            total = time.perf_counter() - start
+            stages = finish_request(token)
+        return self._record(request, response, total, stages)
+
+    async def __acall__(self, request):
+        token = start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            total = time.perf_counter() - start
+            stages = finish_request(token)
+        return self._record(request, response, total, stages)
+
+    def _record(self, request, response, total, stages):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        REQUEST_DURATION.observe(total, view, request.method)
+        REQUESTS.inc(view, request.method, str(response.status_code))
+
+        timings = [f'{stage};dur={duration * 1000:.1f}' for stage, duration in stages]
+        timings.append(f'total;dur={total * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(timings)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profile the rest of the request handling with cProfile when a staff user asks for
+    it or the request is sampled, and store the profile (see profiling.py). Always
+    installed, so a live request can be profiled without a restart; a request without
+    the query parameter or header costs two dictionary lookups when sampling is off,
+    and the user is only loaded for requests that ask. Must come after
+    AuthenticationMiddleware.
+
+    Only one request per process is profiled at a time, under WSGI as well as ASGI:
+    Python allows one active profiler at a time from 3.12 on, and cProfile follows a
+    thread, not a coroutine, so under ASGI a profile also contains whatever else the
+    event loop ran meanwhile. A request due for a profile while another one is being
+    profiled is served without one.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        # Held while a request is profiled
+        self._profiling = threading.Lock()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _trigger(self, requested):
+        if requested:
+            return 'request'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sample'
+        return None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sample_rate and not profiling.asks(request):
+            return self.get_response(request)
+        trigger = self._trigger(profiling.requested(request))
+        if trigger is None or not self._profiling.acquire(blocking=False):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        started_at = timezone.now()
+        start = time.perf_counter()
+        try:
+            response = profiler.runcall(self.get_response, request)
+        finally:
+            self._profiling.release()
+        duration = time.perf_counter() - start
+        return self._save(request, response, profiler, started_at, duration, trigger)
+
+    async def __acall__(self, request):
+        if not self.sample_rate and not profiling.asks(request):
+            return await self.get_response(request)
+        trigger = self._trigger(await profiling.arequested(request))
+        if trigger is None or not self._profiling.acquire(blocking=False):
+            return await self.get_response(request)
+
+        profiler = cProfile.Profile()
+        started_at = timezone.now()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+            self._profiling.release()
+        duration = time.perf_counter() - start
+        return await sync_to_async(self._save)(request, response, profiler, started_at, duration, trigger)
+
+    def _save(self, request, response, profiler, started_at, duration, trigger):
+        match = getattr(request, 'resolver_match', None)
+        user = getattr(request, 'user', None)
+        name = profiling.save_profile(profiler, {
+            'created_at': started_at.isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'trigger': trigger,
+            'user': user.get_username() if user and user.is_authenticated else None,
+        })
+        if trigger == 'request':
+            response['X-Profile-Name'] = name
+        return response
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:51
+
+import math
+
+from django.db import migrations, models
+
+# Version 1 of the price table and the calculation, copied from NZC/costs.py when
+# snapshots were added. Frozen here: the migration must keep computing what the
+# results were shown with, whatever costs.py says later.
+PRICE_TABLE_V1 = {
+    'Direct Air Capture': (100, 345),      # USD per ton of CO₂
+    'Biochar': (10, 345),
+    'Reforestation': (5, 240),
+    'Enhanced Weathering': (50, 200),
+    'BECCS': (15, 400),
+    'Soil carbon sequestration': (45, 100)
+}
+SEK_PER_USD_V1 = 10
+SCOPES = ('scope1', 'scope2', 'scope3')
+
+
+def _tsek(tons, sek_per_ton):
+    return math.ceil(tons * sek_per_ton / 1_000)
+
+
+def snapshot_v1(data):
+    profit = data.get('profit')
+    profit_tsek = profit * 1000 if isinstance(profit, (int, float)) and profit != 0 else None
+    total_tons = sum(data[scope] for scope in SCOPES)
+
+    methods = {}
+    for method, (low, high) in PRICE_TABLE_V1.items():
+        price = [low * SEK_PER_USD_V1, high * SEK_PER_USD_V1]
+        total = [_tsek(total_tons, price[0]), _tsek(total_tons, price[1])]
+        if profit_tsek:
+            percent = [round((cost / profit_tsek) * 100, 1) if cost else "-" for cost in total]
+        else:
+            percent = ["-", "-"]
+        methods[method] = {
+            'price_per_ton': price,
+            **{scope: [_tsek(data[scope], price[0]), _tsek(data[scope], price[1])] for scope in SCOPES},
+            'total': total,
+            'profit_total_percent': percent,
+        }
+    return {'version': 1, 'methods': methods}
+
+
+def add_cost_snapshots(apps, schema_editor):
+    # Existing results were shown with the first price table, so that is what they keep
+    Result = apps.get_model('NZC', 'Result')
+    for result in Result.objects.filter(cost_snapshot__isnull=True).iterator(chunk_size=500):
+        result.cost_snapshot = snapshot_v1(
+            {'scope1': result.scope1, 'scope2': result.scope2, 'scope3': result.scope3, 'profit': result.profit})
+        result.save(update_fields=['cost_snapshot'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NZC', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='cost_snapshot',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(fields=['created_at'], name='NZC_result_created_271345_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(fields=['pdfname'], name='NZC_result_pdfname_fe0f84_idx'),
+        ),
+        migrations.RunPython(add_cost_snapshots, migrations.RunPython.noop),
+    ]
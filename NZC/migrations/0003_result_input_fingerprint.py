@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:54
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def add_fingerprints(apps, schema_editor):
+    # Manual results can be fingerprinted from their numbers (see models.input_fingerprint),
+    # the oldest of identical ones becomes the one that is reused. PDFs weren't kept, so
+    # results from PDFs stay without a fingerprint.
+    Result = apps.get_model('NZC', 'Result')
+    seen = set()
+    for result in Result.objects.filter(pdfname__isnull=True).order_by('id').iterator(chunk_size=500):
+        version = (result.cost_snapshot or {}).get('version', 1)
+        fingerprint = hashlib.sha256(
+            f"prices-v{version}:manual:{result.scope1}:{result.scope2}:{result.scope3}:{result.profit}".encode()
+        ).hexdigest()
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        result.input_fingerprint = fingerprint
+        result.save(update_fields=['input_fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NZC', '0002_result_cost_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='input_fingerprint',
+            field=models.CharField(max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(add_fingerprints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:57
+
+import math
+import random
+
+from django.db import migrations, models
+
+# The summaries as NZC/peer_stats.py built them when the table was added, copied here
+# so later changes to peer_stats.py don't change what this migration writes. Sketch
+# format 1: {'k': k, 'n': values added, 'compactors': [[level 0 values], ...]}, where
+# a value on level h stands for 2**h of the values added (a KLL sketch).
+METRICS_V1 = ('scope1', 'scope2', 'scope3', 'total', 'intensity')
+SKETCH_K_V1 = 200
+
+
+def result_metrics_v1(data):
+    values = {scope: data[scope] for scope in ('scope1', 'scope2', 'scope3')}
+    values['total'] = sum(values.values())
+    profit = data['profit']
+    if isinstance(profit, (int, float)) and profit > 0:
+        values['intensity'] = values['total'] / profit
+    return values
+
+
+def _capacity_v1(compactors, level):
+    depth = len(compactors) - level - 1
+    return int(math.ceil((2 / 3) ** depth * SKETCH_K_V1)) + 1
+
+
+def _sketch_add_v1(compactors, value):
+    compactors[0].append(float(value))
+    while sum(map(len, compactors)) >= sum(_capacity_v1(compactors, level) for level in range(len(compactors))):
+        for level, items in enumerate(compactors):
+            if len(items) >= _capacity_v1(compactors, level):
+                if level + 1 == len(compactors):
+                    compactors.append([])
+                items.sort()
+                keep, pairs = items[:len(items) % 2], items[len(items) % 2:]
+                compactors[level + 1].extend(pairs[random.getrandbits(1)::2])
+                compactors[level] = keep
+                break
+
+
+def summarize_v1(rows):
+    """Count, mean, m2 (Welford), minimum, maximum and sketch per metric."""
+    summaries = {metric: {'count': 0, 'mean': 0.0, 'm2': 0.0, 'minimum': None, 'maximum': None,
+                          'compactors': [[]]} for metric in METRICS_V1}
+    for data in rows:
+        for metric, value in result_metrics_v1(data).items():
+            summary = summaries[metric]
+            summary['count'] += 1
+            delta = value - summary['mean']
+            summary['mean'] += delta / summary['count']
+            summary['m2'] += delta * (value - summary['mean'])
+            summary['minimum'] = value if summary['minimum'] is None else min(summary['minimum'], value)
+            summary['maximum'] = value if summary['maximum'] is None else max(summary['maximum'], value)
+            _sketch_add_v1(summary['compactors'], value)
+    return summaries
+
+
+def build_statistics(apps, schema_editor):
+    # Same as PeerStatistic.rebuild at the time, on the historical models
+    Result = apps.get_model('NZC', 'Result')
+    PeerStatistic = apps.get_model('NZC', 'PeerStatistic')
+    rows = Result.objects.values('scope1', 'scope2', 'scope3', 'profit').iterator(chunk_size=2000)
+    PeerStatistic.objects.bulk_create(
+        PeerStatistic(metric=metric, count=summary['count'], mean=summary['mean'], m2=summary['m2'],
+                      minimum=summary['minimum'], maximum=summary['maximum'],
+                      sketch={'k': SKETCH_K_V1, 'n': summary['count'], 'compactors': summary['compactors']})
+        for metric, summary in summarize_v1(rows).items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('NZC', '0003_result_input_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeerStatistic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=20, unique=True)),
+                ('count', models.IntegerField(default=0)),
+                ('mean', models.FloatField(default=0)),
+                ('m2', models.FloatField(default=0)),
+                ('minimum', models.FloatField(null=True)),
+                ('maximum', models.FloatField(null=True)),
+                ('sketch', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(build_statistics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,98 @@
+"""
+mock_llm.py
+
+Local stand-ins for the OpenAI chat model and embeddings, used by pdf_analyzer when
+NZC_MOCK_LLM=1 so the PDF path runs without an API key or network access, e.g. in
+`manage.py loadtest`. The embeddings hash the words of a text into a fixed-size
+vector, so the similarity search still finds the chunks that share words with the
+queries. The chat model reads the scope and profit figures from the prompt with regular
+expressions and waits NZC_MOCK_LLM_LATENCY seconds (default 0.5) first, in place of
+the API round trip.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from types import SimpleNamespace
+
+from langchain_core.embeddings import Embeddings
+
+NUMBER = r'\D{0,40}?(\d[\d ]*\d|\d)'
+PATTERNS = {
+    'scope_1': re.compile(r'scope\s*1' + NUMBER, re.IGNORECASE),
+    'scope_2': re.compile(r'scope\s*2' + NUMBER, re.IGNORECASE),
+    'scope_3': re.compile(r'scope\s*3' + NUMBER, re.IGNORECASE),
+    'profit_before_tax': re.compile(r'(?:profit before tax|resultat före skatt)' + NUMBER, re.IGNORECASE),
+}
+
+
+class HashingEmbeddings(Embeddings):
+    """Bag-of-words vectors: every word adds 1 to the dimension its hash picks."""
+
+    def __init__(self, size=256):
+        self.size = size
+
+    def embed_query(self, text):
+        vector = [0.0] * self.size
+        for word in re.findall(r'\w+', text.lower()):
+            vector[int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), 'big') % self.size] += 1
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def mock_embeddings():
+    return HashingEmbeddings()
+
+
+def mock_answer(prompt):
+    """The JSON answer analyze_with_gpt asks for, with the first figure found for each key."""
+    # Only the report text, not the instructions before it
+    text = prompt.rsplit('Text att analysera:', 1)[-1]
+    answer = {}
+    for key, pattern in PATTERNS.items():
+        match = pattern.search(text)
+        answer[key] = int(match.group(1).replace(' ', '')) if match else None
+        answer[key.replace('_before_tax', '') + '_year'] = None
+    return json.dumps(answer)
+
+
+def _latency():
+    return float(os.getenv('NZC_MOCK_LLM_LATENCY', 0.5))
+
+
+def _completion(messages):
+    content = mock_answer(messages[-1]['content'])
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class _Completions:
+    def create(self, messages, **kwargs):
+        time.sleep(_latency())
+        return _completion(messages)
+
+
+class _AsyncCompletions:
+    async def create(self, messages, **kwargs):
+        await asyncio.sleep(_latency())
+        return _completion(messages)
+
+
+class MockOpenAIClient:
+    """Answers chat.completions.create like the OpenAI client does."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=_Completions())
+
+
+class MockAsyncOpenAIClient:
+    """Answers chat.completions.create like the async OpenAI client does."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=_AsyncCompletions())
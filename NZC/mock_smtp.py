@@ -0,0 +1,123 @@
+"""
+mock_smtp.py
+
+A local stand-in for an SMTP server, to try the email outbox (see outbox.py)
+without a mail account: it accepts every message and keeps it in memory instead of
+delivering it. It can also answer the next messages with a temporary failure, to
+see the sender retry.
+
+Run it next to `manage.py send_outbox` with EMAIL_HOST=localhost EMAIL_PORT=1025:
+
+    python -m NZC.mock_smtp 1025
+
+or start one in-process:
+
+    with MockSMTPServer() as server:
+        ...  # settings.EMAIL_PORT = server.port
+        server.messages  # [(sender, recipients, raw message bytes), ...]
+"""
+
+import socketserver
+import sys
+import threading
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server.mock
+        with server.lock:
+            server.connections += 1
+        self.reply('220 localhost mock SMTP')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.decode('utf-8', 'replace').strip().partition(' ')
+            command = command.upper()
+            if command == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command == 'HELO' or command == 'NOOP':
+                self.reply('250 OK')
+            elif command == 'MAIL':
+                sender, recipients = argument.split(':', 1)[-1].strip(' <>'), []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                recipients.append(argument.split(':', 1)[-1].strip(' <>'))
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = bytearray()
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                    data += line[1:] if line.startswith(b'..') else line
+                with server.lock:
+                    failing = server.fail_next > 0
+                    if failing:
+                        server.fail_next -= 1
+                    else:
+                        server.messages.append((sender, recipients, bytes(data)))
+                self.reply('451 Temporary failure, try again later' if failing else '250 Queued')
+            elif command == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockSMTPServer:
+    """An SMTP server on localhost in a background thread; port 0 picks a free port."""
+
+    def __init__(self, port=0):
+        self.messages = []
+        self.connections = 0
+        # Messages to answer with 451 instead of accepting
+        self.fail_next = 0
+        self.lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.mock = self
+        self.port = self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    server = MockSMTPServer(int(sys.argv[1]) if len(sys.argv) > 1 else 1025)
+    print(f"Mock SMTP server on localhost:{server.port}, Ctrl-C to stop")
+    try:
+        server.start()
+        seen = 0
+        while True:
+            threading.Event().wait(1)
+            for sender, recipients, data in server.messages[seen:]:
+                subject = next((line for line in data.decode('utf-8', 'replace').splitlines()
+                                if line.startswith('Subject:')), '')
+                print(f"{sender} -> {', '.join(recipients)}: {subject} ({len(data)} bytes)")
+            seen = len(server.messages)
+    except KeyboardInterrupt:
+        server.stop()
@@ -1,4 +1,33 @@
-from django.db import models
+import hashlib
+
+from django.db import models, transaction
+from django.utils import timezone
+
+from .costs import PRICE_TABLE_VERSION, compute_cost_snapshot
+from .peer_stats import METRICS, MetricSummary, result_metrics, summarize
+
+
+def input_fingerprint(data=None, pdf_file=None):
+    """
+    Identify the input of a calculation, so repeated submissions map to one Result.
+
+    Args:
+        data (dict): Manually entered "scope1", "scope2", "scope3" and "profit".
+        pdf_file (UploadedFile): An uploaded report; its content is hashed instead of data.
+
+    Returns:
+        str: A SHA-256 hex digest. The price-table version is part of it, so new
+             prices give new results.
+    """
+    digest = hashlib.sha256(f"prices-v{PRICE_TABLE_VERSION}:".encode())
+    if pdf_file is not None:
+        digest.update(b"pdf:")
+        for chunk in pdf_file.chunks():
+            digest.update(chunk)
+        pdf_file.seek(0)
+    else:
+        digest.update("manual:{scope1}:{scope2}:{scope3}:{profit}".format(**data).encode())
+    return digest.hexdigest()
 
 # Create your models here.
 class Result(models.Model):
@@ -11,4 +40,176 @@ class Result(models.Model):
 
     pdfname = models.CharField(max_length=100, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    email = models.EmailField(max_length=100, null=True)
\ No newline at end of file
+    email = models.EmailField(max_length=100, null=True)
+
+    # Costs per method and scope with the prices used, see costs.compute_cost_snapshot
+    cost_snapshot = models.JSONField(null=True)
+    # See input_fingerprint; NULL for results saved before fingerprints existed
+    input_fingerprint = models.CharField(max_length=64, unique=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['pdfname']),
+        ]
+
+    def get_cost_snapshot(self):
+        """
+        Return the stored cost snapshot, computing and saving it first for results
+        stored before snapshots existed.
+        """
+        if self.cost_snapshot is None:
+            self.cost_snapshot = compute_cost_snapshot(self.input_data())
+            if self.pk is not None:
+                self.save(update_fields=['cost_snapshot'])
+        return self.cost_snapshot
+
+    async def aget_cost_snapshot(self):
+        """Async variant of get_cost_snapshot."""
+        if self.cost_snapshot is None:
+            self.cost_snapshot = compute_cost_snapshot(self.input_data())
+            if self.pk is not None:
+                await self.asave(update_fields=['cost_snapshot'])
+        return self.cost_snapshot
+
+    def input_data(self):
+        return {'scope1': self.scope1, 'scope2': self.scope2, 'scope3': self.scope3, 'profit': self.profit}
+
+    def save(self, *args, **kwargs):
+        if self.cost_snapshot is None:
+            self.cost_snapshot = compute_cost_snapshot(self.input_data())
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                PeerStatistic.record(self.input_data())
+
+
+class PeerStatistic(models.Model):
+    """
+    Aggregates and a quantile sketch of one metric over all saved results, kept up
+    to date as results are saved (see peer_stats). Results added without save(),
+    e.g. with bulk_create, are only counted after `manage.py rebuild_peer_stats`.
+    """
+    metric = models.CharField(max_length=20, unique=True)
+    count = models.IntegerField(default=0)
+    mean = models.FloatField(default=0)
+    m2 = models.FloatField(default=0)
+    minimum = models.FloatField(null=True)
+    maximum = models.FloatField(null=True)
+    sketch = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def summary(self):
+        return MetricSummary.from_fields(self)
+
+    @classmethod
+    def record(cls, data):
+        """Add one calculation to the statistics. Call inside a transaction."""
+        cls.record_many([data])
+
+    @classmethod
+    def record_many(cls, rows):
+        """Add many calculations at once by merging their summary. Call inside a transaction."""
+        for metric, summary in summarize(rows).items():
+            if summary.count == 0:
+                continue
+            stat, _ = cls.objects.select_for_update().get_or_create(metric=metric)
+            merged = stat.summary()
+            merged.merge(summary)
+            for field, value in merged.as_fields().items():
+                setattr(stat, field, value)
+            stat.save()
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recompute every statistic from the results in the database.
+
+        Returns:
+            dict: Metric name to the number of values it summarises.
+        """
+        rows = Result.objects.values('scope1', 'scope2', 'scope3', 'profit').iterator(chunk_size=2000)
+        summaries = summarize(rows)
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(cls(metric=metric, **summary.as_fields()) for metric, summary in summaries.items())
+        return {metric: summary.count for metric, summary in summaries.items()}
+
+    @classmethod
+    def compare(cls, data, min_count=5):
+        """
+        Compare a calculation with all saved results.
+
+        Args:
+            data (dict): "scope1", "scope2", "scope3" and "profit".
+            min_count (int): Metrics summarising fewer results than this are left out.
+
+        Returns:
+            list: One dict per metric with 'metric', 'label', 'unit', 'value',
+                  'percentile' (share of results below the value, 0-100),
+                  'median' and 'count', in the order of METRICS.
+        """
+        stats = {stat.metric: stat for stat in cls.objects.filter(metric__in=list(METRICS))}
+        return cls._comparison(stats, data, min_count)
+
+    @classmethod
+    async def acompare(cls, data, min_count=5):
+        """Async variant of compare."""
+        stats = {stat.metric: stat async for stat in cls.objects.filter(metric__in=list(METRICS))}
+        return cls._comparison(stats, data, min_count)
+
+    @staticmethod
+    def _comparison(stats, data, min_count):
+        comparison = []
+        for metric, value in result_metrics(data).items():
+            stat = stats.get(metric)
+            if stat is None or stat.count < min_count:
+                continue
+            summary = stat.summary()
+            label, unit = METRICS[metric]
+            comparison.append({
+                'metric': metric,
+                'label': label,
+                'unit': unit,
+                'value': value,
+                'percentile': round(summary.percentile_of(value)),
+                'median': summary.quantile(0.5),
+                'count': summary.count,
+            })
+        return comparison
+
+
+class OutgoingEmail(models.Model):
+    """
+    An email in the outbox. The web app only adds rows here; `manage.py send_outbox`
+    sends them in the background (see outbox.py), so SMTP never slows a request.
+    """
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    to = models.EmailField()
+    subject = models.CharField(max_length=200)
+    body = models.TextField()
+    # The result whose PDF report is attached, if attach_report
+    result = models.ForeignKey(Result, null=True, blank=True, on_delete=models.SET_NULL, related_name='emails')
+    attach_report = models.BooleanField(default=False)
+
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Pending emails are sent from this time on; pushed back after a failed attempt
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.to} ({self.status})"
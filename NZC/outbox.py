@@ -0,0 +1,201 @@
+"""
+outbox.py
+
+Email without SMTP in the request: views queue an OutgoingEmail row (one INSERT)
+and `manage.py send_outbox` sends the queue in the background.
+
+The sender takes up to settings.OUTBOX_BATCH_SIZE due emails at a time and sends
+them over one SMTP connection, which it keeps open while there is more to send. A
+failed email is retried after settings.OUTBOX_RETRY_DELAY seconds, doubling after
+every further failure (with some jitter so retries don't bunch up), until
+settings.OUTBOX_MAX_ATTEMPTS; a permanent refusal (a 5xx answer) fails it at once.
+
+Emails being sent are leased for LEASE seconds, so one that was taken by a sender
+that then crashed is sent again afterwards. On databases with row locks (not
+SQLite) several senders can run side by side; on SQLite run one.
+"""
+
+import logging
+import random
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .costs import cost_tables
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+# Seconds an email is reserved for the sender that took it
+LEASE = 300
+
+# Longest wait between two attempts, in seconds
+MAX_RETRY_DELAY = 6 * 3600
+
+
+def _range(pair):
+    return f"{pair[0]}–{pair[1]}"
+
+
+def queue_result_email(result_object, to, link):
+    """
+    Queue an email with a summary of a result, a link to it and its PDF report.
+
+    Args:
+        result_object (Result): The saved result.
+        to (str): A validated email address.
+        link (str): Absolute URL of the result's page.
+
+    Returns:
+        OutgoingEmail: The queued email.
+    """
+    return OutgoingEmail.objects.create(**_result_email(result_object, result_object.get_cost_snapshot(), to, link))
+
+
+async def aqueue_result_email(result_object, to, link):
+    """Async variant of queue_result_email."""
+    cost_snapshot = await result_object.aget_cost_snapshot()
+    return await OutgoingEmail.objects.acreate(**_result_email(result_object, cost_snapshot, to, link))
+
+
+def _result_email(result_object, cost_snapshot, to, link):
+    costs_per_method, _ = cost_tables(cost_snapshot)
+    lines = [
+        "Hello,",
+        "",
+        "Here are the results of your net zero calculation.",
+        "",
+        f"Scope 1: {result_object.scope1} tCO2e",
+        f"Scope 2: {result_object.scope2} tCO2e",
+        f"Scope 3: {result_object.scope3} tCO2e",
+        f"Profit before tax: {result_object.profit} MSEK",
+        "",
+        "Cost to reach net zero per removal method (TSEK):",
+    ]
+    lines += [f"  {method}: {_range(costs['total'])}" for method, costs in costs_per_method.items()]
+    lines += ["", f"See the full results: {link}", "", "The cost table is attached as a PDF.", "",
+              "Net Zero Calculator"]
+    return {
+        'to': to,
+        'subject': f"Your Net Zero Calculator results (ID: {result_object.id})",
+        'body': "\n".join(lines),
+        'result': result_object,
+        'attach_report': True,
+    }
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt after `attempts` failed ones."""
+    delay = min(settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _message(email, connection):
+    message = EmailMessage(email.subject, email.body, settings.DEFAULT_FROM_EMAIL, [email.to],
+                           connection=connection)
+    if email.attach_report and email.result is not None:
+        # Imported here: only the sender needs the report writer
+        from .exports import result_pdf_chunks
+        message.attach(f"net-zero-result-{email.result.id}.pdf", b"".join(result_pdf_chunks(email.result)),
+                       'application/pdf')
+    return message
+
+
+class OutboxSender:
+    """Sends due outbox emails in batches over a reused SMTP connection."""
+
+    def __init__(self, batch_size=None, max_attempts=None):
+        self.batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+        self.max_attempts = max_attempts or settings.OUTBOX_MAX_ATTEMPTS
+        self.connection = None
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def claim(self):
+        """Lease the next batch of due emails; returns them."""
+        now = timezone.now()
+        with transaction.atomic():
+            emails = list(
+                OutgoingEmail.objects.select_for_update(skip_locked=True)
+                .select_related('result')
+                .filter(status=OutgoingEmail.PENDING, next_attempt_at__lte=now)
+                .order_by('next_attempt_at')[:self.batch_size]
+            )
+            OutgoingEmail.objects.filter(id__in=[email.id for email in emails]).update(
+                next_attempt_at=now + timedelta(seconds=LEASE))
+        return emails
+
+    def _open(self):
+        if self.connection is None:
+            self.connection = get_connection(fail_silently=False)
+        # A connection opened here stays open across send_messages calls
+        self.connection.open()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            finally:
+                self.connection = None
+
+    def _send(self, email):
+        self._open()
+        self.connection.send_messages([_message(email, self.connection)])
+
+    def _failed(self, email, error, permanent):
+        email.attempts += 1
+        email.last_error = f"{type(error).__name__}: {error}"[:2000]
+        if permanent or email.attempts >= self.max_attempts:
+            email.status = OutgoingEmail.FAILED
+            self.failed += 1
+            logger.warning("Giving up on email %s to %s: %s", email.id, email.to, email.last_error)
+        else:
+            email.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(email.attempts))
+            self.retried += 1
+
+    def send_batch(self):
+        """
+        Send one batch of due emails. Every email's outcome is saved as soon as it is
+        known, so a crash later in the batch doesn't send it again after the lease.
+
+        Returns:
+            int: How many emails were due (0 when the outbox is empty).
+        """
+        emails = self.claim()
+        for email in emails:
+            try:
+                self._send(email)
+            except smtplib.SMTPResponseException as e:
+                # 4xx is temporary, 5xx permanent; the connection is still usable unless
+                # the server is closing it (421)
+                self._failed(email, e, permanent=500 <= e.smtp_code < 600)
+                if e.smtp_code == 421:
+                    self.close()
+            except smtplib.SMTPRecipientsRefused as e:
+                self._failed(email, e, permanent=all(code >= 500 for code, _ in e.recipients.values()))
+            except (smtplib.SMTPException, OSError) as e:
+                # Lost or refused connection: retry later on a new one
+                self._failed(email, e, permanent=False)
+                self.close()
+            else:
+                email.status = OutgoingEmail.SENT
+                email.attempts += 1
+                email.sent_at = timezone.now()
+                email.last_error = ''
+                self.sent += 1
+            email.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+        return len(emails)
+
+    def send_due(self):
+        """Send batches until nothing is due; returns how many emails were due."""
+        total = 0
+        while True:
+            count = self.send_batch()
+            total += count
+            if count < self.batch_size:
+                return total
@@ -13,14 +13,70 @@ import os
 from dotenv import load_dotenv
 import openai
 import json
+import asyncio
+import contextvars
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from .context_compression import compress_contexts, count_tokens, merge_spans
+from .metrics import LLM_CALLS, LLM_PROMPT_TOKENS, timed
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client and embeddings
-#client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-#embeddings = OpenAIEmbeddings()
+# NZC_MOCK_LLM=1 replaces OpenAI with local stand-ins, e.g. for load tests
+MOCK_LLM = os.getenv('NZC_MOCK_LLM') == '1'
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    """The OpenAI client, created on first use."""
+    if MOCK_LLM:
+        from .mock_llm import MockOpenAIClient
+        return MockOpenAIClient()
+    return openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+
+@lru_cache(maxsize=None)
+def get_embeddings():
+    """The embedding model for the vector store, created on first use."""
+    if MOCK_LLM:
+        from .mock_llm import mock_embeddings
+        return mock_embeddings()
+    return OpenAIEmbeddings()
+
+# Async clients hold connections bound to the event loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+
+def _for_running_loop(name, factory):
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if name not in clients:
+        clients[name] = factory()
+    return clients[name]
+
+def get_async_openai_client():
+    """The async OpenAI client of the running event loop."""
+    if MOCK_LLM:
+        from .mock_llm import MockAsyncOpenAIClient
+        return _for_running_loop('chat', MockAsyncOpenAIClient)
+    return _for_running_loop('chat', lambda: openai.AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY')))
 
+def get_async_embeddings():
+    """The embedding model for async use in the running event loop."""
+    if MOCK_LLM:
+        return get_embeddings()
+    return _for_running_loop('embeddings', OpenAIEmbeddings)
+
+@lru_cache(maxsize=None)
+def _parse_executor():
+    # PDF parsing is CPU-bound; a few threads keep it off the event loop
+    return ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix='pdf-parse')
+
+async def _run_in_executor(function, *args):
+    """Run a blocking function in the parse executor, keeping the request's context (timings)."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_parse_executor(), context.run, function, *args)
+
+@timed('extract_text')
 def extract_text_from_pdf(pdf_file):
     """
     Extract text and tables from a PDF file.
@@ -50,38 +106,43 @@ def extract_text_from_pdf(pdf_file):
     all_text = "\n".join([line for line in all_text.splitlines() if len(line.strip()) > 10])
     return all_text
 
-def create_vector_store(text):
-    """
-    Create a FAISS vector store from the given text.
-
-    Args:
-        text (str): The text to be split into chunks and embedded.
-
-    Returns:
-        FAISS: A FAISS vector store containing the text chunks and their embeddings.
-    """
-    splitter = RecursiveCharacterTextSplitter(
+@lru_cache(maxsize=None)
+def get_text_splitter():
+    """The splitter for the vector store's chunks, created on first use."""
+    return RecursiveCharacterTextSplitter(
         chunk_size=700,
         chunk_overlap=400,
         separators=[
             "\n\n", "\n", ".", "Scope", "MSEK", "Utsläpp", "Resultat", "|"
-        ]
+        ],
+        # Where every chunk starts in the text, for merging overlapping chunks later
+        add_start_index=True
     )
-    chunks = splitter.split_text(text)
-    return FAISS.from_texts(chunks, embeddings)
 
-def analyze_with_gpt(context):
+def _split_text(text):
+    return get_text_splitter().create_documents([text])
+
+@timed('vector_store')
+def create_vector_store(text):
     """
-    Analyze extracted text using GPT and return structured data in JSON format.
+    Create a FAISS vector store from the given text.
 
     Args:
-        context (str): The text to be analyzed by GPT.
+        text (str): The text to be split into chunks and embedded.
 
     Returns:
-        dict or None: A dictionary containing extracted values (e.g., Scope 1, Scope 2, Scope 3 emissions, and profit),
-                      or None if the analysis fails.
+        FAISS: A FAISS vector store containing the text chunks and their embeddings.
     """
-    prompt = f"""
+    return FAISS.from_documents(_split_text(text), get_embeddings())
+
+async def acreate_vector_store(text):
+    """Async variant of create_vector_store; the embeddings are awaited."""
+    with timed('vector_store'):
+        chunks = await _run_in_executor(_split_text, text)
+        return await FAISS.afrom_documents(chunks, get_async_embeddings())
+
+def _analysis_prompt(context):
+    return f"""
 Analysera text från en årsredovisning på svenska eller engelska och extrahera:
 
 - Scope 1 (direkta utsläpp, i ton CO2e)
@@ -114,71 +175,75 @@ Svara endast med en korrekt JSON-struktur, inget annat.
 Text att analysera:
 {context}
 """
+
+def _chat_request(context):
+    """Keyword arguments for chat.completions.create."""
+    return {
+        'model': "gpt-4-turbo-2024-04-09",  # SNABBARE och BILLIGARE modell
+        'temperature': 0.2,
+        'timeout': 60,
+        'messages': [
+            {"role": "system", "content": "Du är en expert på hållbarhetsrapporter. Följ instruktionerna exakt och svara endast med JSON."},
+            {"role": "user", "content": _analysis_prompt(context)}
+        ]
+    }
+
+@timed('llm')
+def analyze_with_gpt(context):
+    """
+    Analyze extracted text using GPT and return structured data in JSON format.
+
+    Args:
+        context (str): The text to be analyzed by GPT.
+
+    Returns:
+        dict or None: A dictionary containing extracted values (e.g., Scope 1, Scope 2, Scope 3 emissions, and profit),
+                      or None if the analysis fails.
+    """
     try:
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-2024-04-09",  # SNABBARE och BILLIGARE modell
-            temperature=0.2,
-            timeout=60,
-            messages=[
-                {"role": "system", "content": "Du är en expert på hållbarhetsrapporter. Följ instruktionerna exakt och svara endast med JSON."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        return json.loads(response.choices[0].message.content)
+        response = get_openai_client().chat.completions.create(**_chat_request(context))
+        values = json.loads(response.choices[0].message.content)
+        LLM_CALLS.inc('ok')
+        return values
     except Exception as e:
+        LLM_CALLS.inc('error')
         print(f"GPT Error: {str(e)}")
         return None
 
-def extract_info_from_pdf(pdf_file):
-    """
-    Main function to extract and analyze information from a PDF file.
+async def aanalyze_with_gpt(context):
+    """Async variant of analyze_with_gpt, awaiting the API instead of blocking on it."""
+    with timed('llm'):
+        try:
+            response = await get_async_openai_client().chat.completions.create(**_chat_request(context))
+            values = json.loads(response.choices[0].message.content)
+            LLM_CALLS.inc('ok')
+            return values
+        except Exception as e:
+            LLM_CALLS.inc('error')
+            print(f"GPT Error: {str(e)}")
+            return None
 
-    Args:
-        pdf_file (str or file-like object): The path to the PDF file or a file-like object.
+QUERIES = [
+    "scope 1 utsläpp greenhouse gas emissions GHG",
+    "scope 2 indirekta utsläpp market-based electricity emissions",
+    "scope 3 värdekedja supply chain emissions",
+    "vinst före skatt resultat före skatt profit before tax"
+]
+
+def _prompt_context(text, documents):
+    """
+    Merge and compress the retrieved chunks (see context_compression.py).
 
     Returns:
-        dict: A dictionary containing:
-            - 'extracted_values': Extracted Scope 1, Scope 2, Scope 3 emissions, and profit.
-            - 'text_sample': A sample of the extracted text.
-            - 'relevant_contexts': Relevant contexts used for analysis.
+        tuple: (the text sent to GPT, the distinct passages found for the results page)
     """
-    text = extract_text_from_pdf(pdf_file)
-    vectordb = create_vector_store(text)
-    
-    queries = [
-        "scope 1 utsläpp greenhouse gas emissions GHG",
-        "scope 2 indirekta utsläpp market-based electricity emissions",
-        "scope 3 värdekedja supply chain emissions",
-        "vinst före skatt resultat före skatt profit before tax"
-    ]
-    
-    all_contexts = []
-    for query in queries:
-        docs = vectordb.similarity_search(query, k=3)
-        contexts = [doc.page_content for doc in docs]
-        all_contexts.extend(contexts)
-
-    unique_contexts = []
-    for context in all_contexts:
-        if context not in unique_contexts:
-            unique_contexts.append(context)
-
-    # Begränsa textmängden
-    max_tokens = 12000
-    current_length = 0
-    selected_contexts = []
-
-    for context in unique_contexts:
-        context_length = len(context.split())
-        if current_length + context_length <= max_tokens:
-            selected_contexts.append(context)
-            current_length += context_length
-        else:
-            break
-
-    combined_context = "\n\n---\n\n".join(selected_contexts)
-
-    extracted_values = analyze_with_gpt(combined_context)
+    with timed('compress'):
+        passages = merge_spans(text, documents)
+        context = compress_contexts(passages)
+    LLM_PROMPT_TOKENS.observe(count_tokens(context))
+    return context, passages
+
+def _analysis_result(text, unique_contexts, extracted_values):
     # Sätt till '-' om värdet är None
     if extracted_values is None:
         extracted_values = {}
@@ -195,3 +260,50 @@ def extract_info_from_pdf(pdf_file):
         'text_sample': text[:1000],
         'relevant_contexts': unique_contexts
     }
+
+def extract_info_from_pdf(pdf_file):
+    """
+    Main function to extract and analyze information from a PDF file.
+
+    Args:
+        pdf_file (str or file-like object): The path to the PDF file or a file-like object.
+
+    Returns:
+        dict: A dictionary containing:
+            - 'extracted_values': Extracted Scope 1, Scope 2, Scope 3 emissions, and profit.
+            - 'text_sample': A sample of the extracted text.
+            - 'relevant_contexts': Relevant contexts used for analysis.
+    """
+    text = extract_text_from_pdf(pdf_file)
+    vectordb = create_vector_store(text)
+    
+    all_docs = []
+    for query in QUERIES:
+        with timed('similarity_search'):
+            docs = vectordb.similarity_search(query, k=3)
+        all_docs.extend(docs)
+
+    context, unique_contexts = _prompt_context(text, all_docs)
+    extracted_values = analyze_with_gpt(context)
+    return _analysis_result(text, unique_contexts, extracted_values)
+
+async def aextract_info_from_pdf(pdf_file):
+    """
+    Async variant of extract_info_from_pdf for async views. Parsing the PDF runs in
+    a thread pool and the embedding and GPT calls are awaited, so one event loop can
+    have many analyses in flight. Returns the same dictionary.
+    """
+    text = await _run_in_executor(extract_text_from_pdf, pdf_file)
+    vectordb = await acreate_vector_store(text)
+
+    async def search(query):
+        with timed('similarity_search'):
+            return await vectordb.asimilarity_search(query, k=3)
+
+    all_docs = []
+    for docs in await asyncio.gather(*(search(query) for query in QUERIES)):
+        all_docs.extend(docs)
+
+    context, unique_contexts = _prompt_context(text, all_docs)
+    extracted_values = await aanalyze_with_gpt(context)
+    return _analysis_result(text, unique_contexts, extracted_values)
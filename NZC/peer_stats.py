@@ -0,0 +1,214 @@
+"""
+peer_stats.py
+
+Summaries of all stored results, used to show how a result compares to its peers.
+
+Every metric keeps a running count, mean, variance, minimum and maximum plus a KLL
+quantile sketch (Karnin, Lang & Liberty, "Optimal Quantile Approximation in
+Streams"). A sketch holds a bounded number of values however many results have
+been added, so finding a percentile doesn't depend on the size of the Result
+table, and two sketches can be merged, which lets a rebuild summarise the table in
+chunks. Ranks are approximate; with the default k=200 the error is about 1
+percentage point.
+"""
+
+import bisect
+import math
+import random
+
+# Metric name: (label, unit)
+METRICS = {
+    'scope1': ('Scope 1', 'tCO₂e'),
+    'scope2': ('Scope 2', 'tCO₂e'),
+    'scope3': ('Scope 3', 'tCO₂e'),
+    'total': ('Total emissions', 'tCO₂e'),
+    'intensity': ('Emissions intensity', 'tCO₂e/MSEK'),
+}
+
+DEFAULT_K = 200
+
+
+def result_metrics(data):
+    """
+    The metric values of one calculation.
+
+    Args:
+        data (dict): "scope1", "scope2", "scope3" and "profit" (MSEK).
+
+    Returns:
+        dict: Metric name to value. The intensity (total emissions per MSEK of
+              profit) is left out when the profit isn't positive.
+    """
+    values = {scope: data[scope] for scope in ('scope1', 'scope2', 'scope3')}
+    values['total'] = sum(values.values())
+    profit = data.get('profit')
+    if isinstance(profit, (int, float)) and profit > 0:
+        values['intensity'] = values['total'] / profit
+    return values
+
+
+class KLLSketch:
+    """
+    A mergeable quantile sketch. Values are kept in levels ("compactors") where a
+    value on level h stands for 2**h of the values added; a full level is sorted
+    and every other value is moved up one level.
+    """
+
+    def __init__(self, k=DEFAULT_K, n=0, compactors=None):
+        self.k = k
+        self.n = n
+        self.compactors = [list(level) for level in compactors] if compactors else [[]]
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil((2 / 3) ** depth * self.k)) + 1
+
+    def _compress(self):
+        while sum(map(len, self.compactors)) >= sum(map(self._capacity, range(len(self.compactors)))):
+            for level, items in enumerate(self.compactors):
+                if len(items) >= self._capacity(level):
+                    if level + 1 == len(self.compactors):
+                        self.compactors.append([])
+                    items.sort()
+                    # With an odd count the smallest value stays behind
+                    keep, pairs = items[:len(items) % 2], items[len(items) % 2:]
+                    self.compactors[level + 1].extend(pairs[random.getrandbits(1)::2])
+                    self.compactors[level] = keep
+                    break
+
+    def update(self, value):
+        self.compactors[0].append(float(value))
+        self.n += 1
+        self._compress()
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.n += other.n
+        self._compress()
+
+    def _cumulative(self):
+        """Sorted values and the total weight up to and including each of them."""
+        weighted = sorted((value, 1 << level) for level, items in enumerate(self.compactors) for value in items)
+        values, weights, total = [], [], 0
+        for value, weight in weighted:
+            total += weight
+            values.append(value)
+            weights.append(total)
+        return values, weights
+
+    def rank(self, value):
+        """Approximate share (0-1) of the added values below value; ties count half."""
+        if self.n == 0:
+            return None
+        values, weights = self._cumulative()
+        below = bisect.bisect_left(values, value)
+        through = bisect.bisect_right(values, value)
+        weight_below = weights[below - 1] if below else 0
+        weight_through = weights[through - 1] if through else 0
+        return (weight_below + weight_through) / 2 / self.n
+
+    def quantile(self, q):
+        """Approximate value at quantile q (0-1)."""
+        if self.n == 0:
+            return None
+        values, weights = self._cumulative()
+        index = bisect.bisect_left(weights, q * self.n)
+        return values[min(index, len(values) - 1)]
+
+    def to_dict(self):
+        return {'k': self.k, 'n': self.n, 'compactors': self.compactors}
+
+    @classmethod
+    def from_dict(cls, data):
+        if not data:
+            return cls()
+        return cls(data['k'], data['n'], data['compactors'])
+
+
+class MetricSummary:
+    """Running aggregates and a quantile sketch for one metric."""
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, minimum=None, maximum=None, sketch=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2                # Sum of squared differences from the mean
+        self.minimum = minimum
+        self.maximum = maximum
+        self.sketch = sketch or KLLSketch()
+
+    def add(self, value):
+        # Welford's online algorithm
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.sketch.update(value)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.minimum = other.minimum if self.minimum is None else min(self.minimum, other.minimum)
+        self.maximum = other.maximum if self.maximum is None else max(self.maximum, other.maximum)
+        self.sketch.merge(other.sketch)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.count) if self.count else None
+
+    def percentile_of(self, value):
+        """Approximate percentile (0-100) of value among the added values."""
+        rank = self.sketch.rank(value)
+        return None if rank is None else rank * 100
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+    def as_fields(self):
+        """The summary as PeerStatistic field values."""
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'm2': self.m2,
+            'minimum': self.minimum,
+            'maximum': self.maximum,
+            'sketch': self.sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_fields(cls, obj):
+        return cls(obj.count, obj.mean, obj.m2, obj.minimum, obj.maximum, KLLSketch.from_dict(obj.sketch))
+
+
+def summarize(rows, chunk_size=10_000):
+    """
+    Summarise many calculations, one chunk at a time, merging the chunk summaries.
+
+    Args:
+        rows (iterable): Input dicts as taken by result_metrics.
+        chunk_size (int): Rows summarised before merging into the totals.
+
+    Returns:
+        dict: Metric name to MetricSummary, for every metric in METRICS.
+    """
+    totals = {metric: MetricSummary() for metric in METRICS}
+    chunk = {metric: MetricSummary() for metric in METRICS}
+    for i, data in enumerate(rows, 1):
+        for metric, value in result_metrics(data).items():
+            chunk[metric].add(value)
+        if i % chunk_size == 0:
+            for metric, summary in chunk.items():
+                totals[metric].merge(summary)
+            chunk = {metric: MetricSummary() for metric in METRICS}
+    for metric, summary in chunk.items():
+        totals[metric].merge(summary)
+    return totals
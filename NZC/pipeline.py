@@ -0,0 +1,274 @@
+"""
+pipeline.py
+
+The stages that build the supplier map data, from scraping the leaderboard to
+writing static/suppliers.json, and a runner that only redoes what changed.
+
+A stage is skipped when the content hashes of its inputs match the last successful
+run and its outputs are still as that run left them. Stages without inputs scrape a
+website, so they only run when their outputs are missing or a refresh is asked for.
+Stages whose inputs don't depend on each other run in parallel.
+"""
+
+import colorsys
+import csv
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+STATE_FILE = '.pipeline_state.json'
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Args:
+        name (str): Unique stage name.
+        inputs (list): Files (relative to the project root) the stage reads.
+        outputs (list): Files the stage writes.
+        command (list or None): Script and arguments, run with the current Python.
+        function (callable or None): Called with the project root instead of a command.
+    """
+
+    def __init__(self, name, inputs, outputs, command=None, function=None):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.command = command
+        self.function = function
+
+    def run(self, base_dir):
+        if self.function is not None:
+            self.function(base_dir)
+            return ''
+        completed = subprocess.run(
+            [sys.executable, *self.command], cwd=base_dir, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"{' '.join(self.command)} exited with {completed.returncode}:\n{completed.stdout[-2000:]}")
+        return completed.stdout
+
+
+def method_colors(methods):
+    """
+    Give every method its own marker colour, evenly spaced around the colour wheel.
+
+    Args:
+        methods (list): Method names in the order they should get colours.
+
+    Returns:
+        dict: Maps each method to a hex colour such as "#e52d2d".
+    """
+    colors = {}
+    for i, method in enumerate(methods):
+        r, g, b = colorsys.hsv_to_rgb(i / len(methods), 0.8, 0.9)
+        colors[method] = f"#{int(r * 255):02x}{int(g * 255):02x}{int(b * 255):02x}"
+    return colors
+
+
+def build_suppliers_json(base_dir, csv_name='cdr_suppliers_with_coordinates.csv', json_name='static/suppliers.json'):
+    """
+    Write the marker data for the supplier map from the geocoded supplier CSV.
+    Suppliers without coordinates are left out.
+
+    Args:
+        base_dir (str): The project root.
+        csv_name (str): The geocoded CSV, relative to base_dir.
+        json_name (str): Where to write the JSON, relative to base_dir.
+    """
+    with open(os.path.join(base_dir, csv_name), newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    colors = method_colors(list(dict.fromkeys(row['Method'] for row in rows)))
+
+    suppliers = []
+    for row in rows:
+        if not row.get('location'):
+            continue
+        latitude, longitude = (float(value) for value in row['location'].split(','))
+        suppliers.append({
+            'name': row['Name'],
+            'method': row['Method'],
+            'tons_delivered': row['Tons Delivered'],
+            'tons_sold': row['Tons Sold'],
+            'latitude': latitude,
+            'longitude': longitude,
+            'precision': row.get('precision') or 'address',
+            'color': colors[row['Method']],
+            'cdr_link': row['CDR_Link'],
+            'company_link': row['Company_Link'],
+        })
+
+    with open(os.path.join(base_dir, json_name), 'w', encoding='utf-8') as f:
+        json.dump(suppliers, f, indent=2)
+
+
+STAGES = [
+    Stage('leaderboard', [], ['cdr_suppliers_with_links.csv'],
+          command=['supplier_info.py', '--incremental']),
+    Stage('company_links', ['cdr_suppliers_with_links.csv'], ['cdr_suppliers_with_links_and_company.csv'],
+          command=['suppliers_with_links.py', '--incremental']),
+    # Looks up the suppliers the leaderboard stage found, so new ones get an address
+    Stage('locations', ['cdr_suppliers_with_links.csv'], ['company_locations.csv'],
+          command=['cdr-iframe-scraper.py', '--input', 'cdr_suppliers_with_links.csv']),
+    Stage('geocode', ['cdr_suppliers_with_links_and_company.csv', 'company_locations.csv'],
+          ['cdr_suppliers_with_coordinates.csv'],
+          command=['geocode-script.py']),
+    Stage('suppliers_json', ['cdr_suppliers_with_coordinates.csv'], ['static/suppliers.json'],
+          function=build_suppliers_json),
+]
+
+
+def file_hash(path):
+    """Return the SHA-256 of a file's content, or None if it doesn't exist."""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PipelineRunner:
+    """
+    Runs a list of stages in dependency order, skipping up-to-date ones.
+
+    Args:
+        base_dir (str): The project root; stage files are relative to it.
+        stages (list): The stages, by default STAGES.
+        state_file (str): Where hashes and timings of past runs are kept.
+        log (callable): Receives progress messages.
+    """
+
+    def __init__(self, base_dir, stages=None, state_file=STATE_FILE, log=print):
+        self.base_dir = str(base_dir)
+        self.stages = {stage.name: stage for stage in (stages or STAGES)}
+        self.state_path = os.path.join(self.base_dir, state_file)
+        self.log = log
+        self._lock = threading.Lock()
+        self.state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding='utf-8') as f:
+                self.state = json.load(f)
+
+        producers = {output: stage.name for stage in self.stages.values() for output in stage.outputs}
+        self.dependencies = {
+            stage.name: {producers[i] for i in stage.inputs if i in producers}
+            for stage in self.stages.values()
+        }
+
+    def _hashes(self, files):
+        return {name: file_hash(os.path.join(self.base_dir, name)) for name in files}
+
+    def is_up_to_date(self, stage, refresh=False):
+        """
+        Tell whether a stage can be skipped.
+
+        Args:
+            stage (Stage): The stage to check.
+            refresh (bool): Treat stages without inputs (scrapers) as stale.
+
+        Returns:
+            bool: True if the inputs are unchanged since the last successful run and
+                  the outputs are as that run left them. A stage without inputs is up
+                  to date as long as its outputs exist.
+        """
+        if refresh and not stage.inputs:
+            return False
+        outputs = self._hashes(stage.outputs)
+        if any(value is None for value in outputs.values()):
+            return False
+        if not stage.inputs:
+            return True
+        previous = self.state.get(stage.name, {})
+        return previous.get('inputs') == self._hashes(stage.inputs) and previous.get('outputs') == outputs
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _run_stage(self, stage, force, refresh, dry_run):
+        if not force and self.is_up_to_date(stage, refresh):
+            return 'skipped', 0.0
+        if dry_run:
+            return 'would run', 0.0
+
+        self.log(f"▶ {stage.name} started")
+        inputs = self._hashes(stage.inputs)
+        start = time.perf_counter()
+        stage.run(self.base_dir)
+        duration = time.perf_counter() - start
+        with self._lock:
+            self.state[stage.name] = {
+                'inputs': inputs,
+                'outputs': self._hashes(stage.outputs),
+                'finished_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'duration': round(duration, 3),
+            }
+            self._save_state()
+        return 'ran', duration
+
+    def run(self, only=None, force=False, refresh=False, jobs=4, dry_run=False):
+        """
+        Run the pipeline.
+
+        Args:
+            only (list or None): Stage names to consider, by default all of them. Stages
+                outside this list are treated as done.
+            force (bool): Run stages even if they are up to date.
+            refresh (bool): Rerun stages without inputs (the scrapers).
+            jobs (int): Maximum number of stages running at once.
+            dry_run (bool): Only report which stages would run, counting every stage
+                downstream of one that would run.
+
+        Returns:
+            dict: Maps each stage name to (status, seconds), where status is "ran",
+                  "skipped", "would run", "failed" or "blocked" (an upstream stage failed).
+        """
+        pending = [name for name in self.stages if only is None or name in only]
+        report = {}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while pending or running:
+                for name in list(pending):
+                    waiting_on = self.dependencies[name] & (set(pending) | set(running.values()))
+                    if waiting_on:
+                        continue
+                    pending.remove(name)
+                    if any(report.get(dep, ('',))[0] in ('failed', 'blocked') for dep in self.dependencies[name]):
+                        report[name] = ('blocked', 0.0)
+                        self.log(f"✖ {name} blocked by a failed upstream stage")
+                        continue
+                    if dry_run and any(report[dep][0] == 'would run' for dep in self.dependencies[name] if dep in report):
+                        # Its inputs would change before it is checked
+                        report[name] = ('would run', 0.0)
+                        continue
+                    future = pool.submit(self._run_stage, self.stages[name], force, refresh, dry_run)
+                    running[future] = name
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        report[name] = future.result()
+                    except Exception as e:
+                        report[name] = ('failed', 0.0)
+                        self.log(f"✖ {name} failed: {e}")
+                        continue
+                    status, duration = report[name]
+                    if status == 'ran':
+                        self.log(f"✔ {name} finished in {duration:.1f} s")
+        return report
@@ -0,0 +1,132 @@
+"""
+preload.py
+
+The web app builds its read-only state on first use: the PDF analyzer's modules
+(pdfplumber, langchain, FAISS and the OpenAI SDK), text splitter, tokenizer and
+model clients when the first PDF is uploaded, the supplier data when the first
+supplier page or search is requested, and every template when it is first
+rendered. A worker serving only the start page never loads most of it, but the
+first requests after a restart are slow and every worker holds its own copy.
+
+A pre-fork server can call preload() once in the parent process instead: every
+worker then starts warm and shares the loaded data with the parent copy-on-write.
+preload() ends with gc.freeze(), so the garbage collector doesn't touch (and copy)
+those objects in the workers. The app does this on startup when
+settings.PRELOAD_ON_STARTUP is set.
+
+warm_state() tells which parts are loaded in this process, however they got
+loaded; the /ready endpoint reports it.
+"""
+
+import gc
+import importlib
+import logging
+import os
+import sys
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template import engines
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+from .supplier_search import get_supplier_index
+from .suppliers import load_method_tables, load_suppliers
+
+logger = logging.getLogger(__name__)
+
+HEAVY_MODULES = ['NZC.pdf_analyzer']
+
+TEMPLATES = [
+    'index.html', 'about.html', 'pdf.html', 'manual.html', 'results.html', 'map.html', 'ccs_methods.html',
+]
+
+# Outcome of every warm-up step run by preload(): name: {'ms': ..., 'error': ...}
+_steps = {}
+
+
+def _import_modules():
+    for module in HEAVY_MODULES:
+        importlib.import_module(module)
+
+
+def _load_templates():
+    for name in TEMPLATES:
+        get_template(name)
+
+
+def _templates_loaded():
+    # The cached template loader keeps every compiled template by name
+    loader = engines['django'].engine.template_loaders[0]
+    cache = getattr(loader, 'get_template_cache', {})
+    return all(name in cache for name in TEMPLATES)
+
+
+def _load_analysis_tools():
+    from .context_compression import get_encoding
+    pdf_analyzer = importlib.import_module('NZC.pdf_analyzer')
+    pdf_analyzer.get_text_splitter()
+    get_encoding()
+    # The clients only set up their connection pools here; connections are opened per worker
+    if os.getenv('OPENAI_API_KEY') or pdf_analyzer.MOCK_LLM:
+        pdf_analyzer.get_embeddings()
+        pdf_analyzer.get_openai_client()
+
+
+def _analysis_tools_loaded():
+    pdf_analyzer = sys.modules.get('NZC.pdf_analyzer')
+    return pdf_analyzer is not None and pdf_analyzer.get_text_splitter.cache_info().currsize > 0
+
+
+# name: (load, loaded)
+STEPS = {
+    'urls': (lambda: get_resolver().url_patterns, lambda: 'NZC.views' in sys.modules),
+    'modules': (_import_modules, lambda: all(module in sys.modules for module in HEAVY_MODULES)),
+    'analysis_tools': (_load_analysis_tools, _analysis_tools_loaded),
+    'suppliers': (load_suppliers, lambda: load_suppliers.cache_info().currsize > 0),
+    'method_tables': (load_method_tables, lambda: load_method_tables.cache_info().currsize > 0),
+    'supplier_index': (get_supplier_index, lambda: get_supplier_index.cache_info().currsize > 0),
+    'templates': (_load_templates, _templates_loaded),
+}
+
+
+def preload():
+    """
+    Load everything in STEPS. A failing step is logged and reported by warm_state()
+    rather than stopping the app, which then loads it on first use as usual.
+    """
+    for name, (load, _) in STEPS.items():
+        start = time.perf_counter()
+        try:
+            load()
+            error = None
+        except Exception as e:
+            logger.exception("Preloading %s failed", name)
+            error = f"{type(e).__name__}: {e}"
+        _steps[name] = {'ms': round((time.perf_counter() - start) * 1000, 1), 'error': error}
+    # Workers must not inherit open database connections
+    connections.close_all()
+    gc.collect()
+    gc.freeze()
+
+
+def warm_state():
+    """
+    Returns:
+        dict: 'ready' (False if preloading is on and a step failed or hasn't run),
+              'warm' (every step loaded), 'preload' (settings.PRELOAD_ON_STARTUP)
+              and per step whether it is 'loaded' here, with its 'ms' and 'error'
+              if preload() ran it.
+    """
+    steps = {}
+    for name, (_, loaded) in STEPS.items():
+        steps[name] = {'loaded': loaded(), **_steps.get(name, {})}
+    ready = not settings.PRELOAD_ON_STARTUP or (
+        len(_steps) == len(STEPS) and not any(step['error'] for step in _steps.values()))
+    return {
+        'ready': ready,
+        'warm': all(step['loaded'] for step in steps.values()),
+        'preload': settings.PRELOAD_ON_STARTUP,
+        'steps': steps,
+    }
@@ -0,0 +1,118 @@
+"""
+profiling.py
+
+Capture a cProfile profile of single requests in a running site. A staff user asks
+for one by adding ?_profile=1 or the header X-Profile-Request: 1 to a request, and
+a share of all requests can be sampled with settings.PROFILING_SAMPLE_RATE (see
+middleware.ProfilingMiddleware). Every profile is stored in
+settings.PROFILING_DIR as a .prof file (readable with pstats or snakeviz) next to a
+.json file with the request's details; the newest settings.PROFILING_MAX_FILES are
+kept. Staff can list and download them at /admin/profiles/.
+"""
+
+import io
+import json
+import os
+import pstats
+import re
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+
+QUERY_PARAMETER = '_profile'
+HEADER = 'HTTP_X_PROFILE_REQUEST'
+
+PROFILE_NAME_RE = re.compile(r'^\d{8}T\d{6}-[0-9a-f]{8}$')
+
+
+def asks(request):
+    """
+    Whether the request carries the query parameter or header, whoever sent it. The
+    query string is only parsed when it mentions the parameter, so this is cheap
+    enough to run on every request.
+    """
+    if request.META.get(HEADER) == '1':
+        return True
+    return QUERY_PARAMETER in request.META.get('QUERY_STRING', '') and request.GET.get(QUERY_PARAMETER) == '1'
+
+
+def requested(request):
+    """Whether the request asks to be profiled; only staff users may do so."""
+    if not asks(request):
+        return False
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_staff)
+
+
+async def arequested(request):
+    """Async variant of requested; the user is loaded without blocking."""
+    if not asks(request) or not hasattr(request, 'auser'):
+        return False
+    user = await request.auser()
+    return bool(user and user.is_staff)
+
+
+def save_profile(profiler, metadata):
+    """
+    Write a finished profile and its metadata, then remove the oldest profiles
+    beyond PROFILING_MAX_FILES.
+
+    Args:
+        profiler (cProfile.Profile): The disabled profiler.
+        metadata (dict): Details of the request, stored as JSON.
+
+    Returns:
+        str: The profile's name.
+    """
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    name = f"{timezone.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+    profiler.dump_stats(os.path.join(settings.PROFILING_DIR, f'{name}.prof'))
+    with open(os.path.join(settings.PROFILING_DIR, f'{name}.json'), 'w', encoding='utf-8') as f:
+        json.dump({'name': name, **metadata}, f)
+
+    for old in list_profiles()[settings.PROFILING_MAX_FILES:]:
+        for extension in ('prof', 'json'):
+            try:
+                os.remove(os.path.join(settings.PROFILING_DIR, f"{old['name']}.{extension}"))
+            except FileNotFoundError:
+                pass
+    return name
+
+
+def list_profiles():
+    """
+    Returns:
+        list: The metadata of every stored profile, newest first, with its 'size' in bytes.
+    """
+    if not os.path.isdir(settings.PROFILING_DIR):
+        return []
+    profiles = []
+    for filename in os.listdir(settings.PROFILING_DIR):
+        name, extension = os.path.splitext(filename)
+        if extension != '.json' or not PROFILE_NAME_RE.match(name):
+            continue
+        try:
+            with open(os.path.join(settings.PROFILING_DIR, filename), encoding='utf-8') as f:
+                metadata = json.load(f)
+            metadata['size'] = os.path.getsize(os.path.join(settings.PROFILING_DIR, f'{name}.prof'))
+        except (OSError, ValueError):
+            continue
+        profiles.append(metadata)
+    profiles.sort(key=lambda metadata: metadata['created_at'], reverse=True)
+    return profiles
+
+
+def profile_path(name):
+    """The .prof file of a stored profile, or None for an unknown or invalid name."""
+    if not PROFILE_NAME_RE.match(name):
+        return None
+    path = os.path.join(settings.PROFILING_DIR, f'{name}.prof')
+    return path if os.path.exists(path) else None
+
+
+def profile_summary(path, limit=40):
+    """The functions with the most cumulative time, as pstats prints them."""
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
@@ -0,0 +1,268 @@
+"""
+supplier_search.py
+
+In-memory supplier search used for autocomplete. Names are split into tokens and
+stored in a prefix trie whose nodes keep the best ranked suppliers below them, so a
+prefix lookup is a walk down the trie. A trigram index over the token vocabulary
+catches typos when the prefix lookup finds nothing.
+"""
+
+import heapq
+import unicodedata
+from functools import lru_cache
+
+from .suppliers import load_suppliers, parse_tons
+
+# Number of suppliers kept per trie node, i.e. the largest useful search limit
+TOP_K = 25
+# Share of the query's trigrams a vocabulary token must contain to count as a fuzzy match
+FUZZY_THRESHOLD = 0.5
+
+
+def normalize(text):
+    """
+    Lowercase a string, strip accents and replace punctuation with spaces.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The normalized text.
+    """
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    return "".join(ch if ch.isalnum() else " " for ch in text if not unicodedata.combining(ch))
+
+
+def trigrams(token):
+    """
+    Split a token into padded trigrams, e.g. "co2" -> {"  c", " co", "co2", "o2 "}.
+
+    Args:
+        token (str): A normalized token.
+
+    Returns:
+        set: The trigrams of the token.
+    """
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _TrieNode:
+    __slots__ = ('children', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.top = []
+
+
+class SupplierIndex:
+    """
+    Prefix and fuzzy search over supplier names.
+
+    Suppliers are ranked by tons delivered, then tons sold, and every list inside the
+    index stores ranks instead of ids, so merging and sorting are plain integer
+    operations.
+    """
+
+    def __init__(self, suppliers, top_k=TOP_K):
+        """
+        Build the index.
+
+        Args:
+            suppliers (list): Dictionaries with at least 'name' or 'Name'. Optional keys
+                are 'method', 'tons_delivered', 'tons_sold', 'cdr_link' and 'company_link'
+                (or the CSV column names).
+            top_k (int): Number of suppliers kept per trie node.
+        """
+        import numpy as np
+
+        self.top_k = top_k
+        entries = [_entry(supplier) for supplier in suppliers]
+        entries.sort(key=lambda e: (-e['tons_delivered'], -e['tons_sold'], e['name']))
+        self._entries = entries
+
+        self._vocabulary = []
+        self._token_ids = {}
+        self._postings = []
+        self._tokens = []
+        for rank, entry in enumerate(entries):
+            tokens = tuple(dict.fromkeys(normalize(entry['name']).split()))
+            self._tokens.append(tokens)
+            for token in tokens:
+                token_id = self._token_ids.get(token)
+                if token_id is None:
+                    token_id = self._token_ids[token] = len(self._vocabulary)
+                    self._vocabulary.append(token)
+                    self._postings.append([])
+                self._postings[token_id].append(rank)
+
+        self._root = self._build_trie()
+        # Trigram postings are partitioned by first letter: typos rarely hit the first
+        # letter, and it keeps each posting list short
+        trigram_ids = {}
+        for token_id, token in enumerate(self._vocabulary):
+            for gram in trigrams(token):
+                trigram_ids.setdefault((token[0], gram), []).append(token_id)
+        self._trigrams = {key: np.array(ids, dtype=np.int32) for key, ids in trigram_ids.items()}
+        self._token_lengths = np.array([len(token) for token in self._vocabulary], dtype=np.int32)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _build_trie(self):
+        root = _TrieNode()
+        ends = {}
+        for token_id, token in enumerate(self._vocabulary):
+            node = root
+            for ch in token:
+                node = node.children.setdefault(ch, _TrieNode())
+            ends[id(node)] = self._postings[token_id]
+
+        # Fill in the top lists bottom-up, children before parents
+        order = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node.children.values())
+        for node in reversed(order):
+            sources = [child.top for child in node.children.values()]
+            if id(node) in ends:
+                sources.append(ends[id(node)])
+            node.top = _merge_unique(sources, self.top_k)
+        return root
+
+    def _find_node(self, prefix):
+        node = self._root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def _fuzzy_tokens(self, token):
+        """Return vocabulary ids similar to token, best first."""
+        import numpy as np
+
+        grams = trigrams(token)
+        postings = [self._trigrams[key] for key in ((token[0], gram) for gram in grams) if key in self._trigrams]
+        if not postings:
+            return []
+        # Counting with numpy keeps misspellings of common name starts fast, where a
+        # thousand or more tokens share a trigram or two with the query
+        token_ids, counts = np.unique(np.concatenate(postings), return_counts=True)
+        similar = counts >= FUZZY_THRESHOLD * len(grams)
+        token_ids, counts = token_ids[similar], counts[similar]
+        # Most shared trigrams first, then closest in length, then vocabulary order
+        order = np.lexsort((token_ids, np.abs(self._token_lengths[token_ids] - len(token)), -counts))
+        return token_ids[order].tolist()
+
+    def _resolve(self, token):
+        """Return the vocabulary id of token, or of the closest token if it is misspelled."""
+        token_id = self._token_ids.get(token)
+        if token_id is None:
+            similar = self._fuzzy_tokens(token)
+            token_id = similar[0] if similar else None
+        return token_id
+
+    def search(self, query, limit=10):
+        """
+        Search suppliers by name.
+
+        All query words but the last must match a word in the name (typos allowed), the
+        last word is treated as a prefix. If nothing starts with the last word, it is
+        matched fuzzily instead, as long as it has at least three letters.
+
+        Args:
+            query (str): The text typed by the user.
+            limit (int): Maximum number of results, capped at top_k.
+
+        Returns:
+            list: Supplier dictionaries, best first, each with a 'match' key that is
+                  either "prefix" or "fuzzy".
+        """
+        tokens = normalize(query).split()
+        limit = max(0, min(limit, self.top_k))
+        if not tokens or not limit:
+            return []
+        *complete, prefix = tokens
+
+        required = []
+        for token in complete:
+            token_id = self._resolve(token)
+            if token_id is None:
+                return []
+            required.append(token_id)
+
+        if required:
+            # Filter the shortest posting list, which is already in rank order
+            postings = min((self._postings[token_id] for token_id in required), key=len)
+            required = {self._vocabulary[token_id] for token_id in required}
+            candidates = [rank for rank in postings if required.issubset(self._tokens[rank])]
+            ranks = []
+            for rank in candidates:
+                if any(token.startswith(prefix) for token in self._tokens[rank]):
+                    ranks.append(rank)
+                    if len(ranks) == limit:
+                        break
+        else:
+            candidates = None
+            node = self._find_node(prefix)
+            ranks = node.top[:limit] if node else []
+        matches = [dict(self._entries[rank], match='prefix') for rank in ranks]
+
+        if not matches and len(prefix) >= 3:
+            seen = set()
+            similar = self._fuzzy_tokens(prefix)
+            if candidates is None:
+                fuzzy_ranks = (rank for token_id in similar for rank in self._postings[token_id])
+            else:
+                # The other words already narrowed things down, so filter those candidates
+                similar = {self._vocabulary[token_id] for token_id in similar}
+                fuzzy_ranks = (rank for rank in candidates if not similar.isdisjoint(self._tokens[rank]))
+            for rank in fuzzy_ranks:
+                if rank in seen:
+                    continue
+                seen.add(rank)
+                matches.append(dict(self._entries[rank], match='fuzzy'))
+                if len(matches) == limit:
+                    break
+        return matches
+
+
+def _entry(supplier):
+    """
+    Map a supplier dictionary or CSV row onto the fields returned by the search. The
+    tonnages of a CSV row are parsed from its "Tons Delivered" and "Tons Sold" cells.
+    """
+    return {
+        'name': supplier.get('name') or supplier.get('Name', ''),
+        'method': supplier.get('method') or supplier.get('Method', ''),
+        'tons_delivered': supplier.get('tons_delivered', parse_tons(supplier.get('Tons Delivered'))),
+        'tons_sold': supplier.get('tons_sold', parse_tons(supplier.get('Tons Sold'))),
+        'cdr_link': supplier.get('cdr_link') or supplier.get('CDR_Link', ''),
+        'company_link': supplier.get('company_link') or supplier.get('Company_Link', ''),
+    }
+
+
+def _merge_unique(sorted_lists, limit):
+    """Merge ascending lists of ranks and return the first `limit` distinct values."""
+    merged = []
+    for rank in heapq.merge(*sorted_lists):
+        if merged and merged[-1] == rank:
+            continue
+        merged.append(rank)
+        if len(merged) == limit:
+            break
+    return merged
+
+
+@lru_cache(maxsize=None)
+def get_supplier_index():
+    """
+    Return the search index over the app's supplier list, built on first use.
+
+    Returns:
+        SupplierIndex: The shared index.
+    """
+    return SupplierIndex(load_suppliers())
@@ -0,0 +1,134 @@
+"""
+suppliers.py
+
+This module loads the scraped CDR supplier list once per process and exposes it
+as plain dictionaries, so views and indexes don't have to re-read the CSV on
+every request.
+"""
+
+import csv
+import os
+from functools import lru_cache
+
+from django.conf import settings
+
+SUPPLIERS_CSV = 'cdr_suppliers_with_links_and_company.csv'
+
+
+def parse_tons(value):
+    """
+    Parse a tonnage cell from the scraped CSV into an integer.
+
+    The leaderboard formats numbers with (non-breaking) spaces as thousands
+    separators, e.g. "130 012".
+
+    Args:
+        value (str or int or None): The raw cell value.
+
+    Returns:
+        int: The parsed tonnage, or 0 if the cell is empty or not a number.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    digits = "".join(ch for ch in str(value) if ch.isdigit())
+    return int(digits) if digits else 0
+
+
+def read_suppliers(csv_path):
+    """
+    Read suppliers from a CSV file.
+
+    Args:
+        csv_path (str): Path to a CSV with at least the columns Name, Tons Delivered,
+            Tons Sold and Method.
+
+    Returns:
+        list: A list of dictionaries, one per supplier, with the original columns
+              plus 'id', 'tons_delivered' and 'tons_sold' as integers.
+    """
+    suppliers = []
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            row = {(key or '').strip(): (value or '').strip() for key, value in row.items()}
+            if not row.get('Name'):
+                continue
+            row['id'] = len(suppliers)
+            row['tons_delivered'] = parse_tons(row.get('Tons Delivered'))
+            row['tons_sold'] = parse_tons(row.get('Tons Sold'))
+            suppliers.append(row)
+    return suppliers
+
+
+@lru_cache(maxsize=None)
+def load_suppliers():
+    """
+    Load the supplier list used by the web app, cached for the lifetime of the process.
+
+    Returns:
+        list: The suppliers as returned by read_suppliers.
+    """
+    return read_suppliers(os.path.join(settings.BASE_DIR, SUPPLIERS_CSV))
+
+
+CCS_METHODS = [
+    "Biochar Carbon Removal (BCR)",
+    "Enhanced Weathering",
+    "Ex-situ Mineralization",
+    "Direct Air Carbon Capture and Storage (DACCS)",
+    "Bioenergy with Carbon Capture and Storage (BECCS)"
+]
+
+SORT_FIELDS = ('tons_delivered', 'tons_sold', 'name')
+
+
+def _table_row(supplier):
+    return {
+        'name': supplier['Name'],
+        'tons_delivered': supplier['tons_delivered'],
+        'tons_sold': supplier['tons_sold'],
+        'cdr_link': supplier.get('CDR_Link', ''),
+        'company_link': supplier.get('Company_Link', ''),
+    }
+
+
+@lru_cache(maxsize=None)
+def load_method_tables():
+    """
+    Group the suppliers by CCS method, with every sort order and the per-method
+    aggregates computed once when the data is loaded.
+
+    Returns:
+        dict: Maps each method in CCS_METHODS to a dictionary with:
+            - 'orders': Maps (sort field, 'asc' or 'desc') to the sorted rows.
+            - 'aggregates': Supplier count, total tons delivered and sold, and the
+              delivery ratio (delivered / sold, in percent).
+    """
+    suppliers = load_suppliers()
+    tables = {}
+    for method in CCS_METHODS:
+        rows = [_table_row(s) for s in suppliers if s.get('Method') == method]
+        delivered = sum(row['tons_delivered'] for row in rows)
+        sold = sum(row['tons_sold'] for row in rows)
+
+        orders = {}
+        for field in SORT_FIELDS:
+            if field == 'name':
+                ascending = sorted(rows, key=lambda row: row['name'].lower())
+            else:
+                ascending = sorted(rows, key=lambda row: (row[field], row['name'].lower()))
+            orders[(field, 'asc')] = ascending
+            orders[(field, 'desc')] = ascending[::-1]
+
+        tables[method] = {
+            'orders': orders,
+            'aggregates': {
+                'supplier_count': len(rows),
+                'tons_delivered': delivered,
+                'tons_sold': sold,
+                'delivery_ratio': round(delivered / sold * 100, 1) if sold else None,
+            },
+        }
+    return tables
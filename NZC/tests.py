@@ -1,3 +1,1148 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import csv
+import importlib
+import io
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
+from xml.etree import ElementTree
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import OperationalError
+from django.http import HttpResponse
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from calculator1 import calculate_net_zero_cost
+from .admission import ConcurrencyLimiter, Rejected
+from .context_compression import compress_contexts, count_tokens, table_header
+from .costs import (
+    EXACT_FLOAT_INT, REMOVAL_METHODS, SCOPES, SEK_PER_USD, VECTORIZE_FROM, _round1, compute_cost_arrays,
+    compute_cost_snapshot, compute_cost_snapshots, cost_tables,
+)
+from . import admission, async_views, exports, preload, profiling, views
+from .metrics import Counter, Histogram
+from .middleware import ProfilingMiddleware
+from .mock_smtp import MockSMTPServer
+from .models import OutgoingEmail, PeerStatistic, Result, input_fingerprint
+from .outbox import OutboxSender, queue_result_email
+from .peer_stats import KLLSketch
+from .pipeline import PipelineRunner, Stage
+from .supplier_search import SupplierIndex, normalize, trigrams
+from .suppliers import CCS_METHODS, SORT_FIELDS, load_method_tables
+
+# The calculations are checked on many generated companies instead of a few
+# examples: any change that gives another number for one of them fails. Seeds are
+# fixed so a failure can be reproduced.
+SEEDS = range(5)
+
+
+def _tons(rng):
+    # Every order of magnitude equally often, and exact zeros
+    return rng.choice([0, rng.randint(0, 10 ** rng.randint(0, 10))])
+
+
+def _profit(rng):
+    return rng.choice([
+        rng.randint(1, 10 ** rng.randint(0, 7)),
+        -rng.randint(1, 10 ** rng.randint(0, 5)),
+        0, '-', None,
+    ])
+
+
+def companies(rng, count):
+    """Calculation input as the views pass it, with a missing, "-" or zero profit now and then."""
+    rows = []
+    for _ in range(count):
+        data = {scope: _tons(rng) for scope in SCOPES}
+        profit = _profit(rng)
+        if profit is not None:
+            data['profit'] = profit
+        rows.append(data)
+    return rows
+
+
+def api_companies(rng, count):
+    """Companies the API accepts: integer scopes and profit."""
+    return [{**{scope: _tons(rng) for scope in SCOPES}, 'profit': rng.randint(-10 ** 5, 10 ** 7)}
+            for _ in range(count)]
+
+
+class CostCalculationTests(SimpleTestCase):
+    """The scalar, vectorized and calculator1 paths give the same costs."""
+
+    def test_vectorized_snapshots_match_scalar(self):
+        for seed in SEEDS:
+            rows = companies(random.Random(seed), 2000)
+            with self.subTest(seed=seed):
+                self.assertEqual(compute_cost_snapshots(rows), [compute_cost_snapshot(data) for data in rows])
+
+    def test_vectorized_snapshots_match_scalar_for_small_batches(self):
+        rng = random.Random(1)
+        for count in (0, 1, VECTORIZE_FROM - 1, VECTORIZE_FROM):
+            rows = companies(rng, count)
+            with self.subTest(count=count):
+                self.assertEqual(compute_cost_snapshots(rows), [compute_cost_snapshot(data) for data in rows])
+
+    def test_vectorized_snapshots_match_scalar_beyond_float_precision(self):
+        # Such companies are computed one by one, among the others
+        rng = random.Random(2)
+        rows = companies(rng, VECTORIZE_FROM)
+        rows[3]['scope3'] = EXACT_FLOAT_INT
+        rows[7]['profit'] = EXACT_FLOAT_INT
+        rows[11] = {'scope1': 999999999999999999, 'scope2': 999999999999999999, 'scope3': 1, 'profit': 3}
+        self.assertEqual(compute_cost_snapshots(rows), [compute_cost_snapshot(data) for data in rows])
+
+    def test_arrays_match_scalar(self):
+        rows = companies(random.Random(3), 1000)
+        arrays = compute_cost_arrays(
+            *([data[scope] for data in rows] for scope in SCOPES),
+            [data['profit'] if isinstance(data.get('profit'), int) else float('nan') for data in rows])
+        for index, data in enumerate(rows):
+            for method, costs in compute_cost_snapshot(data)['methods'].items():
+                self.assertEqual(list(arrays[method]['price_per_ton']), costs['price_per_ton'])
+                for key in (*SCOPES, 'total'):
+                    self.assertEqual([int(values[index]) for values in arrays[method][key]], costs[key])
+                percent = [float(values[index]) for values in arrays[method]['profit_total_percent']]
+                self.assertEqual(["-" if math.isnan(value) else value for value in percent],
+                                 costs['profit_total_percent'])
+
+    def test_arrays_reject_companies_beyond_float_precision(self):
+        with self.assertRaises(ValueError):
+            compute_cost_arrays([EXACT_FLOAT_INT], [0], [0], [1])
+        with self.assertRaises(ValueError):
+            compute_cost_arrays([1], [0], [0], [EXACT_FLOAT_INT])
+
+    def test_round1_matches_round(self):
+        import numpy as np
+
+        rng = random.Random(4)
+        # Many values end in 5 in the second decimal, where rounding is hardest
+        values = [rng.randint(-10 ** 6, 10 ** 6) / 100 for _ in range(20000)]
+        values += [rng.uniform(-1e6, 1e6) for _ in range(20000)]
+        values += [0.15, 0.25, 0.35, 2.675, 1e17 + 0.5, -0.05, 0.0]
+        rounded = _round1(np, np.array(values))
+        self.assertEqual(rounded.tolist(), [round(value, 1) for value in values])
+
+    def test_snapshot_properties(self):
+        for data in companies(random.Random(5), 2000):
+            for method, costs in compute_cost_snapshot(data)['methods'].items():
+                low, high = REMOVAL_METHODS[method]
+                self.assertEqual(costs['price_per_ton'], [low * SEK_PER_USD, high * SEK_PER_USD])
+                for key in (*SCOPES, 'total'):
+                    self.assertLessEqual(costs[key][0], costs[key][1])
+                for bound in (0, 1):
+                    scope_costs = [costs[scope][bound] for scope in SCOPES]
+                    # Rounded up once for the total, and once per scope
+                    self.assertGreaterEqual(costs['total'][bound], max(scope_costs))
+                    self.assertLessEqual(costs['total'][bound], sum(scope_costs))
+                    self.assertLess(costs['total'][bound] - sum(data[scope] for scope in SCOPES)
+                                    * costs['price_per_ton'][bound] / 1000, 1)
+                profit = data.get('profit')
+                for cost, percent in zip(costs['total'], costs['profit_total_percent']):
+                    if not isinstance(profit, int) or profit == 0 or cost == 0:
+                        self.assertEqual(percent, "-")
+                    else:
+                        self.assertEqual(percent < 0, profit < 0 and percent != 0)
+
+    def test_calculator_agrees_with_snapshot(self):
+        for data in companies(random.Random(6), 2000):
+            snapshot = compute_cost_snapshot(data)
+            for method, costs in snapshot['methods'].items():
+                for bound in (0, 1):
+                    price = costs['price_per_ton'][bound]
+                    result = calculate_net_zero_cost(data, {'name': method, 'cost_per_ton': price})
+                    self.assertEqual(result['total_emissions'], sum(data[scope] for scope in SCOPES))
+                    # SEK in calculator1, whole TSEK rounded up on the results page
+                    self.assertEqual(math.ceil(result['cost_to_offset'] / 1000), costs['total'][bound])
+                    percent = costs['profit_total_percent'][bound]
+                    if percent == "-":
+                        self.assertTrue(result['percentage_of_revenue'] == "-" or result['cost_to_offset'] == 0)
+                    else:
+                        # Apart from rounding: up to 1 TSEK from rounding up, 0.05 and 0.005 percentage points
+                        tolerance = 100 / (abs(data['profit']) * 1000) + 0.055
+                        self.assertAlmostEqual(result['percentage_of_revenue'], percent,
+                                               delta=tolerance + abs(percent) * 1e-12)
+
+    def test_calculator_without_profit(self):
+        method = {'name': 'Biochar', 'cost_per_ton': 100}
+        for data in ({'scope1': 1, 'scope2': 2, 'scope3': 3},
+                     {'scope1': 1, 'scope2': 2, 'scope3': 3, 'profit': 0},
+                     {'scope1': 1, 'scope2': 2, 'scope3': 3, 'profit': '-'}):
+            with self.subTest(data=data):
+                result = calculate_net_zero_cost(data, method)
+                self.assertEqual(result['cost_to_offset'], 600)
+                self.assertEqual(result['percentage_of_revenue'], "-")
+
+
+class CostViewTests(TestCase):
+    """The results page, the API and the exports show the numbers of compute_cost_snapshot."""
+
+    def test_results_page_matches_snapshot(self):
+        rng = random.Random(7)
+        for data in api_companies(rng, 20):
+            data['profit'] = rng.randint(1, 10 ** 6)
+            with self.subTest(data=data):
+                response = self.client.post('/results', data)
+                self.assertEqual(response.status_code, 200)
+                costs_per_method, price_per_ton = cost_tables(compute_cost_snapshot(data))
+                self.assertEqual(response.context['costs_per_method'], costs_per_method)
+                self.assertEqual(response.context['price_per_ton'], price_per_ton)
+
+                # Shown again from the stored snapshot
+                stored = self.client.get('/results', {'id': response.context['result_id']})
+                self.assertEqual(stored.context['costs_per_method'], costs_per_method)
+
+    def test_api_matches_snapshot(self):
+        rng = random.Random(8)
+        for count in (1, VECTORIZE_FROM + 70):
+            rows = api_companies(rng, count)
+            with self.subTest(count=count):
+                response = self.client.post('/api/v1/calculate', json.dumps(rows if count > 1 else rows[0]),
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                body = response.json()
+                results = body['results'] if count > 1 else [body]
+                self.assertEqual([result['input'] for result in results], rows)
+                self.assertEqual([result['methods'] for result in results],
+                                 [json.loads(json.dumps(compute_cost_snapshot(data)['methods'])) for data in rows])
+
+    def test_api_persisted_result_matches_snapshot(self):
+        rows = api_companies(random.Random(9), VECTORIZE_FROM)
+        response = self.client.post('/api/v1/calculate?persist=true', json.dumps(rows),
+                                    content_type='application/json')
+        for data, result in zip(rows, response.json()['results']):
+            self.assertEqual(Result.objects.get(id=result['id']).cost_snapshot, compute_cost_snapshot(data))
+
+    def test_csv_export_matches_snapshot(self):
+        data = {'scope1': 1234, 'scope2': 56789, 'scope3': 101112, 'profit': 77}
+        response = self.client.post('/results', data)
+        export = self.client.get(f"/results/{response.context['result_id']}/export.csv")
+        rows = b''.join(export.streaming_content).decode().splitlines()[1:]
+        expected = []
+        for method, costs in compute_cost_snapshot(data)['methods'].items():
+            values = [costs[key] for key in ('price_per_ton', *SCOPES, 'total', 'profit_total_percent')]
+            expected.append(','.join([method] + [str(value) for pair in values for value in pair]))
+        self.assertEqual(rows, expected)
+
+
+class ConcurrencyLimiterTests(SimpleTestCase):
+
+    def test_cancelled_waiter_gives_back_its_slot(self):
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=2, timeout=5)
+
+        async def scenario():
+            held = limiter.acquire()
+            waiter = asyncio.ensure_future(limiter.aslot().__aenter__())
+            while limiter.waiting == 0:
+                await asyncio.sleep(0.01)
+            # The client disconnects while its request waits for a slot
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            limiter.release(held)
+            # The waiting thread takes the slot and gives it back right away
+            deadline = time.monotonic() + 5
+            while (limiter.waiting or limiter.active) and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            self.assertEqual(limiter.active, 0)
+            async with limiter.aslot():
+                self.assertEqual(limiter.active, 1)
+            self.assertEqual(limiter.active, 0)
+
+        asyncio.run(scenario())
+
+    def test_full_queue_is_rejected(self):
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=0, timeout=5)
+
+        async def scenario():
+            async with limiter.aslot():
+                with self.assertRaises(Rejected):
+                    async with limiter.aslot():
+                        pass
+            self.assertEqual(limiter.active, 0)
+
+        asyncio.run(scenario())
+
+
+class PersistCalculationsTests(TestCase):
+
+    def test_concurrent_insert_is_counted_once_in_peer_statistics(self):
+        rows = api_companies(random.Random(10), 5)
+        calculations = [(data, compute_cost_snapshot(data)) for data in rows]
+        result_ids = views._result_ids
+        raced = []
+
+        def racing_result_ids(fingerprints):
+            ids = result_ids(fingerprints)
+            if not raced:
+                # Another request saves the second company between the lookup and the insert
+                raced.append(Result.objects.create(input_fingerprint=input_fingerprint(rows[1]), **rows[1]))
+            return ids
+
+        with mock.patch.object(views, '_result_ids', racing_result_ids):
+            ids = views._persist_calculations(calculations)
+
+        self.assertEqual(Result.objects.count(), 5)
+        self.assertEqual(ids[1], raced[0].id)
+        counts = {stat.metric: stat.count for stat in PeerStatistic.objects.all()}
+        self.assertEqual(counts, PeerStatistic.rebuild())
+
+
+class PeerStatisticMigrationTests(TestCase):
+
+    def test_backfill_matches_rebuild(self):
+        migration = importlib.import_module('NZC.migrations.0004_peer_statistic')
+        Result.objects.bulk_create(Result(input_fingerprint=str(index), **data)
+                                   for index, data in enumerate(api_companies(random.Random(11), 3000)))
+        PeerStatistic.rebuild()
+        rebuilt = {stat.metric: stat for stat in PeerStatistic.objects.all()}
+        PeerStatistic.objects.all().delete()
+
+        migration.build_statistics(apps, None)
+        for stat in PeerStatistic.objects.all():
+            expected = rebuilt.pop(stat.metric)
+            with self.subTest(metric=stat.metric):
+                self.assertEqual((stat.count, stat.minimum, stat.maximum),
+                                 (expected.count, expected.minimum, expected.maximum))
+                self.assertAlmostEqual(stat.mean, expected.mean, delta=abs(expected.mean) * 1e-9)
+                self.assertLess(sum(map(len, stat.sketch['compactors'])), stat.count)
+                sketch = KLLSketch.from_dict(stat.sketch)
+                reference = KLLSketch.from_dict(expected.sketch)
+                for q in (0.1, 0.5, 0.9):
+                    value = reference.quantile(q)
+                    self.assertAlmostEqual(sketch.rank(value), reference.rank(value), delta=0.03)
+        self.assertEqual(rebuilt, {})
+
+
+class OutboxSenderTests(TestCase):
+    """The sender against a local SMTP server (mock_smtp.py)."""
+
+    def setUp(self):
+        self.server = MockSMTPServer().start()
+        self.addCleanup(self.server.stop)
+        settings = override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                                     EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.server.port, EMAIL_USE_TLS=False)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def queue(self, count):
+        return [OutgoingEmail.objects.create(to=f"user{index}@example.com", subject=f"Email {index}", body="Hello")
+                for index in range(count)]
+
+    def test_batches_share_one_connection(self):
+        emails = self.queue(5)
+        sender = OutboxSender(batch_size=2)
+        self.assertEqual(sender.send_due(), 5)
+        sender.close()
+
+        self.assertEqual(sender.sent, 5)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual([recipients for _, recipients, _ in self.server.messages], [[email.to] for email in emails])
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.SENT, attempts=1).count(), 5)
+
+    def test_temporary_failure_is_retried(self):
+        first, second = self.queue(2)
+        self.server.fail_next = 1
+        sender = OutboxSender()
+        sender.send_batch()
+
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.attempts), (OutgoingEmail.PENDING, 1))
+        self.assertIn('451', first.last_error)
+        self.assertGreater(first.next_attempt_at, timezone.now())
+        second.refresh_from_db()
+        self.assertEqual(second.status, OutgoingEmail.SENT)
+        # Not due yet
+        self.assertEqual(sender.send_batch(), 0)
+
+        OutgoingEmail.objects.filter(id=first.id).update(next_attempt_at=timezone.now())
+        self.assertEqual(sender.send_batch(), 1)
+        sender.close()
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.attempts, first.last_error), (OutgoingEmail.SENT, 2, ''))
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_each_email_is_saved_when_sent(self):
+        self.queue(3)
+        sender = OutboxSender()
+        sent = []
+        send = sender._send
+
+        def send_then_crash(email):
+            if len(sent) == 2:
+                raise KeyboardInterrupt
+            send(email)
+            sent.append(email)
+
+        with mock.patch.object(sender, '_send', send_then_crash), self.assertRaises(KeyboardInterrupt):
+            sender.send_batch()
+        sender.close()
+        self.assertEqual(set(OutgoingEmail.objects.filter(status=OutgoingEmail.SENT).values_list('id', flat=True)),
+                         {email.id for email in sent})
+
+    def test_result_email_has_the_report_attached(self):
+        result = Result.objects.create(scope1=1, scope2=2, scope3=3, profit=4, input_fingerprint='email')
+        queue_result_email(result, 'user@example.com', 'http://testserver/results?id=1')
+        sender = OutboxSender()
+        sender.send_due()
+        sender.close()
+        _, _, data = self.server.messages[0]
+        self.assertIn(b'application/pdf', data)
+        self.assertIn(f'net-zero-result-{result.id}.pdf'.encode(), data)
+
+
+@override_settings(EMAIL_RATE_LIMIT=(3, 3600), EMAIL_RECIPIENT_RATE_LIMIT=(2, 3600))
+class EmailRateLimitTests(TestCase):
+
+    def setUp(self):
+        admission.email_limiters.cache_clear()
+        self.addCleanup(admission.email_limiters.cache_clear)
+
+    def post(self, email, client_ip='10.0.0.1'):
+        data = {'scope1': 1, 'scope2': 2, 'scope3': 3, 'profit': 4, 'email': email}
+        response = self.client.post('/results', data, REMOTE_ADDR=client_ip)
+        return [str(message) for message in response.context['messages']]
+
+    def test_recipient_limit(self):
+        self.post('user@example.com', '10.0.0.1')
+        self.post('USER@example.com', '10.0.0.2')
+        messages = self.post('user@example.com', '10.0.0.3')
+        self.assertTrue(messages[0].startswith('Too many emails'), messages)
+        self.assertEqual(OutgoingEmail.objects.count(), 2)
+
+    def test_client_limit(self):
+        for index in range(3):
+            self.post(f'user{index}@example.com')
+        messages = self.post('other@example.com')
+        self.assertTrue(messages[0].startswith('Too many emails'), messages)
+        self.assertEqual(OutgoingEmail.objects.count(), 3)
+        # Another client may still ask
+        self.post('other@example.com', '10.0.0.2')
+        self.assertEqual(OutgoingEmail.objects.count(), 4)
+
+
+class CompactResultsTests(TestCase):
+
+    def test_peer_statistics_forget_archived_results(self):
+        rng = random.Random(11)
+        rows = api_companies(rng, 30)
+        for data in rows:
+            Result.objects.create(input_fingerprint=input_fingerprint(data), **data)
+        PeerStatistic.record_many(rows)
+        old_ids = list(Result.objects.order_by('id').values_list('id', flat=True)[:12])
+        Result.objects.filter(id__in=old_ids).update(created_at=timezone.now() - timedelta(days=400))
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            call_command('compact_results', older_than=365, archive_dir=archive_dir, vacuum='none', pause=0,
+                         stdout=io.StringIO())
+            self.assertEqual(len(os.listdir(archive_dir)), 1)
+
+        self.assertEqual(Result.objects.count(), 18)
+        counts = {stat.metric: stat.count for stat in PeerStatistic.objects.all()}
+        self.assertEqual(counts['total'], 18)
+        self.assertEqual(counts, PeerStatistic.rebuild())
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    """The journal mode and connection pragmas, on a database file of their own."""
+
+    PRAGMAS = ['journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'temp_store']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = os.path.join(directory.name, 'db.sqlite3')
+
+    def manage(self, *args, profile='tuned'):
+        env = dict(os.environ, DB_PROFILE=profile, NZC_DB_PATH=self.db_path)
+        completed = subprocess.run([sys.executable, 'manage.py', *args], cwd=settings.BASE_DIR, env=env,
+                                   capture_output=True, text=True, timeout=60)
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        return completed.stdout
+
+    def journal_mode(self):
+        with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+            return connection.execute("PRAGMA journal_mode").fetchone()[0]
+
+    def pragmas(self, profile):
+        """The pragmas of a connection Django opens with the profile."""
+        output = self.manage('shell', '-c', "from django.db import connection\n"
+                             "with connection.cursor() as cursor:\n"
+                             f"    print(*[cursor.execute('PRAGMA ' + name).fetchone()[0] for name in {self.PRAGMAS}])",
+                             profile=profile)
+        return dict(zip(self.PRAGMAS, output.splitlines()[-1].split()))
+
+    def test_set_journal_mode(self):
+        self.assertIn("is now wal", self.manage('set_journal_mode', 'wal'))
+        self.assertEqual(self.journal_mode(), 'wal')
+        # Stored in the file, so every later connection uses it
+        self.assertEqual(self.pragmas('default')['journal_mode'], 'wal')
+        self.manage('set_journal_mode', 'delete')
+        self.assertEqual(self.journal_mode(), 'delete')
+
+    def test_tuned_profile_sets_the_pragmas(self):
+        # synchronous NORMAL is 1, temp_store MEMORY is 2
+        self.assertEqual(self.pragmas('tuned'), {'journal_mode': 'delete', 'synchronous': '1', 'busy_timeout': '5000',
+                                                 'cache_size': '-20000', 'temp_store': '2'})
+        default = self.pragmas('default')
+        self.assertEqual((default['synchronous'], default['temp_store']), ('2', '0'))
+        self.assertNotEqual(default['cache_size'], '-20000')
+
+
+class ProfilingMiddlewareTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def profile(self, user, **extra):
+        request = RequestFactory().get('/', **extra)
+        request.user = user
+        with override_settings(PROFILING_SAMPLE_RATE=0, PROFILING_DIR=self.directory):
+            return ProfilingMiddleware(lambda request: HttpResponse("ok"))(request)
+
+    def test_staff_request_is_profiled(self):
+        staff = User(username='staff', is_staff=True)
+        response = self.profile(staff, HTTP_X_PROFILE_REQUEST='1')
+        self.assertIn('X-Profile-Name', response)
+        response = self.profile(staff, QUERY_STRING='_profile=1')
+        self.assertIn('X-Profile-Name', response)
+        with override_settings(PROFILING_DIR=self.directory):
+            self.assertEqual([p['trigger'] for p in profiling.list_profiles()], ['request', 'request'])
+
+    def test_other_requests_are_not_profiled(self):
+        for user in (User(username='visitor'), AnonymousUser()):
+            with self.subTest(user=user):
+                response = self.profile(user, HTTP_X_PROFILE_REQUEST='1', QUERY_STRING='_profile=1')
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('X-Profile-Name', response)
+        response = self.profile(User(username='staff', is_staff=True), QUERY_STRING='profile=1&_profile=0')
+        self.assertNotIn('X-Profile-Name', response)
+        self.assertFalse(os.listdir(self.directory))
+
+    def test_one_request_is_profiled_at_a_time(self):
+        responses = []
+
+        def get_response(request):
+            if not responses:
+                # A second request arrives on another thread while the first is profiled
+                responses.append(None)
+                other = threading.Thread(target=lambda: responses.append(middleware(make_request())))
+                other.start()
+                other.join()
+            return HttpResponse("ok")
+
+        def make_request():
+            request = RequestFactory().get('/')
+            request.user = AnonymousUser()
+            return request
+
+        with override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_DIR=self.directory):
+            middleware = ProfilingMiddleware(get_response)
+            self.assertEqual(middleware(make_request()).status_code, 200)
+            self.assertEqual(responses[1].status_code, 200)
+            self.assertEqual(len(profiling.list_profiles()), 1)
+            # The lock is free again
+            middleware(make_request())
+            self.assertEqual(len(profiling.list_profiles()), 2)
+
+
+class ContextCompressionTests(SimpleTestCase):
+
+    TABLE = [
+        "Växthusgasutsläpp (ton CO2e)",
+        "2024 | 2023 | 2022",
+        "Scope 1 | 1 200 | 1 300 | 1 450",
+        "Scope 2 (market-based) | 800 | 900 | 950",
+        "Scope 2 (location-based) | 2 100 | 2 200 | 2 300",
+        "Scope 3 | 45 000 | 47 000 | 51 000",
+    ]
+    # Lines that score higher than the year headings (but lower than the rows) and compete for the budget
+    NARRATIVE = [f"Resultat: {n} av {n + 3}." for n in range(10, 30)]
+
+    def test_table_header(self):
+        self.assertEqual(table_header(self.TABLE, 4), [0, 1])
+        self.assertEqual(table_header(["Scope 1 | 5 | 6", "Scope 2 | 7 | 8"], 1), [])
+        self.assertEqual(table_header(["Resultaträkning (MSEK)", "Resultat före skatt | 310 | 290"], 1), [0])
+
+    def test_rows_keep_their_header(self):
+        table = self.TABLE[:3]
+        passage = "\n".join(self.NARRATIVE[:10] + table + self.NARRATIVE[10:])
+        budget = sum(count_tokens(line) + 1 for line in table)
+        # The year headings score lower than every other line, but come with the row
+        self.assertEqual(compress_contexts([passage], budget).splitlines(), table)
+
+    def test_neighbouring_rows_fill_the_remaining_budget(self):
+        context = compress_contexts(["\n".join(self.NARRATIVE[:3] + self.TABLE)], 1500).splitlines()
+        self.assertEqual(context[-len(self.TABLE):], self.TABLE)
+
+
+SPREADSHEET = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def xlsx_rows(data):
+    """The rows of the first sheet of an XLSX file, read with zipfile and ElementTree only."""
+    with zipfile.ZipFile(io.BytesIO(data)) as workbook:
+        assert workbook.testzip() is None
+        for name in ('[Content_Types].xml', '_rels/.rels', 'xl/workbook.xml', 'xl/_rels/workbook.xml.rels'):
+            ElementTree.fromstring(workbook.read(name))
+        sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+    rows = []
+    for row in sheet.iter(f'{SPREADSHEET}row'):
+        values = []
+        for cell in row.iter(f'{SPREADSHEET}c'):
+            if cell.get('t') == 'inlineStr':
+                values.append(cell.find(f'{SPREADSHEET}is/{SPREADSHEET}t').text or '')
+            else:
+                number = float(cell.find(f'{SPREADSHEET}v').text)
+                values.append(int(number) if number.is_integer() else number)
+        rows.append(values)
+    return rows
+
+
+class ExportTests(TestCase):
+    """The exports open in the programs that read them and show the numbers of the results page."""
+
+    DATA = {'scope1': 1234, 'scope2': 56789, 'scope3': 101112, 'profit': 77}
+
+    def setUp(self):
+        response = self.client.post('/results', self.DATA)
+        self.result = Result.objects.get(id=response.context['result_id'])
+        self.costs_per_method = response.context['costs_per_method']
+        self.price_per_ton = response.context['price_per_ton']
+
+    def page_rows(self):
+        """The cost table of the results page, one row per method as the exports write it."""
+        return [[method, *self.price_per_ton[method], *costs['scope1'], *costs['scope2'], *costs['scope3'],
+                 *costs['total'], *costs['profit_total_percent']] for method, costs in self.costs_per_method.items()]
+
+    def download(self, url, client=None):
+        response = (client or self.client).get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def create_results(self, count):
+        rng = random.Random(12)
+        Result.objects.bulk_create(
+            Result(input_fingerprint=f'export-{index}', cost_snapshot=compute_cost_snapshot(data), **data)
+            for index, data in enumerate(api_companies(rng, count)))
+
+    def test_csv_matches_results_page(self):
+        data = self.download(f'/results/{self.result.id}/export.csv')
+        header, *rows = csv.reader(io.StringIO(data.decode()))
+        self.assertEqual(header, exports.RESULT_COLUMNS)
+        self.assertEqual(rows, [[str(value) for value in row] for row in self.page_rows()])
+
+    def test_xlsx_is_a_valid_workbook(self):
+        rows = xlsx_rows(self.download(f'/results/{self.result.id}/export.xlsx'))
+        self.assertEqual(rows, [exports.RESULT_COLUMNS] + self.page_rows())
+
+    def test_xlsx_of_many_results_is_streamed(self):
+        self.create_results(3000)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get('/admin/results/export.xlsx')
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        rows = xlsx_rows(b''.join(chunks))
+        self.assertEqual(rows[0], exports.RANGE_COLUMNS)
+        self.assertEqual(len(rows), 1 + Result.objects.count())
+        self.assertEqual([row[0] for row in rows[1:]], list(Result.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_pdf_opens_with_pdfplumber(self):
+        import pdfplumber
+
+        with pdfplumber.open(io.BytesIO(self.download(f'/results/{self.result.id}/export.pdf'))) as pdf:
+            self.assertEqual(len(pdf.pages), 1)
+            text = pdf.pages[0].extract_text()
+        self.assertIn(f'result {self.result.id}', text)
+        for method, costs in self.costs_per_method.items():
+            low, high = costs['total']
+            self.assertIn(f'{method}', text)
+            self.assertIn(f'{low}–{high}', text)
+
+    def test_pdf_of_many_results_has_every_page(self):
+        import pdfplumber
+
+        self.create_results(300)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        with pdfplumber.open(io.BytesIO(self.download('/admin/results/export.pdf'))) as pdf:
+            self.assertGreater(len(pdf.pages), 1)
+            text = '\n'.join(page.extract_text() for page in pdf.pages)
+        for result_id in Result.objects.values_list('id', flat=True):
+            self.assertRegex(text, rf'(?m)^{result_id} ')
+
+    async def test_asgi_export_is_streamed_asynchronously(self):
+        response = await AsyncClient().get(f'/results/{self.result.id}/export.csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        data = b''.join([chunk async for chunk in response.streaming_content])
+        header, *rows = csv.reader(io.StringIO(data.decode()))
+        self.assertEqual(rows, [[str(value) for value in row] for row in self.page_rows()])
+
+        response = await AsyncClient().get(f'/results/{self.result.id}/export.xlsx')
+        data = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(xlsx_rows(data), [exports.RESULT_COLUMNS] + self.page_rows())
+
+
+class ResultsViewTests(TestCase):
+    """The sync and async results views run the same flow and give the same outcome."""
+
+    DATA = {'scope1': '1200', 'scope2': '800', 'scope3': '45000', 'profit': '310'}
+
+    def setUp(self):
+        # Fresh rate limits for the uploads and emails of every test
+        admission.analysis_limiters.cache_clear()
+        admission.email_limiters.cache_clear()
+
+    def call(self, view, data, factory):
+        request = factory.post('/results', data)
+        request.session = SessionStore()
+        request._messages = FallbackStorage(request)
+        request.user = AnonymousUser()
+        if view is async_views.results:
+            response = async_to_sync(view)(request)
+        else:
+            response = view(request)
+        return response, [str(message) for message in get_messages(request)]
+
+    def both(self, data):
+        """Post to the sync view, then to the async one."""
+        outcomes = []
+        for view, factory in ((views.results, RequestFactory()), (async_views.results, AsyncRequestFactory())):
+            outcomes.append(self.call(view, data() if callable(data) else data, factory))
+        return outcomes
+
+    def test_manual_input(self):
+        (sync_response, _), (async_response, _) = self.both(dict(self.DATA, email='user@example.com'))
+        self.assertEqual((sync_response.status_code, async_response.status_code), (200, 200))
+        result = Result.objects.get()
+        self.assertEqual(result.input_data(), {key: int(value) for key, value in self.DATA.items()})
+        # Both asked for an email; the second submission reused the result
+        self.assertEqual(OutgoingEmail.objects.filter(result=result).count(), 2)
+        for response in (sync_response, async_response):
+            self.assertIn(f'{result.id}', response.content.decode())
+
+    def test_missing_input(self):
+        for response, messages in self.both({'scope1': '1'}):
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(messages, ['Missing required data'])
+        self.assertFalse(Result.objects.exists())
+
+    def upload(self):
+        return {'file': SimpleUploadedFile('report.pdf', b'%PDF-1.4 report', content_type='application/pdf')}
+
+    def analysis(self, *args):
+        return {'extracted_values': {'scope1': 1200, 'scope2': 800, 'scope3': 45000, 'profit': 310},
+                'text_sample': '', 'relevant_contexts': []}
+
+    def test_pdf_is_analysed_once(self):
+        calls = []
+
+        async def aanalysis(pdf_file):
+            calls.append('async')
+            return self.analysis()
+
+        with mock.patch('NZC.pdf_analyzer.extract_info_from_pdf', side_effect=self.analysis) as analyse, \
+                mock.patch('NZC.pdf_analyzer.aextract_info_from_pdf', aanalysis):
+            (sync_response, _), (async_response, _) = self.both(self.upload)
+            self.assertEqual(analyse.call_count, 1)
+            # The async view found the result saved by the sync one
+            self.assertEqual(calls, [])
+            Result.objects.all().delete()
+            async_response, _ = self.call(async_views.results, self.upload(), AsyncRequestFactory())
+            self.assertEqual(calls, ['async'])
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(Result.objects.get().pdfname, 'report.pdf')
+
+    def test_pdf_with_missing_numbers_is_not_saved(self):
+        for extracted in ({'scope1': 1200, 'scope3': 45000, 'profit': 310},
+                          {'scope1': 1200, 'scope2': 800, 'scope3': 45000}):
+            analysis = dict(self.analysis(), extracted_values=extracted)
+            with self.subTest(extracted=extracted), \
+                    mock.patch('NZC.pdf_analyzer.extract_info_from_pdf', return_value=analysis), \
+                    mock.patch('NZC.pdf_analyzer.aextract_info_from_pdf', mock.AsyncMock(return_value=analysis)):
+                for response, messages in self.both(self.upload):
+                    self.assertEqual(response.status_code, 200)
+                    self.assertIn('not saved', messages[0])
+                    self.assertContains(response, '1200')
+                self.assertFalse(Result.objects.exists())
+
+    def test_upload_is_hashed_off_the_event_loop(self):
+        on_event_loop = []
+
+        def fingerprint(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_event_loop.append(True)
+            except RuntimeError:
+                on_event_loop.append(False)
+            return input_fingerprint(*args, **kwargs)
+
+        with mock.patch.object(async_views, 'input_fingerprint', fingerprint), \
+                mock.patch('NZC.pdf_analyzer.aextract_info_from_pdf', mock.AsyncMock(side_effect=self.analysis)):
+            response, _ = self.call(async_views.results, self.upload(), AsyncRequestFactory())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(on_event_loop, [False])
+
+
+class MetricsTests(TestCase):
+
+    DATA = {'scope1': 1200, 'scope2': 800, 'scope3': 45000, 'profit': 310}
+
+    def samples(self):
+        """The samples of /metrics, as {'name{labels}': value}."""
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                sample, value = line.rsplit(' ', 1)
+                samples[sample] = float(value)
+        return samples
+
+    def test_exposition_format(self):
+        counter = Counter('test_total', 'A counter.', ('kind',))
+        counter.inc('a "quoted"\nvalue')
+        counter.inc('b', amount=2)
+        self.assertEqual(counter.render(), [
+            '# HELP test_total A counter.',
+            '# TYPE test_total counter',
+            'test_total{kind="a \\"quoted\\"\\nvalue"} 1',
+            'test_total{kind="b"} 2',
+        ])
+        histogram = Histogram('test_seconds', 'A histogram.', ('stage',), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, 'render')
+        self.assertEqual(histogram.render(), [
+            '# HELP test_seconds A histogram.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{stage="render",le="0.1"} 2',
+            'test_seconds_bucket{stage="render",le="1"} 3',
+            'test_seconds_bucket{stage="render",le="+Inf"} 4',
+            'test_seconds_sum{stage="render"} 3.65',
+            'test_seconds_count{stage="render"} 4',
+        ])
+
+    def test_requests_are_counted(self):
+        requests = 'nzc_requests_total{view="results",method="POST",status="200"}'
+        duration = 'nzc_request_duration_seconds_count{view="results",method="POST"}'
+        stage = 'nzc_stage_duration_seconds_count{stage="costs"}'
+        before = self.samples()
+        self.client.post('/results', self.DATA)
+        self.client.post('/results', self.DATA)
+        after = self.samples()
+        for sample in (requests, duration, stage):
+            with self.subTest(sample=sample):
+                self.assertEqual(after[sample] - before.get(sample, 0), 2)
+        self.assertEqual(after['nzc_cache_lookups_total{cache="result",outcome="hit"}']
+                         - before.get('nzc_cache_lookups_total{cache="result",outcome="hit"}', 0), 1)
+        buckets = [value for sample, value in after.items()
+                   if sample.startswith('nzc_request_duration_seconds_bucket{view="results",method="POST"')]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(buckets[-1], after[duration])
+
+    def test_server_timing_header(self):
+        response = self.client.post('/results', self.DATA)
+        self.assertEqual(response.status_code, 200)
+        stages = dict(re.fullmatch(r'([a-z_]+);dur=(\d+\.\d)', entry).groups()
+                      for entry in response['Server-Timing'].split(', '))
+        self.assertTrue({'costs', 'db_save', 'peers', 'render', 'total'} <= set(stages), stages)
+        self.assertEqual(list(stages)[-1], 'total')
+        self.assertLessEqual(max(float(value) for value in stages.values()), float(stages['total']))
+
+
+class MethodPagesTests(SimpleTestCase):
+    """Paging of the CCS method tables, on the supplier list shipped with the app."""
+
+    METHOD = CCS_METHODS[0]
+
+    def get(self, **params):
+        response = self.client.get('/api/v1/ccs_methods', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_response_shape(self):
+        data = self.get()
+        self.assertEqual({key: data[key] for key in ('sort', 'order', 'per_page')},
+                         {'sort': 'tons_delivered', 'order': 'desc', 'per_page': 25})
+        self.assertEqual(list(data['methods']), CCS_METHODS)
+        for method, table in data['methods'].items():
+            with self.subTest(method=method):
+                self.assertEqual(set(table), {'aggregates', 'suppliers', 'page', 'num_pages'})
+                self.assertEqual(table['aggregates'], load_method_tables()[method]['aggregates'])
+                self.assertEqual(table['page'], 1)
+                count = table['aggregates']['supplier_count']
+                self.assertEqual(table['num_pages'], max(1, math.ceil(count / 25)))
+                self.assertEqual(len(table['suppliers']), min(count, 25))
+                for row in table['suppliers']:
+                    self.assertEqual(set(row), {'name', 'tons_delivered', 'tons_sold', 'cdr_link', 'company_link'})
+                delivered = [row['tons_delivered'] for row in table['suppliers']]
+                self.assertEqual(delivered, sorted(delivered, reverse=True))
+
+    def test_pages_cover_every_supplier_once(self):
+        first = self.get(method=self.METHOD, per_page=7)['methods'][self.METHOD]
+        names = []
+        for page in range(1, first['num_pages'] + 1):
+            table = self.get(method=self.METHOD, page=page, per_page=7)['methods'][self.METHOD]
+            self.assertEqual(table['page'], page)
+            names += [row['name'] for row in table['suppliers']]
+        self.assertEqual(len(names), load_method_tables()[self.METHOD]['aggregates']['supplier_count'])
+        self.assertEqual(len(set(names)), len(names))
+
+    def test_page_out_of_bounds(self):
+        num_pages = self.get(per_page=10)['methods'][self.METHOD]['num_pages']
+        self.assertGreater(num_pages, 1)
+        # Past the end and below 1 show the last page, anything that isn't a number the first
+        for page, expected in ((num_pages + 5, num_pages), (0, num_pages), (-1, num_pages),
+                               ('abc', 1), ('', 1), ('2.5', 1)):
+            with self.subTest(page=page):
+                data = self.get(method=self.METHOD, page=page, per_page=10)
+                self.assertEqual(data['methods'][self.METHOD]['page'], expected)
+        # Only the selected method leaves page 1
+        data = self.get(method=self.METHOD, page=num_pages, per_page=10)
+        self.assertEqual({table['page'] for method, table in data['methods'].items() if method != self.METHOD}, {1})
+
+    def test_invalid_options(self):
+        for per_page, expected in ((0, 1), (-3, 1), (1000, 100), ('many', 25), ('', 25)):
+            with self.subTest(per_page=per_page):
+                data = self.get(per_page=per_page)
+                self.assertEqual(data['per_page'], expected)
+                self.assertLessEqual(len(data['methods'][self.METHOD]['suppliers']), expected)
+        data = self.get(sort='price; DROP TABLE', order='sideways')
+        self.assertEqual((data['sort'], data['order']), ('tons_delivered', 'desc'))
+
+    def test_sort_orders(self):
+        for sort in SORT_FIELDS:
+            with self.subTest(sort=sort):
+                rows = self.get(sort=sort, order='asc', per_page=100)['methods'][self.METHOD]['suppliers']
+                key = (lambda row: row['name'].lower()) if sort == 'name' else (lambda row: row[sort])
+                self.assertEqual([key(row) for row in rows], sorted(key(row) for row in rows))
+
+    def test_html_page_uses_the_same_pages(self):
+        response = self.client.get('/ccs_methods', {'method': self.METHOD, 'page': 2, 'per_page': 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['method_tables'][self.METHOD]['page'].number, 2)
+        self.assertEqual(response.context['per_page'], 10)
+
+
+class SupplierSearchTests(SimpleTestCase):
+
+    SUPPLIERS = [
+        {'name': 'Climeworks', 'method': 'DACCS', 'tons_delivered': 900, 'tons_sold': 5000},
+        {'name': 'Carbon Engineering', 'method': 'DACCS', 'tons_delivered': 50, 'tons_sold': 800},
+        {'name': 'Carbonfuture', 'method': 'Biochar', 'tons_delivered': 700, 'tons_sold': 700},
+        {'name': 'Exomad Green', 'method': 'Biochar', 'tons_delivered': 130000, 'tons_sold': 499000},
+        {'name': 'Green Carbon Café', 'method': 'Biochar', 'tons_delivered': 0, 'tons_sold': 10},
+        {'name': 'Stockholm Exergi', 'method': 'BECCS', 'tons_delivered': 0, 'tons_sold': 3000},
+    ]
+
+    def setUp(self):
+        self.index = SupplierIndex(self.SUPPLIERS)
+
+    def names(self, query, limit=10):
+        return [(supplier['name'], supplier['match']) for supplier in self.index.search(query, limit)]
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams('co2'), {'  c', ' co', 'co2', 'o2 '})
+        self.assertEqual(normalize('Green Carbon Café!'), 'green carbon cafe ')
+
+    def test_prefix_match_in_rank_order(self):
+        # Most tons delivered first, then most sold
+        self.assertEqual(self.names('carb'), [('Carbonfuture', 'prefix'), ('Carbon Engineering', 'prefix'),
+                                              ('Green Carbon Café', 'prefix')])
+        self.assertEqual(self.names('CARB', limit=1), [('Carbonfuture', 'prefix')])
+        self.assertEqual(self.names('cafe'), [('Green Carbon Café', 'prefix')])
+        self.assertEqual(self.names(''), [])
+        self.assertEqual(self.names('carb', limit=0), [])
+
+    def test_words_must_all_match(self):
+        self.assertEqual(self.names('carbon eng'), [('Carbon Engineering', 'prefix')])
+        self.assertEqual(self.names('green carb'), [('Green Carbon Café', 'prefix')])
+        self.assertEqual(self.names('exergi carb'), [])
+
+    def test_typos(self):
+        self.assertEqual(self.names('climewroks'), [('Climeworks', 'fuzzy')])
+        self.assertEqual(self.names('stokholm'), [('Stockholm Exergi', 'fuzzy')])
+        # A misspelled complete word, then a prefix
+        self.assertEqual(self.names('stokholm ex'), [('Stockholm Exergi', 'prefix')])
+        # Too short to match fuzzily
+        self.assertEqual(self.names('xo'), [])
+
+    def test_csv_rows(self):
+        index = SupplierIndex([
+            {'Name': 'Exomad Green', 'Tons Delivered': '130 012', 'Tons Sold': '499 208', 'Method': 'Biochar',
+             'CDR_Link': 'https://www.cdr.fyi/supplier/exomad-green'},
+            {'Name': 'Exergy Labs', 'Tons Delivered': '12', 'Tons Sold': '', 'Method': 'DACCS'},
+        ])
+        results = index.search('ex')
+        self.assertEqual([(r['name'], r['tons_delivered'], r['tons_sold']) for r in results],
+                         [('Exomad Green', 130012, 499208), ('Exergy Labs', 12, 0)])
+        self.assertEqual(results[0]['cdr_link'], 'https://www.cdr.fyi/supplier/exomad-green')
+
+
+class PipelineRunnerTests(SimpleTestCase):
+    """A small pipeline of file-writing stages: source -> upper -> shout, and an independent other."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.base_dir = directory.name
+        self.source = 'net zero'
+        self.failing = set()
+        self.calls = []
+        self.stages = [
+            Stage('source', [], ['source.txt'], function=self.stage('source', lambda _: self.source)),
+            Stage('upper', ['source.txt'], ['upper.txt'], function=self.stage('upper', str.upper, 'source.txt')),
+            Stage('shout', ['upper.txt'], ['shout.txt'], function=self.stage('shout', lambda text: text + '!',
+                                                                              'upper.txt')),
+            Stage('other', [], ['other.txt'], function=self.stage('other', lambda _: 'other')),
+        ]
+
+    def stage(self, name, transform, input_name=None):
+        def run(base_dir):
+            self.calls.append(name)
+            if name in self.failing:
+                raise RuntimeError(f"{name} broke")
+            text = self.read(input_name) if input_name else None
+            with open(os.path.join(base_dir, f'{name}.txt'), 'w', encoding='utf-8') as f:
+                f.write(transform(text))
+        return run
+
+    def read(self, name):
+        with open(os.path.join(self.base_dir, name), encoding='utf-8') as f:
+            return f.read()
+
+    def run_pipeline(self, **kwargs):
+        self.calls = []
+        # A new runner each time, so the state is read back from its file
+        report = PipelineRunner(self.base_dir, self.stages, log=lambda message: None).run(jobs=2, **kwargs)
+        return {name: status for name, (status, _) in report.items()}
+
+    def test_unchanged_stages_are_skipped(self):
+        self.assertEqual(set(self.run_pipeline().values()), {'ran'})
+        self.assertEqual(self.read('shout.txt'), 'NET ZERO!')
+        self.assertEqual(set(self.run_pipeline().values()), {'skipped'})
+        self.assertEqual(self.calls, [])
+
+        # An input edited by hand reruns the stages that read it
+        with open(os.path.join(self.base_dir, 'source.txt'), 'w', encoding='utf-8') as f:
+            f.write('carbon')
+        self.assertEqual(self.run_pipeline(), {'source': 'skipped', 'upper': 'ran', 'shout': 'ran',
+                                               'other': 'skipped'})
+        self.assertEqual(self.read('shout.txt'), 'CARBON!')
+
+        # So does a missing or changed output
+        os.remove(os.path.join(self.base_dir, 'other.txt'))
+        with open(os.path.join(self.base_dir, 'shout.txt'), 'w', encoding='utf-8') as f:
+            f.write('edited')
+        self.assertEqual(self.run_pipeline(), {'source': 'skipped', 'upper': 'skipped', 'shout': 'ran',
+                                               'other': 'ran'})
+
+    def test_refresh_and_force(self):
+        self.run_pipeline()
+        self.source = 'removal'
+        self.assertEqual(self.run_pipeline(refresh=True), {'source': 'ran', 'upper': 'ran', 'shout': 'ran',
+                                                           'other': 'ran'})
+        self.assertEqual(self.read('shout.txt'), 'REMOVAL!')
+        # Same output as before, so nothing downstream changes
+        self.assertEqual(self.run_pipeline(refresh=True), {'source': 'ran', 'upper': 'skipped', 'shout': 'skipped',
+                                                           'other': 'ran'})
+        self.assertEqual(set(self.run_pipeline(force=True, only=['upper', 'shout']).values()), {'ran'})
+        self.assertEqual(self.calls, ['upper', 'shout'])
+
+    def test_failure_blocks_downstream_stages(self):
+        self.failing = {'upper'}
+        self.assertEqual(self.run_pipeline(), {'source': 'ran', 'upper': 'failed', 'shout': 'blocked',
+                                               'other': 'ran'})
+        self.assertNotIn('shout', self.calls)
+        # The failed stage isn't recorded as done
+        self.failing = set()
+        self.assertEqual(self.run_pipeline(), {'source': 'skipped', 'upper': 'ran', 'shout': 'ran',
+                                               'other': 'skipped'})
+
+    def test_dry_run(self):
+        self.assertEqual(set(self.run_pipeline(dry_run=True).values()), {'would run'})
+        self.assertEqual(self.calls, [])
+        self.assertFalse(os.path.exists(os.path.join(self.base_dir, 'source.txt')))
+
+        self.run_pipeline()
+        self.assertEqual(set(self.run_pipeline(dry_run=True).values()), {'skipped'})
+        # Only upper's input changed, but shout would be rebuilt from upper's new output
+        with open(os.path.join(self.base_dir, 'source.txt'), 'w', encoding='utf-8') as f:
+            f.write('carbon')
+        self.assertEqual(self.run_pipeline(dry_run=True), {'source': 'skipped', 'upper': 'would run',
+                                                           'shout': 'would run', 'other': 'skipped'})
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.run_pipeline(), {'source': 'skipped', 'upper': 'ran', 'shout': 'ran',
+                                               'other': 'skipped'})
+
+
+class ReadyTests(TestCase):
+
+    def setUp(self):
+        # What preload() ran is kept per process; start each test without it
+        steps = mock.patch.dict(preload._steps, clear=True)
+        steps.start()
+        self.addCleanup(steps.stop)
+
+    def test_ready_after_preload(self):
+        # The database connection is kept open and the heap not frozen, for the other tests
+        with mock.patch.object(preload, 'connections'), mock.patch('gc.freeze'):
+            preload.preload()
+        with override_settings(PRELOAD_ON_STARTUP=True):
+            response = self.client.get('/ready')
+        self.assertEqual(response.status_code, 200)
+        state = response.json()
+        self.assertEqual((state['ready'], state['warm'], state['database']), (True, True, True))
+        self.assertEqual(set(state['steps']), set(preload.STEPS))
+        for step in state['steps'].values():
+            self.assertTrue(step['loaded'])
+            self.assertIsNone(step['error'])
+
+    def test_not_ready_before_preload(self):
+        with override_settings(PRELOAD_ON_STARTUP=True):
+            response = self.client.get('/ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.json()['ready'])
+        # Without preloading, a worker is ready as soon as it can serve requests
+        with override_settings(PRELOAD_ON_STARTUP=False):
+            self.assertEqual(self.client.get('/ready').status_code, 200)
+
+    def test_not_ready_after_a_failed_step(self):
+        preload._steps.update({name: {'ms': 1.0, 'error': None} for name in preload.STEPS})
+        preload._steps['suppliers']['error'] = "FileNotFoundError: cdr_suppliers_with_links_and_company.csv"
+        with override_settings(PRELOAD_ON_STARTUP=True):
+            response = self.client.get('/ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('FileNotFoundError', response.json()['steps']['suppliers']['error'])
+
+    def test_not_ready_without_database(self):
+        with mock.patch.object(Result.objects, 'exists', side_effect=OperationalError("no such table: NZC_result")):
+            response = self.client.get('/ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual((response.json()['ready'], response.json()['database']), (False, False))
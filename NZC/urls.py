@@ -1,12 +1,26 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# The views that wait on the database, OpenAI and PDF parsing have async variants for ASGI
+if settings.ASYNC_VIEWS:
+    from .async_views import calculate_api, result_api, results
+else:
+    from .views import calculate_api, result_api, results
+
 urlpatterns = [
     path('', views.index, name='index'),
     path('about', views.about, name='about'),
     path('pdf', views.pdf, name='pdf'),
     path('manual', views.manual, name='manual'),
-    path('results', views.results, name='results'),
+    path('results', results, name='results'),
+    path('results/<int:result_id>/export.<str:export_format>', views.export_result, name='export_result'),
     path('map', views.supplier_map, name='map'),
     path('ccs_methods', views.ccs_methods, name='ccs_methods'),
-]
\ No newline at end of file
+    path('api/v1/ccs_methods', views.ccs_methods_api, name='ccs_methods_api'),
+    path('api/v1/suppliers/search', views.supplier_search, name='supplier_search'),
+    path('api/v1/calculate', calculate_api, name='calculate_api'),
+    path('api/v1/results/<int:result_id>', result_api, name='result_api'),
+    path('ready', views.ready, name='ready'),
+    path('metrics', views.metrics, name='metrics'),
+]
@@ -1,15 +1,31 @@
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.shortcuts import get_object_or_404
-from .models import Result
-from calculator1 import *
-from .pdf_analyzer import extract_info_from_pdf
-import math
+from django.core.paginator import Paginator
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import DatabaseError, IntegrityError, transaction
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from .models import PeerStatistic, Result, input_fingerprint
+from calculator1 import get_results
+from .costs import compute_cost_snapshot, compute_cost_snapshots, cost_tables
+from .outbox import queue_result_email
+from .metrics import CACHE_LOOKUPS, render_metrics, timed
+from . import admission, exports, profiling
+from asgiref.sync import sync_to_async
+import json
+from .supplier_search import get_supplier_index
+from .suppliers import SORT_FIELDS, load_method_tables
 import os
-import pandas as pd
-from django.conf import settings
 
-openai_enabled = os.getenv("OPENAI_API_KEY") is not None
+# PDF upload needs an OpenAI key, or the stand-in model (see NZC/mock_llm.py)
+openai_enabled = os.getenv("OPENAI_API_KEY") is not None or os.getenv("NZC_MOCK_LLM") == "1"
 
 # Create your views here.
 def index(request):
@@ -27,68 +43,151 @@ def manual(request):
 def supplier_map(request):
     return render(request, 'map.html')
 
-def results(request):
+def _stored_result_context(result_object, cost_snapshot):
+    """The results page context for a saved result, read from its cost snapshot."""
+    with timed('costs'):
+        costs_per_method, price_per_ton = cost_tables(cost_snapshot)
+    return {
+        'results': get_results(result_object.input_data()),
+        'costs_per_method': costs_per_method,
+        'price_per_ton': price_per_ton
+    }
+
+def _analysis_context(analysis_results):
     """
-    Handle requests to the results page.
+    The calculation input and results page context for the PDF analyzer's output.
 
-    For GET requests:
-        - Fetch and display results for a specific result ID.
+    Returns:
+        tuple: (data, cost_snapshot, context); cost_snapshot is None when the analyzer
+               didn't find all three scopes as numbers.
+    """
+    extracted_values = analysis_results['extracted_values']
 
-    For POST requests:
-        - Process uploaded PDF or manual input data.
-        - Perform calculations and save results to the database.
+    data = {
+        'scope1': extracted_values.get('scope1', '-'),
+        'scope2': extracted_values.get('scope2', '-'),
+        'scope3': extracted_values.get('scope3', '-'),
+        'profit': extracted_values.get('profit', '-')
+    }
+
+    # If all scopes are numbers, calculate and show tabel
+    if all(isinstance(data[k], int) or (isinstance(data[k], str) and data[k].isdigit()) for k in ['scope1', 'scope2', 'scope3']):
+        for k in ['scope1', 'scope2', 'scope3']:
+            if isinstance(data[k], str):
+                data[k] = int(data[k])
+        if isinstance(data['profit'], str) and data['profit'].isdigit():
+            data['profit'] = int(data['profit'])
+        results = get_results(data)
+
+        with timed('costs'):
+            cost_snapshot = compute_cost_snapshot(data)
+            costs_per_method, price_per_ton = cost_tables(cost_snapshot)
+        context = {
+            'results': results,
+            'text_sample': analysis_results['text_sample'],
+            'relevant_contexts': analysis_results['relevant_contexts'],
+            'costs_per_method': costs_per_method,
+            'price_per_ton': price_per_ton
+        }
+        return data, cost_snapshot, context
+
+    context = {
+        'results': data,
+        'text_sample': analysis_results['text_sample'],
+        'relevant_contexts': analysis_results['relevant_contexts']
+    }
+    return data, None, context
+
+def _manual_input(request):
+    """The numbers posted from the manual form, or None if one is missing."""
+    if not (request.POST.get('scope1') and request.POST.get('scope2') and request.POST.get('scope3') and request.POST.get('profit')):
+        return None
+    return {
+        'scope1': int(request.POST.get('scope1')), 
+        'scope2': int(request.POST.get('scope2')), 
+        'scope3': int(request.POST.get('scope3')),
+        'profit': int(request.POST.get('profit'))
+    }
+
+def _manual_context(data):
     """
-    context = {}
+    Returns:
+        tuple: (cost_snapshot, context) for manually entered numbers.
+    """
+    context = {
+        'results': get_results(data)
+    }
+    with timed('costs'):
+        cost_snapshot = compute_cost_snapshot(data)
+        costs_per_method, price_per_ton = cost_tables(cost_snapshot)
+    context['costs_per_method'] = costs_per_method
+    context['price_per_ton'] = price_per_ton
+    return cost_snapshot, context
+
+def _rejected_response(request, rejected):
+    """The start page with the reason a PDF analysis wasn't admitted (see admission.py)."""
+    messages.error(request, rejected.message)
+    response = render(request, 'index.html', {'openai_enabled': openai_enabled}, status=rejected.status)
+    response['Retry-After'] = str(rejected.retry_after)
+    return response
 
-    removal_methods = {
-        'Direct Air Capture': (100, 345),      # Cost in U.S. dollars per ton of CO₂
-        'Biochar': (10, 345),
-        'Reforestation': (5, 240),
-        'Enhanced Weathering': (50, 200),
-        'BECCS': (15, 400),
-        'Soil carbon sequestration': (45, 100)
+def _result_defaults(data, pdfname, cost_snapshot):
+    """The fields of a new Result, for get_or_create on its input fingerprint."""
+    return {
+        'scope1': data['scope1'],
+        'scope2': data['scope2'],
+        'scope3': data['scope3'],
+        'profit': data['profit'],
+        'pdfname': pdfname,
+        'email': None,
+        'cost_snapshot': cost_snapshot
     }
 
+def _email_recipient(request, context):
+    """
+    The address posted in 'email' if the results should be emailed to it, or None.
+    An invalid address or a used-up rate limit is reported with a message instead.
+    """
+    email = request.POST.get('email', '').strip()
+    if not email or 'costs_per_method' not in context:
+        return None
+    try:
+        validate_email(email)
+    except ValidationError:
+        messages.error(request, f'{email} is not a valid email address')
+        return None
+    retry_after = admission.take_email_limit(request, email)
+    if retry_after is not None:
+        messages.error(request, f'Too many emails have been requested. Please try again in {retry_after} seconds.')
+        return None
+    return email
+
+def _render_results(request, context, result_object):
+    context['openai_enabled'] = openai_enabled
+    context["result_id"] =  result_object.id if result_object is not None else None
+    with timed('render'):
+        return render(request, 'results.html', context)
+
+def _results_flow(request):
+    """
+    The results page, written once for views.results and async_views.results.
+
+    A generator: every step that waits for the database, the PDF analyzer or the
+    templates is yielded as (step name, *arguments) and its return value is sent back
+    (or its exception thrown back in). ResultSteps runs the steps in the request's
+    thread, async_views.AsyncResultSteps on the event loop. Returns the response.
+    """
+    context = {}
+    result_object = None
+
     if request.method == 'GET':
         result_id = request.GET.get('id')
-        if result_id:
-            result_object = get_object_or_404(Result, id=result_id)
-            data = {
-                'scope1': result_object.scope1,
-                'scope2': result_object.scope2,
-                'scope3': result_object.scope3,
-                'profit': result_object.profit
-            }
-            results = get_results(data)
-            context = {
-                'results': results
-            }
-
-            # Calculate costs per method
-            costs_per_method = {}
-            price_per_ton = {}
-            for method, (low, high) in removal_methods.items():
-                total_low = math.ceil((data['scope1'] + data['scope2'] + data['scope3']) * low * 10 / 1_000)
-                total_high = math.ceil((data['scope1'] + data['scope2'] + data['scope3']) * high * 10 / 1_000)
-                profit_tsek = data['profit'] * 1000 if isinstance(data['profit'], (int, float)) and data['profit'] != 0 else None
-                if profit_tsek:
-                    percent_low = round((total_low / profit_tsek) * 100, 1) if total_low else "-"
-                    percent_high = round((total_high / profit_tsek) * 100, 1) if total_high else "-"
-                else:
-                    percent_low = percent_high = "-"
-                costs_per_method[method] = {
-                    'scope1': (math.ceil(data['scope1'] * low * 10 / 1_000), math.ceil(data['scope1'] * high * 10 / 1_000)),
-                    'scope2': (math.ceil(data['scope2'] * low * 10 / 1_000), math.ceil(data['scope2'] * high * 10 / 1_000)),
-                    'scope3': (math.ceil(data['scope3'] * low * 10 / 1_000), math.ceil(data['scope3'] * high * 10 / 1_000)),
-                    'total': (total_low, total_high),
-                    'profit_total_percent': (percent_low, percent_high)
-                }
-                price_per_ton[method] = (low * 10, high * 10)  # SEK per ton
-            context['costs_per_method'] = costs_per_method
-            context['price_per_ton'] = price_per_ton
-        else:
+        if not result_id:
             messages.error(request, f'ID: {result_id} does not exist')
             return redirect('index')
+        result_object = yield ('stored_result', result_id)
+        # Costs per method as computed when the result was saved
+        context = yield ('stored_context', result_object)
 
     elif request.method == 'POST':
         if request.FILES.get('file'):
@@ -98,150 +197,502 @@ def results(request):
                 messages.error(request, 'File is not PDF type')
                 return redirect('index')
 
-            try:
-                # Use the PDF analyzer to get initial data
-                analysis_results = extract_info_from_pdf(pdf_file)
-                extracted_values = analysis_results['extracted_values']
-                
-                data = {
-                    'scope1': extracted_values.get('scope1', '-'),
-                    'scope2': extracted_values.get('scope2', '-'),
-                    'scope3': extracted_values.get('scope3', '-'),
-                    'profit': extracted_values.get('profit', '-')
-                }
-
-                # If all scopes are numbers, calculate and show tabel
-                if all(isinstance(data[k], int) or (isinstance(data[k], str) and data[k].isdigit()) for k in ['scope1', 'scope2', 'scope3']):
-                    for k in ['scope1', 'scope2', 'scope3']:
-                        if isinstance(data[k], str):
-                            data[k] = int(data[k])
-                    if isinstance(data['profit'], str) and data['profit'].isdigit():
-                        data['profit'] = int(data['profit'])
-                    results = get_results(data)
-
-                    costs_per_method = {}
-                    price_per_ton = {}
-                    for method, (low, high) in removal_methods.items():
-                        total_low = math.ceil((data['scope1'] + data['scope2'] + data['scope3']) * low * 10 / 1_000)
-                        total_high = math.ceil((data['scope1'] + data['scope2'] + data['scope3']) * high * 10 / 1_000)
-                        profit_tsek = data['profit'] * 1000 if isinstance(data['profit'], (int, float)) and data['profit'] != 0 else None
-                        if profit_tsek:
-                            percent_low = round((total_low / profit_tsek) * 100, 1) if total_low else "-"
-                            percent_high = round((total_high / profit_tsek) * 100, 1) if total_high else "-"
-                        else:
-                            percent_low = percent_high = "-"
-                        costs_per_method[method] = {
-                            'scope1': (math.ceil(data['scope1'] * low * 10 / 1_000), math.ceil(data['scope1'] * high * 10 / 1_000)),
-                            'scope2': (math.ceil(data['scope2'] * low * 10 / 1_000), math.ceil(data['scope2'] * high * 10 / 1_000)),
-                            'scope3': (math.ceil(data['scope3'] * low * 10 / 1_000), math.ceil(data['scope3'] * high * 10 / 1_000)),
-                            'total': (total_low, total_high),
-                            'profit_total_percent': (percent_low, percent_high)
-                        }
-                        price_per_ton[method] = (low * 10, high * 10)  # SEK per ton
-                    context = {
-                        'results': results,
-                        'text_sample': analysis_results['text_sample'],
-                        'relevant_contexts': analysis_results['relevant_contexts'],
-                        'costs_per_method': costs_per_method,
-                        'price_per_ton': price_per_ton
-                    }
-                else:
-                    results = (
-                        f"Scope 1: {data['scope1']}\n"
-                        f"Scope 2: {data['scope2']}\n"
-                        f"Scope 3: {data['scope3']}\n"
-                        f"Vinst (MSEK): {data['profit']}"
-                    )
-                    context = {
-                        'results': results,
-                        'text_sample': analysis_results['text_sample'],
-                        'relevant_contexts': analysis_results['relevant_contexts']
-                    }
-            except Exception as e:
-                messages.error(request, f'Error analyzing PDF: {str(e)}')
-                return redirect('index')
+            fingerprint = yield ('pdf_fingerprint', pdf_file)
+            result_object = yield ('find_result', fingerprint)
+            if result_object is not None:
+                # Same PDF as before, no need to analyse it again
+                CACHE_LOOKUPS.inc('result', 'hit')
+                context = yield ('stored_context', result_object)
+            else:
+                try:
+                    # Use the PDF analyzer to get initial data, if a slot is free
+                    analysis_results = yield ('analyze', request, pdf_file)
+                    data, cost_snapshot, context = _analysis_context(analysis_results)
+                except admission.Rejected as rejected:
+                    return (yield ('rejected', request, rejected))
+                except Exception as e:
+                    messages.error(request, f'Error analyzing PDF: {str(e)}')
+                    return redirect('index')
+                if not all(isinstance(data[key], int) for key in ('scope1', 'scope2', 'scope3', 'profit')):
+                    # A result needs all four numbers: show what was found, but don't save it
+                    messages.error(request, 'Not all numbers were found in the report, so the result was not saved')
+                    return (yield ('render', request, context, None))
+                result_object = yield ('save_result', fingerprint, _result_defaults(data, pdf_file.name, cost_snapshot))
 
-        elif request.POST.get('scope1') and request.POST.get('scope2') and request.POST.get('scope3') and request.POST.get('profit'):
-            data = {
-                'scope1': int(request.POST.get('scope1')), 
-                'scope2': int(request.POST.get('scope2')), 
-                'scope3': int(request.POST.get('scope3')),
-                'profit': int(request.POST.get('profit'))
-            }
-            results = get_results(data)
-            context = {
-                'results': results
-            }
-
-            costs_per_method = {}
-            price_per_ton = {}
-            for method, (low, high) in removal_methods.items():
-                total_low = math.ceil((data['scope1'] + data['scope2'] + data['scope3']) * low * 10 / 1_000)
-                total_high = math.ceil((data['scope1'] + data['scope2'] + data['scope3']) * high * 10 / 1_000)
-                profit_tsek = data['profit'] * 1000 if isinstance(data['profit'], (int, float)) and data['profit'] != 0 else None
-                if profit_tsek:
-                    percent_low = round((total_low / profit_tsek) * 100, 1) if total_low else "-"
-                    percent_high = round((total_high / profit_tsek) * 100, 1) if total_high else "-"
-                else:
-                    percent_low = percent_high = "-"
-                costs_per_method[method] = {
-                    'scope1': (math.ceil(data['scope1'] * low * 10 / 1_000), math.ceil(data['scope1'] * high * 10 / 1_000)),
-                    'scope2': (math.ceil(data['scope2'] * low * 10 / 1_000), math.ceil(data['scope2'] * high * 10 / 1_000)),
-                    'scope3': (math.ceil(data['scope3'] * low * 10 / 1_000), math.ceil(data['scope3'] * high * 10 / 1_000)),
-                    'total': (total_low, total_high),
-                    'profit_total_percent': (percent_low, percent_high)
-                }
-                price_per_ton[method] = (low * 10, high * 10)  # SEK per ton
-            context['costs_per_method'] = costs_per_method
-            context['price_per_ton'] = price_per_ton
         else:
-            messages.error(request, 'Missing required data')
-            return redirect('index')
-        
-        # save results to database
-        result_object = Result(
-            scope1=data['scope1'],
-            scope2=data['scope2'],
-            scope3=data['scope3'],
-            profit=data['profit'],
-            pdfname=pdf_file.name if request.FILES.get('file') else None,
-            email=None
-        )
-        result_object.save()
+            data = _manual_input(request)
+            if data is None:
+                messages.error(request, 'Missing required data')
+                return redirect('index')
+            fingerprint = input_fingerprint(data)
+            cost_snapshot, context = _manual_context(data)
+            result_object = yield ('save_result', fingerprint, _result_defaults(data, None, cost_snapshot))
     else:
         messages.error(request, 'Please submit data first')
         return redirect('index')
-        
-    context['openai_enabled'] = openai_enabled
-    
-    
-    context["result_id"] =  result_object.id
-    return render(request, 'results.html', context)
 
-def ccs_methods(request):
-    result_id = request.GET.get('id')
-    csv_path = os.path.join(settings.BASE_DIR, 'cdr_suppliers_with_links_and_company.csv')
-    df = pd.read_csv(csv_path)
-    df.columns = df.columns.str.strip()
-
-    methods = [
-        "Biochar Carbon Removal (BCR)",
-        "Enhanced Weathering",
-        "Ex-situ Mineralization",
-        "Direct Air Carbon Capture and Storage (DACCS)",
-        "Bioenergy with Carbon Capture and Storage (BECCS)"
-    ]
+    if request.method == 'POST':
+        # Sending happens in the background (see outbox.py); the request only adds a row to the outbox
+        email = _email_recipient(request, context)
+        if email is not None:
+            link = request.build_absolute_uri(reverse('results') + f'?id={result_object.id}')
+            yield ('queue_email', result_object, email, link)
+            messages.info(request, f'The results will be emailed to {email}')
+    if 'costs_per_method' in context:
+        # How the numbers compare with all results saved so far
+        context['peer_comparison'] = yield ('peer_comparison', result_object.input_data())
+    return (yield ('render', request, context, result_object))
+
+def _run_flow(flow, steps):
+    """Run a flow like _results_flow, each step with the method of `steps` of that name."""
+    value, error = None, None
+    while True:
+        try:
+            step = flow.send(value) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        name, *args = step
+        try:
+            value, error = getattr(steps, name)(*args), None
+        except Exception as e:
+            value, error = None, e
+
+class ResultSteps:
+    """The steps of _results_flow for the sync view."""
+
+    def stored_result(self, result_id):
+        return get_object_or_404(Result, id=result_id)
+
+    def stored_context(self, result_object):
+        return _stored_result_context(result_object, result_object.get_cost_snapshot())
+
+    def pdf_fingerprint(self, pdf_file):
+        return input_fingerprint(pdf_file=pdf_file)
+
+    def find_result(self, fingerprint):
+        return Result.objects.filter(input_fingerprint=fingerprint).first()
+
+    def analyze(self, request, pdf_file):
+        # Imported here: the analyzer pulls in pdfplumber, langchain, FAISS and
+        # OpenAI, which most requests never need (see NZC/preload.py)
+        from .pdf_analyzer import extract_info_from_pdf
+
+        with admission.analysis_slot(request):
+            return extract_info_from_pdf(pdf_file)
+
+    def rejected(self, request, rejected):
+        return _rejected_response(request, rejected)
+
+    def save_result(self, fingerprint, defaults):
+        # The unique fingerprint makes this safe when identical requests race
+        with timed('db_save'):
+            result_object, created = Result.objects.get_or_create(input_fingerprint=fingerprint, defaults=defaults)
+        CACHE_LOOKUPS.inc('result', 'miss' if created else 'hit')
+        return result_object
+
+    def queue_email(self, result_object, email, link):
+        with timed('db_save'):
+            return queue_result_email(result_object, email, link)
+
+    def peer_comparison(self, data):
+        with timed('peers'):
+            return PeerStatistic.compare(data)
+
+    def render(self, request, context, result_object):
+        return _render_results(request, context, result_object)
+
+def results(request):
+    """
+    Handle requests to the results page.
+
+    For GET requests:
+        - Fetch and display results for a specific result ID.
+
+    For POST requests:
+        - Process uploaded PDF or manual input data.
+        - Perform calculations and save results to the database. Input that was
+          submitted before (same numbers or same PDF) reuses the existing result.
+
+    Under ASGI the async variant in async_views.py runs the same flow (_results_flow).
+    """
+    return _run_flow(_results_flow(request), ResultSteps())
+
+def _method_pages(request):
+    """
+    Page the precomputed CCS method tables according to the request's query parameters.
+
+    Query parameters:
+        - sort: 'tons_delivered' (default), 'tons_sold' or 'name'.
+        - order: 'desc' (default) or 'asc'.
+        - per_page: Rows per table (default 25, at most 100).
+        - method, page: The page to show for that method; other methods show page 1.
+
+    Returns:
+        tuple: (method_tables, options) where method_tables maps each method to its
+               'page' (a Django Page) and 'aggregates', and options holds the sort,
+               order and per_page that were used.
+    """
+    sort = request.GET.get('sort', 'tons_delivered')
+    if sort not in SORT_FIELDS:
+        sort = 'tons_delivered'
+    order = 'asc' if request.GET.get('order') == 'asc' else 'desc'
+    try:
+        per_page = min(max(int(request.GET.get('per_page', 25)), 1), 100)
+    except ValueError:
+        per_page = 25
+    selected_method = request.GET.get('method')
 
     method_tables = {}
-    for method in methods:
-        suppliers = df[df['Method'] == method][['Name', 'Tons Delivered', 'Tons Sold', 'Company_Link']].to_dict(orient='records')
-        method_tables[method] = suppliers
+    for method, table in load_method_tables().items():
+        page_number = request.GET.get('page') if method == selected_method else 1
+        method_tables[method] = {
+            'page': Paginator(table['orders'][(sort, order)], per_page).get_page(page_number),
+            'aggregates': table['aggregates'],
+        }
+    return method_tables, {'sort': sort, 'order': order, 'per_page': per_page}
 
-    columns = ['Name', 'Tons Delivered', 'Tons Sold', 'Company_Link']
+def ccs_methods(request):
+    result_id = request.GET.get('id')
+    method_tables, options = _method_pages(request)
 
     context = {
         'method_tables': method_tables,
-        'columns': columns,
         'result_id' : result_id,
+        **options,
     }
     return render(request, 'ccs_methods.html', context)
+
+def ccs_methods_api(request):
+    """
+    JSON variant of the CCS methods page, taking the same query parameters.
+
+    Returns:
+        JsonResponse: Per method, the aggregates, the rows of the requested page and
+                      the paging information.
+    """
+    method_tables, options = _method_pages(request)
+    methods = {}
+    for method, table in method_tables.items():
+        page = table['page']
+        methods[method] = {
+            'aggregates': table['aggregates'],
+            'suppliers': list(page.object_list),
+            'page': page.number,
+            'num_pages': page.paginator.num_pages,
+        }
+    return JsonResponse({'methods': methods, **options})
+
+def supplier_search(request):
+    """
+    Search suppliers by name for autocomplete.
+
+    Query parameters:
+        - q: The search text.
+        - limit: Maximum number of results (default 10).
+
+    Returns:
+        JsonResponse: The query and a list of matching suppliers, best first.
+    """
+    query = request.GET.get('q', '')
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        limit = 10
+    matches = get_supplier_index().search(query, limit=limit)
+    return JsonResponse({'query': query, 'results': matches})
+
+# Most companies accepted by one POST /api/v1/calculate
+API_MAX_BATCH = 10_000
+API_FIELDS = ('scope1', 'scope2', 'scope3', 'profit')
+
+def _parse_company(item):
+    """
+    Validate one company of an API request.
+
+    Returns:
+        tuple: (data, errors) where data has the four ints and errors maps
+               field names to messages.
+    """
+    if not isinstance(item, dict):
+        return None, {'company': 'Expected an object'}
+    data, errors = {}, {}
+    for field in API_FIELDS:
+        value = item.get(field)
+        if isinstance(value, bool) or not isinstance(value, int):
+            errors[field] = 'Required, must be an integer'
+        elif value < 0 and field != 'profit':
+            errors[field] = 'Must not be negative'
+        else:
+            data[field] = value
+    return data, errors
+
+def _api_result(data, snapshot, reference=None, result_id=None):
+    result = {
+        'input': data,
+        'price_table_version': snapshot['version'],
+        'methods': snapshot['methods'],
+    }
+    if reference is not None:
+        result['reference'] = reference
+    if result_id is not None:
+        result['id'] = result_id
+    return result
+
+def _result_ids(fingerprints):
+    ids = {}
+    for start in range(0, len(fingerprints), 500):
+        ids.update(Result.objects.filter(input_fingerprint__in=fingerprints[start:start + 500])
+                   .values_list('input_fingerprint', 'id'))
+    return ids
+
+def _persist_calculations(calculations):
+    """
+    Save calculations that don't have a Result yet, in one transaction.
+
+    Args:
+        calculations (list): (data, snapshot) pairs.
+
+    Returns:
+        list: The Result id of every calculation, in order.
+    """
+    fingerprints = [input_fingerprint(data) for data, _ in calculations]
+    unique = list(dict.fromkeys(fingerprints))
+    with transaction.atomic():
+        for attempt in range(3):
+            ids = _result_ids(unique)
+            new = {}
+            for fingerprint, (data, snapshot) in zip(fingerprints, calculations):
+                if fingerprint not in ids and fingerprint not in new:
+                    new[fingerprint] = Result(input_fingerprint=fingerprint, cost_snapshot=snapshot, **data)
+            if not new:
+                break
+            try:
+                with transaction.atomic():
+                    Result.objects.bulk_create(new.values(), batch_size=500)
+            except IntegrityError:
+                # Another request saved some of the same input meanwhile; look again.
+                # Not ignore_conflicts: the peer statistics must count only rows saved here.
+                if attempt == 2:
+                    raise
+                continue
+            # bulk_create skips Result.save, so the peer statistics are updated here
+            PeerStatistic.record_many(result.input_data() for result in new.values())
+            ids.update(_result_ids(list(new)))
+            break
+    return [ids[fingerprint] for fingerprint in fingerprints]
+
+@csrf_exempt
+@require_POST
+def calculate_api(request):
+    """
+    Calculate net zero costs for one company or a batch of companies.
+
+    The body is a JSON object with "scope1", "scope2", "scope3" (tCO₂e) and "profit"
+    (MSEK), all integers, and optionally a "reference" that is returned as is, or an
+    array of such objects (at most API_MAX_BATCH).
+
+    Query parameters:
+        - persist: 'true' to save the calculations as results; each then gets an 'id'
+          usable with /results?id= and /api/v1/results/<id>. Nothing is saved otherwise.
+
+    Returns:
+        JsonResponse: For an object, its 'input', 'price_table_version' and 'methods'
+                      (costs per removal method as in the cost snapshot); for an array,
+                      {'count': ..., 'results': [...]} in the same order. Invalid input
+                      gives status 400 with 'error' and, per company, 'errors'.
+    """
+    parsed = _api_calculations(request)
+    if isinstance(parsed, JsonResponse):
+        return parsed
+    items, batch, calculations = parsed
+
+    result_ids = None
+    if request.GET.get('persist') == 'true':
+        with timed('db_save'):
+            result_ids = _persist_calculations(calculations)
+    return _api_response(items, batch, calculations, result_ids)
+
+def _api_calculations(request):
+    """
+    Parse and calculate the body of a calculate_api request.
+
+    Returns:
+        tuple or JsonResponse: (items, batch, calculations), calculations being
+                               (data, snapshot) pairs, or the 400 response for bad input.
+    """
+    try:
+        payload = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return JsonResponse({'error': 'Request body must be JSON'}, status=400)
+
+    batch = isinstance(payload, list)
+    items = payload if batch else [payload]
+    if not items:
+        return JsonResponse({'error': 'No companies given'}, status=400)
+    if len(items) > API_MAX_BATCH:
+        return JsonResponse({'error': f'At most {API_MAX_BATCH} companies per request'}, status=400)
+
+    companies, errors = [], []
+    for index, item in enumerate(items):
+        data, item_errors = _parse_company(item)
+        if item_errors:
+            errors.append({'index': index, 'errors': item_errors})
+        elif not errors:
+            companies.append(data)
+    if errors:
+        return JsonResponse({'error': 'Invalid input', 'errors': errors[:100]}, status=400)
+    with timed('costs'):
+        # The whole batch at once; same numbers as compute_cost_snapshot per company
+        snapshots = compute_cost_snapshots(companies)
+    return items, batch, list(zip(companies, snapshots))
+
+def _api_response(items, batch, calculations, result_ids=None):
+    if result_ids is None:
+        result_ids = [None] * len(calculations)
+    results = [
+        _api_result(data, snapshot, item.get('reference'), result_id)
+        for item, (data, snapshot), result_id in zip(items, calculations, result_ids)
+    ]
+    if batch:
+        return JsonResponse({'count': len(results), 'results': results})
+    return JsonResponse(results[0])
+
+@require_GET
+def result_api(request, result_id):
+    """
+    JSON variant of the results page for a saved result.
+
+    Returns:
+        JsonResponse: The result's 'id', 'created_at', 'pdfname', 'input',
+                      'price_table_version', 'methods' and 'peers' (see
+                      PeerStatistic.compare), or status 404.
+    """
+    result_object = Result.objects.filter(id=result_id).first()
+    if result_object is None:
+        return JsonResponse({'error': f'Result {result_id} does not exist'}, status=404)
+    return JsonResponse(_stored_result_json(result_object))
+
+def _stored_result_json(result_object):
+    data = result_object.input_data()
+    response = _api_result(data, result_object.get_cost_snapshot(), result_id=result_object.id)
+    response['created_at'] = result_object.created_at
+    response['pdfname'] = result_object.pdfname
+    response['peers'] = PeerStatistic.compare(data)
+    return response
+
+def _streaming_export(request, chunks, export_format, filename):
+    """
+    Send export chunks as they are produced, without a Content-Length (chunked).
+    Under ASGI the chunks are produced in the thread that owns the database
+    connection, one at a time, since Django would otherwise read them all first.
+    """
+    if isinstance(request, ASGIRequest):
+        chunks = _async_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=exports.FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
+
+async def _async_chunks(chunks):
+    chunks = iter(chunks)
+    while True:
+        chunk = await sync_to_async(next)(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+@require_GET
+def export_result(request, result_id, export_format):
+    """
+    Download the cost table of a saved result as CSV, XLSX or PDF, with the same
+    numbers as the results page.
+    """
+    if export_format not in exports.FORMATS:
+        raise Http404(f'Unknown export format {export_format}')
+    result_object = get_object_or_404(Result, id=result_id)
+    if export_format == 'pdf':
+        chunks = exports.result_pdf_chunks(result_object)
+    elif export_format == 'xlsx':
+        chunks = exports.xlsx_chunks(exports.RESULT_COLUMNS, exports.result_rows(result_object))
+    else:
+        chunks = exports.csv_chunks(exports.RESULT_COLUMNS, exports.result_rows(result_object))
+    return _streaming_export(request, chunks, export_format, f'net-zero-result-{result_object.id}')
+
+@staff_member_required
+@require_GET
+def export_results(request, export_format):
+    """
+    Download every saved result in a date range as CSV, XLSX or PDF, streamed so
+    that any number of results can be exported.
+
+    Query parameters:
+        - from, to: First and last day (YYYY-MM-DD) of the results to include; both optional.
+    """
+    if export_format not in exports.FORMATS:
+        raise Http404(f'Unknown export format {export_format}')
+    results = Result.objects.order_by('id')
+    dates = {}
+    for parameter, lookup in (('from', 'created_at__date__gte'), ('to', 'created_at__date__lte')):
+        if request.GET.get(parameter):
+            try:
+                dates[parameter] = parse_date(request.GET[parameter])
+            except ValueError:
+                dates[parameter] = None
+            if dates[parameter] is None:
+                return HttpResponseBadRequest(f'{parameter} must be a date as YYYY-MM-DD')
+            results = results.filter(**{lookup: dates[parameter]})
+    results = results.defer('email', 'input_fingerprint').iterator(chunk_size=exports.BATCH_SIZE)
+
+    period = ' '.join(f'{parameter} {date}' for parameter, date in dates.items())
+    if export_format == 'pdf':
+        chunks = exports.range_pdf_chunks(results, f'Net Zero Calculator – results {period}'.strip())
+    elif export_format == 'xlsx':
+        chunks = exports.xlsx_chunks(exports.RANGE_COLUMNS, exports.range_rows(results), sheet='Results')
+    else:
+        chunks = exports.csv_chunks(exports.RANGE_COLUMNS, exports.range_rows(results))
+    filename = '-'.join(['net-zero-results', *period.split()])
+    return _streaming_export(request, chunks, export_format, filename)
+
+def _database_ready():
+    """Whether the database can be queried and has the app's tables."""
+    try:
+        Result.objects.exists()
+    except DatabaseError:
+        return False
+    return True
+
+def ready(request):
+    """
+    Readiness probe: 200 with what is loaded in this worker (see preload.warm_state),
+    or 503 while the database can't be used or preloading is on and hasn't succeeded.
+    """
+    from .preload import warm_state
+    state = warm_state()
+    state['database'] = _database_ready()
+    state['ready'] = state['ready'] and state['database']
+    return JsonResponse(state, status=200 if state['ready'] else 503)
+
+def metrics(request):
+    """Request, stage, cache and LLM metrics of this process in the Prometheus text format."""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required
+def profile_list(request):
+    """Admin page listing the stored request profiles."""
+    return render(request, 'admin/profiles.html', {
+        'title': 'Request profiles',
+        'profiles': profiling.list_profiles(),
+        'query_parameter': profiling.QUERY_PARAMETER,
+    })
+
+@staff_member_required
+def profile_download(request, name):
+    """
+    Download a stored profile as a .prof file, or with ?format=text show the
+    functions with the most cumulative time.
+    """
+    path = profiling.profile_path(name)
+    if path is None:
+        raise Http404(f'No profile {name}')
+    if request.GET.get('format') == 'text':
+        return HttpResponse(profiling.profile_summary(path), content_type='text/plain; charset=utf-8')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{name}.prof')
@@ -0,0 +1,52 @@
+"""
+Benchmark for the concurrent company-link fetcher.
+
+Starts the local cdr.fyi fixture server with an artificial per-page latency and
+fetches every supplier page at several concurrency levels. Concurrency 1 is the
+serial baseline; the old script additionally slept 2 s per page.
+
+Run from the repository root:
+    python benchmarks/bench_company_links.py [--latency 0.2] [--concurrency 1 8 16]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraping.company_links import fetch_company_links  # noqa: E402
+from scraping.fixture_server import load_fixture_suppliers, start_fixture_server  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds per page on the fixture server")
+    parser.add_argument('--fail-every', type=int, default=0, help="Make every n-th request fail with 503")
+    parser.add_argument('--host-interval', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 16])
+    args = parser.parse_args()
+
+    suppliers = load_fixture_suppliers()
+    server, base_url = start_fixture_server(suppliers, latency=args.latency, fail_every=args.fail_every)
+    links = [f"{base_url}/supplier/{s['slug']}" for s in suppliers]
+    expected = {f"{base_url}/supplier/{s['slug']}": s['Company_Link'] or "N/A" for s in suppliers}
+
+    try:
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            found = asyncio.run(fetch_company_links(links, concurrency=concurrency, host_interval=args.host_interval))
+            elapsed = time.perf_counter() - start
+            correct = sum(found[link] == expected[link] for link in found)
+            print(
+                f"concurrency={concurrency:3d}: {len(found)} pages in {elapsed:.2f} s "
+                f"({len(found) / elapsed:.1f} pages/s), {correct}/{len(found)} links correct"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Prompt context benchmark: how many tokens of report text the PDF analyzer sends to
+GPT, and whether the figures to extract are still in it, before and after the
+compression stage (NZC/context_compression.py).
+
+Every run generates annual-report-like texts with known Scope 1-3 and profit
+figures, among distractors: earlier years in the same tables, location-based
+Scope 2, other financial lines, narrative percentages and repeated page headers.
+The texts go through the analyzer's splitter, vector store and similarity search
+with the local hashing embeddings (NZC_MOCK_LLM=1), so no API key is needed. For
+the old context (exact-duplicate removal, 12,000 words in retrieval order) and the
+compressed one at every budget it reports:
+
+- tokens: prompt context tokens (tiktoken, or the estimate without its encoding)
+- recall: share of figures whose label and value are both still in the context
+- accuracy: share of figures the stand-in model (NZC/mock_llm.py) reads correctly;
+  it takes the first number after each label, so it is a rough proxy for GPT
+- headers: share of figures whose table's column headings (the years) are still
+  in the context. Without it a real model can't tell this year's column
+  from last year's, which the stand-in's accuracy doesn't show.
+- compress_ms: time of the compression stage
+
+Run from the repository root:
+    python benchmarks/bench_context.py [--reports 30] [--budgets 100 200 500 1500]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['NZC_MOCK_LLM'] = '1'
+
+from NZC import pdf_analyzer  # noqa: E402
+from NZC.context_compression import compress_contexts, count_tokens, get_encoding, merge_spans  # noqa: E402
+from NZC.mock_llm import mock_answer  # noqa: E402
+
+FIGURES = {'scope_1': 'Scope 1', 'scope_2': 'Scope 2', 'scope_3': 'Scope 3', 'profit_before_tax': 'Resultat före skatt'}
+
+NARRATIVE = [
+    "Koncernen fortsatte att utveckla verksamheten under året med fokus på lönsam tillväxt och kundnytta.",
+    "Medarbetarna är vår viktigaste resurs och vi investerar löpande i kompetensutveckling och ledarskap.",
+    "The group continued its work to reduce emissions across operations and the value chain.",
+    "Styrelsen bedömer att den finansiella ställningen är god och att likviditeten är tillfredsställande.",
+    "Riskhantering är en integrerad del av styrningen och omfattar både operativa och finansiella risker.",
+    "Our targets are validated by the Science Based Targets initiative against a 1.5 degree pathway.",
+]
+
+
+def fmt(number):
+    return f"{number:,}".replace(',', ' ')
+
+
+def report(rng, pages):
+    """A report text, its true figures and the header of the table each one is in."""
+    truth = {key: rng.randint(100, 900_000) for key in ('scope_1', 'scope_2', 'scope_3')}
+    truth['profit_before_tax'] = rng.randint(10, 20_000)
+    year = rng.randint(2019, 2024)
+    header = f"Årsredovisning {year} | Exempelbolaget AB (publ)"
+
+    sections = [[
+        f"Nettoomsättningen ökade med {rng.randint(2, 30)} procent till {fmt(rng.randint(1_000, 90_000))} MSEK.",
+        f"Antalet anställda uppgick till {fmt(rng.randint(100, 20_000))} vid årets slut.",
+    ], [
+        # Text extracted from a PDF table often has the column headings on a line of their own
+        "Resultaträkning (MSEK)",
+        f"{year} | {year - 1}",
+        f"Nettoomsättning | {fmt(rng.randint(1_000, 90_000))} | {fmt(rng.randint(1_000, 90_000))}",
+        f"Rörelseresultat | {fmt(rng.randint(10, 30_000))} | {fmt(rng.randint(10, 30_000))}",
+        f"Finansnetto | -{fmt(rng.randint(1, 900))} | -{fmt(rng.randint(1, 900))}",
+        f"Resultat före skatt | {fmt(truth['profit_before_tax'])} | {fmt(rng.randint(10, 20_000))}",
+        f"Skatt på årets resultat | -{fmt(rng.randint(1, 4_000))} | -{fmt(rng.randint(1, 4_000))}",
+    ], [
+        "Växthusgasutsläpp (ton CO2e)",
+        f"{year} | {year - 1} | {year - 2}",
+        f"Scope 1 | {fmt(truth['scope_1'])} | {fmt(rng.randint(100, 900_000))} | {fmt(rng.randint(100, 900_000))}",
+        f"Scope 2 (market-based) | {fmt(truth['scope_2'])} | {fmt(rng.randint(100, 900_000))} | {fmt(rng.randint(100, 900_000))}",
+        f"Scope 2 (location-based) | {fmt(rng.randint(100, 900_000))} | {fmt(rng.randint(100, 900_000))} | {fmt(rng.randint(100, 900_000))}",
+        f"Scope 3 | {fmt(truth['scope_3'])} | {fmt(rng.randint(100, 900_000))} | {fmt(rng.randint(100, 900_000))}",
+        "Utsläppen har beräknats enligt GHG-protokollet och verifierats av tredje part.",
+    ], [
+        f"Energianvändning (MWh) | {fmt(rng.randint(1_000, 500_000))} | {fmt(rng.randint(1_000, 500_000))}",
+        f"Andel förnybar el | {rng.randint(10, 100)} % | {rng.randint(10, 100)} %",
+    ]]
+
+    lines = []
+    every = max(1, pages // len(sections))
+    for page in range(pages):
+        lines.append(header)
+        lines += rng.sample(NARRATIVE, 4)
+        if page % every == 0 and sections:
+            lines += sections.pop(rng.randrange(len(sections)))
+        lines.append(f"Sida {page + 1}")
+    headers = {key: f"{year} | {year - 1} | {year - 2}" for key in FIGURES}
+    headers['profit_before_tax'] = f"{year} | {year - 1}"
+    return "\n".join(lines), truth, headers
+
+
+def legacy_context(documents):
+    """The context as built before the compression stage."""
+    unique = []
+    for document in documents:
+        if document.page_content not in unique:
+            unique.append(document.page_content)
+    selected, length = [], 0
+    for context in unique:
+        words = len(context.split())
+        if length + words > 12000:
+            break
+        selected.append(context)
+        length += words
+    return "\n\n---\n\n".join(selected)
+
+
+def score(context, truth, headers):
+    recall = sum(
+        bool(re.search(re.escape(label) + r'[^\n]{0,30}?' + re.escape(fmt(truth[key])), context))
+        for key, label in FIGURES.items())
+    answer = json.loads(mock_answer('Text att analysera:\n' + context))
+    accuracy = sum(answer.get(key) == truth[key] for key in FIGURES)
+    lines = set(context.splitlines())
+    header_recall = sum(headers[key] in lines for key in FIGURES)
+    return recall, accuracy, header_recall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=30)
+    parser.add_argument('--pages', type=int, default=40)
+    parser.add_argument('--budgets', type=int, nargs='+', default=[100, 200, 500, 1500])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    modes = ['legacy'] + [f'budget {budget}' for budget in args.budgets]
+    stats = {mode: {'tokens': [], 'recall': 0, 'accuracy': 0, 'headers': 0, 'ms': []} for mode in modes}
+
+    for _ in range(args.reports):
+        text, truth, headers = report(rng, args.pages)
+        vectordb = pdf_analyzer.create_vector_store(text)
+        documents = [doc for query in pdf_analyzer.QUERIES for doc in vectordb.similarity_search(query, k=3)]
+
+        contexts = {}
+        start = time.perf_counter()
+        contexts['legacy'] = legacy_context(documents)
+        stats['legacy']['ms'].append((time.perf_counter() - start) * 1000)
+        for budget in args.budgets:
+            start = time.perf_counter()
+            contexts[f'budget {budget}'] = compress_contexts(merge_spans(text, documents), budget)
+            stats[f'budget {budget}']['ms'].append((time.perf_counter() - start) * 1000)
+
+        for mode, context in contexts.items():
+            recall, accuracy, header_recall = score(context, truth, headers)
+            stats[mode]['tokens'].append(count_tokens(context))
+            stats[mode]['recall'] += recall
+            stats[mode]['accuracy'] += accuracy
+            stats[mode]['headers'] += header_recall
+
+    figures = args.reports * len(FIGURES)
+    print(f"{args.reports} reports of {args.pages} pages; tokens counted with "
+          f"{'tiktoken' if get_encoding() else 'the estimate (tiktoken encoding unavailable)'}")
+    print(f"{'context':<14}{'tokens (mean)':>15}{'tokens (max)':>14}{'recall':>9}{'accuracy':>10}{'headers':>9}"
+          f"{'compress_ms':>13}")
+    legacy_tokens = statistics.mean(stats['legacy']['tokens'])
+    for mode in modes:
+        tokens = stats[mode]['tokens']
+        print(f"{mode:<14}{statistics.mean(tokens):>15.0f}{max(tokens):>14}"
+              f"{stats[mode]['recall'] / figures:>9.0%}{stats[mode]['accuracy'] / figures:>10.0%}"
+              f"{stats[mode]['headers'] / figures:>9.0%}"
+              f"{statistics.mean(stats[mode]['ms']):>13.2f}"
+              + ('' if mode == 'legacy' else f"   ({1 - statistics.mean(tokens) / legacy_tokens:.0%} fewer tokens)"))
+
+
+if __name__ == '__main__':
+    main()
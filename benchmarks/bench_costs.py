@@ -0,0 +1,136 @@
+"""
+Cost calculation benchmark: how long computing the net zero costs takes for 1, 1k,
+100k and 10M companies on each path of NZC/costs.py.
+
+- page: compute_cost_snapshot and cost_tables per company, as the results page does
+- scalar: compute_cost_snapshot for every company of a batch of the API's largest
+  request (API_MAX_BATCH companies), as POST /api/v1/calculate did before batches
+  were vectorized
+- batch: compute_cost_snapshots per batch, as POST /api/v1/calculate does
+- arrays: compute_cost_arrays in chunks of --chunk companies, without building
+  snapshots
+
+The companies are random with emissions and profits spread over several orders
+of magnitude. Every size is computed in chunks that are dropped afterwards, so
+memory stays flat. The paths that build snapshots take some minutes at 10M
+companies and only run up to --scalar-max companies (default 100k).
+
+Before timing, the first chunk of every size is checked to give the same numbers on
+every path (NZC/tests.py checks this more thoroughly).
+
+Run from the repository root:
+    python benchmarks/bench_costs.py [--sizes 1 1000 100000 10000000] [--scalar-max 100000]
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NZC.costs import SCOPES, compute_cost_arrays, compute_cost_snapshot, compute_cost_snapshots, cost_tables  # noqa: E402
+
+# Largest batch of POST /api/v1/calculate (views.API_MAX_BATCH; not imported to keep Django out)
+API_MAX_BATCH = 10_000
+
+
+def synthetic_chunks(size, chunk, seed):
+    """(scope1, scope2, scope3, profit) arrays of up to chunk companies each, size companies in all."""
+    rng = np.random.default_rng(seed)
+    for start in range(0, size, chunk):
+        count = min(chunk, size - start)
+        scopes = [np.floor(10 ** rng.uniform(0, 8, count)).astype(np.int64) for _ in SCOPES]
+        profit = np.floor(10 ** rng.uniform(0, 5, count))
+        # Some companies have a loss, some no profit stated
+        profit[rng.random(count) < 0.1] *= -1
+        profit[rng.random(count) < 0.05] = np.nan
+        yield (*scopes, profit)
+
+
+def rows(scope1, scope2, scope3, profit):
+    """The chunk as the dicts the views pass to compute_cost_snapshot."""
+    return [
+        {'scope1': s1, 'scope2': s2, 'scope3': s3, 'profit': '-' if math.isnan(p) else int(p)}
+        for s1, s2, s3, p in zip(scope1.tolist(), scope2.tolist(), scope3.tolist(), profit.tolist())
+    ]
+
+
+def page(chunk):
+    for data in rows(*chunk):
+        cost_tables(compute_cost_snapshot(data))
+
+
+def batches(chunk):
+    companies = rows(*chunk)
+    for start in range(0, len(companies), API_MAX_BATCH):
+        yield companies[start:start + API_MAX_BATCH]
+
+
+def scalar(chunk):
+    for companies in batches(chunk):
+        # The API keeps a batch's snapshots for its response
+        [compute_cost_snapshot(data) for data in companies]
+
+
+def batch(chunk):
+    for companies in batches(chunk):
+        compute_cost_snapshots(companies)
+
+
+def arrays(chunk):
+    compute_cost_arrays(*chunk)
+
+
+PATHS = {'page': page, 'scalar': scalar, 'batch': batch, 'arrays': arrays}
+
+
+def check(chunk):
+    """Raise if the paths disagree on the first 2000 companies of a chunk."""
+    sample = tuple(values[:2000] for values in chunk)
+    companies = rows(*sample)
+    expected = [compute_cost_snapshot(data) for data in companies]
+    if compute_cost_snapshots(companies) != expected:
+        raise AssertionError("compute_cost_snapshots differs from compute_cost_snapshot")
+    computed = compute_cost_arrays(*sample)
+    for index, snapshot in enumerate(expected):
+        for method, costs in snapshot['methods'].items():
+            percent = [value[index] for value in computed[method]['profit_total_percent']]
+            if ([int(value[index]) for value in computed[method]['total']] != costs['total']
+                    or ["-" if math.isnan(value) else value for value in percent] != costs['profit_total_percent']):
+                raise AssertionError(f"compute_cost_arrays differs from compute_cost_snapshot for {companies[index]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 1_000, 100_000, 10_000_000])
+    parser.add_argument('--scalar-max', type=int, default=100_000,
+                        help="Largest size to run the paths that build snapshots for.")
+    parser.add_argument('--chunk', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # Imports numpy's lazy parts and warms caches outside the timings
+    arrays(next(synthetic_chunks(1, 1, args.seed)))
+
+    print(f"{'companies':>10}  {'path':<7}{'seconds':>10}{'µs/company':>12}{'companies/s':>14}")
+    for size in args.sizes:
+        check(next(synthetic_chunks(size, args.chunk, args.seed)))
+        for name, run in PATHS.items():
+            if name != 'arrays' and size > args.scalar_max:
+                print(f"{size:>10}  {name:<7}{'skipped (--scalar-max)':>36}")
+                continue
+            elapsed = 0.0
+            for chunk in synthetic_chunks(size, args.chunk, args.seed):
+                # Only the calculation is timed, not generating the companies
+                start = time.perf_counter()
+                run(chunk)
+                elapsed += time.perf_counter() - start
+            print(f"{size:>10}  {name:<7}{elapsed:>10.3f}{elapsed / size * 1e6:>12.2f}{size / elapsed:>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
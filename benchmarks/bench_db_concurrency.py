@@ -0,0 +1,179 @@
+"""
+Concurrent read/write benchmark for the SQLite database profiles.
+
+Runs the results view through Django's test client in several worker processes at
+once, all on the same database file, like the worker processes of a pre-fork
+server: most requests show a stored result (GET /results?id=...), the rest submit
+a new calculation (POST /results), which writes a row. Separate processes (rather
+than threads, which share Python's GIL and serialise most of the work) make the
+writes really contend for SQLite's lock.
+
+Every configuration gets a fresh database in a temporary directory, so the tracked
+db.sqlite3 is never touched:
+
+- default:      SQLite's and Django's defaults (rollback journal)
+- tuned:        DB_PROFILE=tuned (busy timeout, IMMEDIATE write transactions,
+                persistent connections), still with the rollback journal
+- tuned+wal:    the same after `manage.py set_journal_mode wal`
+
+Run from the repository root:
+    python benchmarks/bench_db_concurrency.py [--processes 4] [--duration 5] [--write-ratio 0.2]
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# name: (DB_PROFILE, journal mode)
+CONFIGURATIONS = {
+    'default': ('default', 'delete'),
+    'tuned': ('tuned', 'delete'),
+    'tuned+wal': ('tuned', 'wal'),
+}
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def setup_django(db_path):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DAT257.settings')
+    os.environ['NZC_DB_PATH'] = db_path
+    from django.conf import settings
+    settings.ALLOWED_HOSTS = ['testserver']
+    import django
+    django.setup()
+
+
+def prepare(db_path, journal_mode, seed_rows):
+    """Create and fill the database; runs in a child process."""
+    setup_django(db_path)
+    from django.core.management import call_command
+
+    from NZC.models import Result
+
+    call_command('migrate', verbosity=0)
+    call_command('set_journal_mode', journal_mode, verbosity=0)
+    Result.objects.bulk_create(
+        Result(scope1=random.randint(0, 10**6), scope2=random.randint(0, 10**6),
+               scope3=random.randint(0, 10**7), profit=random.randint(1, 10**5), input_fingerprint=str(index))
+        for index in range(seed_rows)
+    )
+
+
+def work(db_path, start_at, duration, write_ratio):
+    """Send requests until the deadline; runs in each worker process."""
+    setup_django(db_path)
+    from django.db import connections
+    from django.test import Client
+
+    from NZC.models import Result
+
+    ids = list(Result.objects.values_list('id', flat=True))
+    client = Client(raise_request_exception=True)
+    rng = random.Random()
+    stats = {'reads': [], 'writes': [], 'errors': 0, 'locked': 0}
+
+    # All workers start together
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        write = rng.random() < write_ratio
+        start = time.perf_counter()
+        try:
+            if write:
+                response = client.post('/results', {
+                    'scope1': rng.randint(0, 10**6), 'scope2': rng.randint(0, 10**6),
+                    'scope3': rng.randint(0, 10**7), 'profit': rng.randint(1, 10**5),
+                })
+            else:
+                response = client.get('/results', {'id': rng.choice(ids)})
+            ok = response.status_code == 200
+            locked = False
+        except Exception as e:
+            ok = False
+            locked = 'locked' in str(e)
+        elapsed = time.perf_counter() - start
+        if ok:
+            stats['writes' if write else 'reads'].append(elapsed)
+        else:
+            stats['errors'] += 1
+            stats['locked'] += locked
+    connections.close_all()
+    return stats
+
+
+def child(args, *extra):
+    return [sys.executable, os.path.abspath(__file__), *extra, '--seed-rows', str(args.seed_rows),
+            '--duration', str(args.duration), '--write-ratio', str(args.write_ratio)]
+
+
+def run_configuration(args, profile, journal_mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.sqlite3')
+        env = {**os.environ, 'DB_PROFILE': profile}
+        subprocess.run(child(args, '--prepare', db_path, '--journal-mode', journal_mode),
+                       cwd=ROOT, env=env, check=True)
+        # Time for the workers to start Django before the common start
+        start_at = time.time() + 3
+        workers = [
+            subprocess.Popen(child(args, '--work', db_path, '--start-at', str(start_at)),
+                             cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            for _ in range(args.processes)
+        ]
+        stats = {'reads': [], 'writes': [], 'errors': 0, 'locked': 0}
+        for worker in workers:
+            stdout, stderr = worker.communicate()
+            if worker.returncode != 0:
+                raise RuntimeError(f"Worker failed:\n{stderr[-2000:]}")
+            result = json.loads(stdout.strip().splitlines()[-1])
+            for key in stats:
+                stats[key] += result[key]
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0, help="Seconds per configuration")
+    parser.add_argument('--write-ratio', type=float, default=0.2, help="Share of requests that write")
+    parser.add_argument('--seed-rows', type=int, default=1000, help="Results in the database before the run")
+    parser.add_argument('--configurations', nargs='+', choices=list(CONFIGURATIONS), default=list(CONFIGURATIONS))
+    parser.add_argument('--prepare', help=argparse.SUPPRESS)
+    parser.add_argument('--journal-mode', help=argparse.SUPPRESS)
+    parser.add_argument('--work', help=argparse.SUPPRESS)
+    parser.add_argument('--start-at', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.prepare:
+        prepare(args.prepare, args.journal_mode, args.seed_rows)
+        return
+    if args.work:
+        print(json.dumps(work(args.work, args.start_at, args.duration, args.write_ratio)))
+        return
+
+    print(f"{args.processes} processes, {args.duration:.0f} s per configuration, {args.write_ratio:.0%} writes")
+    print(f"{'configuration':<14} {'req/s':>8} {'reads':>7} {'writes':>7} {'errors':>7} {'locked':>7} "
+          f"{'read p50/p95 ms':>16} {'write p50/p95 ms':>17}")
+    for name in args.configurations:
+        s = run_configuration(args, *CONFIGURATIONS[name])
+        completed = len(s['reads']) + len(s['writes'])
+        print(f"{name:<14} {completed / args.duration:8.1f} {len(s['reads']):7d} {len(s['writes']):7d} "
+              f"{s['errors']:7d} {s['locked']:7d} "
+              f"{percentile(s['reads'], 50) * 1000:7.1f}/{percentile(s['reads'], 95) * 1000:<8.1f} "
+              f"{percentile(s['writes'], 50) * 1000:7.1f}/{percentile(s['writes'], 95) * 1000:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmark for the map address scraper.
+
+Serves the offline map stand-in with an artificial search delay and looks up every
+company with 1, 2 and 4 headless browsers, checking the addresses against the CSV
+the map was built from. The old script slept about 5 s per company on top of the
+search itself. Needs Chrome.
+
+Run from the repository root:
+    python benchmarks/bench_map_scraper.py [--search-delay 0.3] [--workers 1 2 4] [--limit 40]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraping.fixture_server import load_fixture_locations, start_fixture_server  # noqa: E402
+from scraping.map_locations import scrape_locations  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--search-delay', type=float, default=0.3, help="Seconds the map takes to answer a search")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--limit', type=int, default=40, help="Companies to look up per run")
+    args = parser.parse_args()
+
+    locations = load_fixture_locations()
+    if not locations:
+        sys.exit("company_locations.csv is missing or has no addresses to serve")
+    server, base_url = start_fixture_server(locations=locations, search_delay=args.search_delay)
+    companies = [{'name': l['name'], 'tons': '', 'method': ''} for l in locations[:args.limit]]
+    expected = {l['name']: l['geo_address'] for l in locations}
+
+    try:
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as tmp:
+                start = time.perf_counter()
+                results = scrape_locations(companies, map_url=f"{base_url}/map", workers=workers,
+                                           checkpoint_path=os.path.join(tmp, 'checkpoint.jsonl'))
+                elapsed = time.perf_counter() - start
+            correct = sum(r['geo_address'] == expected[r['name']] for r in results)
+            print(
+                f"workers={workers}: {len(results)} companies in {elapsed:.2f} s "
+                f"({len(results) / elapsed:.2f}/s), {correct}/{len(results)} addresses correct"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+Worker startup benchmark: cold-start latency and memory of the web app across
+forked workers, with and without preloading (NZC_PRELOAD=1, see NZC/preload.py).
+
+Each mode runs in a fresh process that sets up Django (which preloads in the
+preload mode) and serves the start page. It then forks workers the way a pre-fork
+server does. Every worker makes its first request to each page in PATHS and its
+first PDF analysis (a generated report, with the stand-in LLM and no latency),
+timing each, so the figures are what the first users after a restart wait. Once
+all workers are done they report their memory together. PSS (proportional set
+size) splits pages shared with the parent and the other workers between them, so
+the parent's and workers' PSS add up to what the processes really use; it is read
+from /proc and missing on systems without it.
+
+Run from the repository root:
+    python benchmarks/bench_startup.py [--workers 4]
+"""
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = {'lazy': '0', 'preload': '1'}
+
+PATHS = ['/', '/manual', '/ccs_methods', '/map', '/api/v1/suppliers/search?q=bio', '/ready']
+
+
+def memory_mb():
+    """Current RSS and PSS of this process in MB (PSS is None without /proc)."""
+    rss = pss = None
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Rss:'):
+                    rss = int(line.split()[1]) / 1024
+                elif line.startswith('Pss:'):
+                    pss = int(line.split()[1]) / 1024
+    except OSError:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return rss, pss
+
+
+def run_worker(client, write_fd, measure_fd, exit_fd):
+    try:
+        report = warm_up(client)
+    except Exception as e:
+        report = {'error': f'{type(e).__name__}: {e}'}
+
+    # Measure once every worker has warmed up, while all of them are alive
+    os.write(write_fd, b'done\n')
+    os.read(measure_fd, 1)
+    report['rss_mb'], report['pss_mb'] = memory_mb()
+    os.write(write_fd, (json.dumps(report) + '\n').encode())
+    os.read(exit_fd, 1)
+
+
+def warm_up(client):
+    timings = {}
+    for path in PATHS:
+        start = time.perf_counter()
+        client.get(path)
+        timings[path] = (time.perf_counter() - start) * 1000
+    from NZC.management.commands.loadtest import fixture_pdf
+    start = time.perf_counter()
+    from NZC.pdf_analyzer import extract_info_from_pdf
+    extract_info_from_pdf(io.BytesIO(fixture_pdf(1200, 340, 56000, 780)))
+    timings['PDF analysis'] = (time.perf_counter() - start) * 1000
+    return {'timings': timings}
+
+
+def run_mode(workers):
+    """Measure the mode in NZC_PRELOAD; runs inside the child process."""
+    os.environ['NZC_MOCK_LLM'] = '1'
+    os.environ['NZC_MOCK_LLM_LATENCY'] = '0'
+    # None of the measured paths needs the database; keep the real one untouched
+    os.environ['NZC_DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    start = time.perf_counter()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DAT257.settings')
+    from django.conf import settings
+    settings.ALLOWED_HOSTS = ['testserver']
+
+    import django
+    django.setup()
+    from django.db import connections
+    from django.test import Client
+    from django.urls import get_resolver
+    get_resolver().url_patterns  # Imports NZC.views
+    startup = time.perf_counter() - start
+
+    client = Client()
+    start = time.perf_counter()
+    client.get('/')
+    first_request = time.perf_counter() - start
+    connections.close_all()
+
+    read_fd, write_fd = os.pipe()
+    measure_read, measure_write = os.pipe()
+    exit_read, exit_write = os.pipe()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                run_worker(client, write_fd, measure_read, exit_read)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        for _ in range(workers):
+            f.readline()
+        os.write(measure_write, b'x' * workers)
+        reports = [json.loads(f.readline()) for _ in range(workers)]
+        parent_rss, parent_pss = memory_mb()
+        os.write(exit_write, b'x' * workers)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+    errors = [r['error'] for r in reports if 'error' in r]
+    if errors:
+        raise RuntimeError(f"Worker failed: {errors[0]}")
+
+    def total(key, parent):
+        values = [r[key] for r in reports]
+        return None if parent is None or None in values else parent + sum(values)
+
+    return {
+        'startup_ms': startup * 1000,
+        'first_request_ms': first_request * 1000,
+        'timings': {name: sum(r['timings'][name] for r in reports) / workers for name in reports[0]['timings']},
+        'parent_rss_mb': parent_rss,
+        'worker_rss_mb': sum(r['rss_mb'] for r in reports) / workers,
+        'total_rss_mb': total('rss_mb', parent_rss),
+        'total_pss_mb': total('pss_mb', parent_pss),
+    }
+
+
+def fmt(value, width):
+    return f"{'-':>{width}}" if value is None else f"{value:{width}.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4, help="Workers forked per mode")
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(args.workers)))
+        return
+
+    results = {}
+    for mode in args.modes:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', '--workers', str(args.workers)],
+            cwd=ROOT, env={**os.environ, 'NZC_PRELOAD': MODES[mode]}, capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            print(f"{mode} failed:\n{completed.stderr[-2000:]}")
+            continue
+        results[mode] = json.loads(completed.stdout.strip().splitlines()[-1])
+    if not results:
+        return
+
+    modes = list(results)
+    print(f"{args.workers} forked workers per mode; latencies are each worker's first, averaged")
+    print(f"{'':<46}" + ''.join(f"{mode:>12}" for mode in modes))
+    rows = [('startup ms', 'startup_ms'), ('parent 1st request ms', 'first_request_ms')]
+    rows += [(f"worker 1st {name} ms", name) for name in results[modes[0]]['timings']]
+    rows += [('parent RSS MB', 'parent_rss_mb'), ('worker RSS MB', 'worker_rss_mb'),
+             ('total RSS MB', 'total_rss_mb'), ('total PSS MB', 'total_pss_mb')]
+    for label, key in rows:
+        values = [results[mode]['timings'].get(key) if key in results[mode]['timings'] else results[mode].get(key)
+                  for mode in modes]
+        print(f"{label:<46}" + ''.join(fmt(value, 12) for value in values))
+
+if __name__ == '__main__':
+    main()
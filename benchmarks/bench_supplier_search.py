@@ -0,0 +1,124 @@
+"""
+Benchmark for the supplier search index.
+
+Builds a SupplierIndex over synthetic suppliers (100k by default) and reports build
+time and query latency for prefix, multi-word and misspelled queries. Exits with
+status 1 if the p95 or p99 latency of any query kind reaches --target-ms.
+
+Run from the repository root:
+    python benchmarks/bench_supplier_search.py [--suppliers 100000] [--queries 5000]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NZC.supplier_search import SupplierIndex  # noqa: E402
+
+METHODS = [
+    "Biochar Carbon Removal (BCR)",
+    "Enhanced Weathering",
+    "Ex-situ Mineralization",
+    "Direct Air Carbon Capture and Storage (DACCS)",
+    "Bioenergy with Carbon Capture and Storage (BECCS)",
+]
+WORDS = [
+    "carbon", "climate", "green", "earth", "terra", "bio", "char", "air", "ocean", "rock",
+    "stone", "forest", "soil", "blue", "planet", "capture", "removal", "future", "nordic",
+    "solutions", "energy", "labs", "systems", "works", "tech", "minerals", "alpha", "clean",
+]
+SYLLABLES = [
+    "ka", "ro", "mi", "te", "lu", "va", "zen", "tor", "bex", "qui", "dra", "sol", "nox", "fy", "pa",
+    "gri", "hel", "jo", "wen", "ul", "sta", "ber", "cor", "dal", "fin", "gar", "is", "mun", "os", "vik",
+]
+
+
+def synthetic_suppliers(count, seed=0):
+    rng = random.Random(seed)
+    suppliers = []
+    for _ in range(count):
+        brand = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        words = rng.sample(WORDS, rng.randint(0, 2))
+        suppliers.append({
+            'name': " ".join([brand] + [w.capitalize() for w in words]),
+            'method': rng.choice(METHODS),
+            'tons_delivered': int(rng.paretovariate(1.2) * 100),
+            'tons_sold': int(rng.paretovariate(1.1) * 200),
+        })
+    return suppliers
+
+
+def misspell(word, rng):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def queries(suppliers, count, seed=1):
+    rng = random.Random(seed)
+    result = []
+    for _ in range(count):
+        name = rng.choice(suppliers)['name'].lower()
+        words = name.split()
+        kind = rng.random()
+        if kind < 0.5:
+            result.append(('prefix', name[:rng.randint(1, min(len(name), 8))]))
+        elif kind < 0.8 and len(words) > 1:
+            result.append(('multi-word', " ".join(words[:-1] + [words[-1][:3]])))
+        else:
+            result.append(('typo', misspell(words[0], rng)))
+    return result
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--suppliers', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=5_000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--target-ms', type=float, default=1.0,
+                        help="Latency p95 and p99 must stay under for every query kind.")
+    args = parser.parse_args()
+
+    suppliers = synthetic_suppliers(args.suppliers)
+    start = time.perf_counter()
+    index = SupplierIndex(suppliers)
+    print(f"Built index over {len(index)} suppliers in {time.perf_counter() - start:.2f} s")
+
+    timings = {}
+    for kind, query in queries(suppliers, args.queries):
+        start = time.perf_counter()
+        index.search(query, limit=args.limit)
+        timings.setdefault(kind, []).append((time.perf_counter() - start) * 1000)
+
+    all_timings = [t for values in timings.values() for t in values]
+    for kind, values in sorted(timings.items()) + [('all', all_timings)]:
+        print(
+            f"{kind:>10}: n={len(values):5d}  mean={statistics.mean(values):.3f} ms  "
+            f"p50={percentile(values, 50):.3f} ms  p95={percentile(values, 95):.3f} ms  "
+            f"p99={percentile(values, 99):.3f} ms"
+        )
+    # Every kind must stay under the target in its tail, not just on average
+    slow = [
+        f"{kind} p{pct}={percentile(values, pct):.3f} ms"
+        for kind, values in sorted(timings.items()) for pct in (95, 99)
+        if percentile(values, pct) >= args.target_ms
+    ]
+    if slow:
+        print(f"SLOW: {', '.join(slow)} (target < {args.target_ms} ms)")
+        sys.exit(1)
+    print(f"OK: p95 and p99 of every query kind under {args.target_ms} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -21,9 +21,10 @@ def calculate_net_zero_cost(data, cc_method):
 
     Args:
         data (dict): A dictionary containing "scope1", "scope2", "scope3", and "profit".
+            Emissions are in tons CO₂e and profit in MSEK, as on the results page.
         cc_method (dict): A dictionary containing the carbon capture method details, including:
             - "name" (str): The name of the carbon capture method.
-            - "cost_per_ton" (float): The cost per ton of carbon removal.
+            - "cost_per_ton" (float): The cost per ton of carbon removal, in SEK.
 
     Returns:
         dict: A dictionary containing:
@@ -32,8 +33,12 @@ def calculate_net_zero_cost(data, cc_method):
             - "scope2" (int): Emissions from scope 2.
             - "scope3" (int): Emissions from scope 3.
             - "total_emissions" (int): The total emissions from all scopes.
-            - "cost_to_offset" (float): The total cost to offset the emissions.
-            - "percentage_of_revenue" (float): The percentage of revenue required to offset emissions.
+            - "cost_to_offset" (float): The total cost to offset the emissions, in SEK.
+            - "percentage_of_revenue" (float): The percentage of revenue required to offset emissions,
+              or "-" without a profit.
+
+    The results page (NZC/costs.py) computes the same in TSEK, rounded up to whole TSEK;
+    NZC/tests.py checks that both agree.
     """
     scope1 = data.get("scope1", 0)
     scope2 = data.get("scope2", 0)
@@ -42,7 +47,11 @@ def calculate_net_zero_cost(data, cc_method):
 
     total_emissions = scope1 + scope2 + scope3
     cost_to_offset = total_emissions * cc_method['cost_per_ton']
-    percentage = (cost_to_offset / (revenue*1000000)) * 100
+    if isinstance(revenue, (int, float)) and revenue != 0:
+        # Profit is in MSEK and the cost in SEK
+        percentage = round((cost_to_offset / (revenue*1000000)) * 100, 2)
+    else:
+        percentage = "-"
 
     return {
         "method": cc_method["name"],
@@ -51,6 +60,6 @@ def calculate_net_zero_cost(data, cc_method):
         "scope3": scope3,
         "total_emissions": total_emissions,
         "cost_to_offset": round(cost_to_offset, 2),
-        "percentage_of_revenue": round(percentage, 2)
+        "percentage_of_revenue": percentage
         
     }
\ No newline at end of file
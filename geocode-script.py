@@ -1,78 +1,24 @@
 import pandas as pd
-import requests
-import time
 import os
 from dotenv import load_dotenv
+from scraping.geocoding import NOT_FOUND, Geocoder, GoogleProvider, NominatimProvider
 
 # Load environment variables (for API keys)
 load_dotenv()
 
-def geocode_address(address):
+def make_geocoder():
     """
-    Convert an address to latitude and longitude using Nominatim API
-    (OpenStreetMap's geocoding service)
-    
-    Note: For production use, consider using a paid service like Google Maps API
-    which has better rate limits and more reliable results
-    """
-    # Respect Nominatim's usage policy with a delay between requests
-    time.sleep(1)
-    
-    try:
-        # For a more robust solution in production, consider using Google's Geocoding API
-        # with proper error handling, but it requires an API key
-        base_url = "https://nominatim.openstreetmap.org/search"
-        params = {
-            'q': address,
-            'format': 'json',
-            'limit': 1
-        }
-        headers = {
-            'User-Agent': 'CompanyLocationGeocoder/1.0'  # Required by Nominatim
-        }
-        
-        response = requests.get(base_url, params=params, headers=headers)
-        data = response.json()
-        
-        if data and len(data) > 0:
-            lat = float(data[0]['lat'])
-            lon = float(data[0]['lon'])
-            return lat, lon
-        else:
-            print(f"Could not geocode address: {address}")
-            return None, None
-    except Exception as e:
-        print(f"Error geocoding address {address}: {e}")
-        return None, None
-
-def google_geocode_address(address, api_key):
+    Pick the geocoding provider: Google Maps if GOOGLE_MAPS_API_KEY is set, otherwise
+    Nominatim (OpenStreetMap). Results are cached in geocode_cache.sqlite3, and addresses
+    the offline gazetteer places in a known city never reach the provider.
     """
-    Convert an address to latitude and longitude using Google Maps Geocoding API
-    
-    This is a more reliable option for production use, but requires an API key
-    and may have associated costs
-    """
-    time.sleep(0.1)  # Respect rate limits
-    
-    try:
-        base_url = "https://maps.googleapis.com/maps/api/geocode/json"
-        params = {
-            'address': address,
-            'key': api_key
-        }
-        
-        response = requests.get(base_url, params=params)
-        data = response.json()
-        
-        if data['status'] == 'OK' and data['results']:
-            location = data['results'][0]['geometry']['location']
-            return location['lat'], location['lng']
-        else:
-            print(f"Could not geocode address: {address} (Status: {data['status']})")
-            return None, None
-    except Exception as e:
-        print(f"Error geocoding address {address}: {e}")
-        return None, None
+    google_api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+    if google_api_key is not None:
+        print("Using Google Maps Geocoding API")
+        return Geocoder(GoogleProvider(google_api_key))
+    print("Using Nominatim (OpenStreetMap) Geocoding API")
+    print("For production use, consider using Google Maps API for better results")
+    return Geocoder(NominatimProvider())
 
 def main():
     # Read the input CSV files
@@ -83,42 +29,18 @@ def main():
     suppliers_df.columns = suppliers_df.columns.str.strip()
     locations_df.columns = locations_df.columns.str.strip()
     
-    # Prepare the geocoding
-    google_api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
-    use_google_api = google_api_key is not None
-    
-    if use_google_api:
-        print("Using Google Maps Geocoding API")
-    else:
-        print("Using Nominatim (OpenStreetMap) Geocoding API")
-        print("For production use, consider using Google Maps API for better results")
-    
-    # Create a dictionary to store geocoded locations to avoid redundant lookups
-    geocoded_locations = {}
-    
-    # Geocode each address
+    # Geocode all addresses at once, only addresses missing from the cache and the gazetteer hit the network
+    geocoded_locations = make_geocoder().geocode_batch(locations_df['geo_address'].tolist())
+
     coordinates = []
-    for _, row in locations_df.iterrows():
-        address = row['geo_address']
-        
-        # Skip if we've already geocoded this address
-        if address in geocoded_locations:
-            lat, lon = geocoded_locations[address]
-        else:
-            # Geocode the address using the appropriate service
-            if use_google_api:
-                lat, lon = google_geocode_address(address, google_api_key)
-            else:
-                lat, lon = geocode_address(address)
-                
-            # Store for future use
-            geocoded_locations[address] = (lat, lon)
-        
+    for row in locations_df.itertuples(index=False):
+        location = geocoded_locations.get(row.geo_address, NOT_FOUND)
         coordinates.append({
-            'name': row['name'],
-            'latitude': lat,
-            'longitude': lon,
-            'geo_address': address
+            'name': row.name,
+            'latitude': location.latitude,
+            'longitude': location.longitude,
+            'precision': location.precision,
+            'geo_address': row.geo_address
         })
     
     # Convert to DataFrame
@@ -129,7 +51,7 @@ def main():
     coordinates_df['Name'] = coordinates_df['name']
     
     # Merge the dataframes on the company name
-    result_df = pd.merge(suppliers_df, coordinates_df[['Name', 'latitude', 'longitude', 'geo_address']], 
+    result_df = pd.merge(suppliers_df, coordinates_df[['Name', 'latitude', 'longitude', 'precision', 'geo_address']], 
                          on='Name', how='left')
     
     # Add the location column which combines the coordinates for use in Leaflet
@@ -139,7 +61,7 @@ def main():
     )
     
     # Reorder columns to match the requested format
-    final_df = result_df[['Name', 'Tons Delivered', 'Tons Sold', 'Method', 'CDR_Link', 'Company_Link', 'location', 'geo_address']]
+    final_df = result_df[['Name', 'Tons Delivered', 'Tons Sold', 'Method', 'CDR_Link', 'Company_Link', 'location', 'precision', 'geo_address']]
     
     # Save to a new CSV file
     output_file = 'cdr_suppliers_with_coordinates.csv'
@@ -152,6 +74,7 @@ def main():
     print(f"\nGeocoding complete!")
     print(f"Total suppliers: {total_suppliers}")
     print(f"Successfully geocoded: {geocoded_suppliers} ({geocoded_suppliers / total_suppliers * 100:.1f}%)")
+    print("By precision:", final_df['precision'].value_counts().to_dict())
     print(f"Output saved to: {output_file}")
 
 if __name__ == "__main__":
@@ -0,0 +1,3 @@
+"""
+Shared helpers for the scripts that scrape and prepare the CDR supplier data.
+"""
@@ -0,0 +1,294 @@
+"""
+company_links.py
+
+Concurrent fetching of company links from cdr.fyi supplier pages.
+
+Pages are fetched with a plain async HTTP client. Only pages where the link is not
+in the served HTML (e.g. rendered client-side) are handed to a small pool of
+headless browsers, which wait for the link element to appear instead of sleeping.
+"""
+
+import asyncio
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_HOST_INTERVAL = 0.1  # Minimum seconds between two requests to the same host
+DEFAULT_RETRIES = 3
+DEFAULT_TIMEOUT = 20
+USER_AGENT = 'NetZeroCalculatorScraper/1.0'
+COMPANY_LINK_SELECTOR = "a.text-muted-foreground"
+
+
+def parse_company_link(html):
+    """
+    Find the company link on a cdr.fyi supplier page.
+
+    Args:
+        html (str): The page source.
+
+    Returns:
+        str or None: The company link, or None if the page doesn't contain it.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    tag = soup.select_one(COMPANY_LINK_SELECTOR)
+    return tag.get("href") if tag and tag.get("href") else None
+
+
+class HostThrottle:
+    """
+    Per-host politeness: spaces out the start of requests to the same host by at
+    least `interval` seconds, while requests to different hosts run freely.
+    """
+
+    def __init__(self, interval=DEFAULT_HOST_INTERVAL):
+        self.interval = interval
+        self._next_slot = {}
+
+    async def wait(self, url):
+        host = urlsplit(url).netloc
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(host, 0))
+        self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+Page = namedtuple('Page', ['status', 'text', 'etag', 'last_modified'])
+
+
+async def fetch_page(session, url, throttle, retries=DEFAULT_RETRIES, etag=None, last_modified=None):
+    """
+    GET a page, retrying connection errors, 429 and 5xx responses with exponential
+    backoff (or the server's Retry-After).
+
+    If an ETag or Last-Modified value from an earlier fetch is given, the request is
+    made conditional and an unchanged page comes back as status 304 without a body.
+
+    Args:
+        session (aiohttp.ClientSession): The session to use.
+        url (str): The page to fetch.
+        throttle (HostThrottle): Per-host rate limiting.
+        retries (int): Number of retries after the first attempt.
+        etag (str or None): Sent as If-None-Match.
+        last_modified (str or None): Sent as If-Modified-Since.
+
+    Returns:
+        Page or None: The status, body and validators of the response, or None if
+                      the page could not be fetched.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    for attempt in range(retries + 1):
+        await throttle.wait(url)
+        delay = 0.5 * 2 ** attempt + random.uniform(0, 0.25)
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 429 or response.status >= 500:
+                    retry_after = response.headers.get('Retry-After', '')
+                    if retry_after.isdigit():
+                        delay = int(retry_after)
+                elif response.status >= 400:
+                    print(f"❌ {url} returned {response.status}")
+                    return None
+                else:
+                    text = await response.text() if response.status != 304 else None
+                    return Page(
+                        response.status,
+                        text,
+                        response.headers.get('ETag', etag),
+                        response.headers.get('Last-Modified', last_modified),
+                    )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error fetching {url}: {e!r}")
+        if attempt < retries:
+            await asyncio.sleep(delay)
+    print(f"❌ Giving up on {url} after {retries + 1} attempts")
+    return None
+
+
+async def fetch_html(session, url, throttle, retries=DEFAULT_RETRIES):
+    """
+    GET a page with retries, see fetch_page.
+
+    Returns:
+        str or None: The page source, or None if the page could not be fetched.
+    """
+    page = await fetch_page(session, url, throttle, retries)
+    return page.text if page else None
+
+
+def setup_driver(headless=True, window_size=None):
+    """
+    Configure and return a Chrome webdriver.
+
+    Args:
+        headless (bool): Run without a window.
+        window_size (str or None): e.g. "1920,1080", for pages whose layout depends on it.
+    """
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    options = Options()
+    if headless:
+        options.add_argument("--headless")
+    if window_size:
+        options.add_argument(f"--window-size={window_size}")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+
+
+class BrowserPool:
+    """
+    A small pool of browser sessions for pages that need JavaScript.
+
+    Drivers are started on first use, at most `size` of them, and handed out one
+    caller at a time, so the pool also bounds browser concurrency.
+    """
+
+    def __init__(self, size=2, timeout=15, driver_factory=setup_driver):
+        self.size = size
+        self.timeout = timeout
+        self._driver_factory = driver_factory
+        self._idle = queue.Queue()
+        self._drivers = []
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            start_new = self._started < self.size
+            if start_new:
+                self._started += 1
+        if not start_new:
+            return self._idle.get()
+        try:
+            driver = self._driver_factory()
+        except Exception:
+            with self._lock:
+                self._started -= 1
+            raise
+        with self._lock:
+            self._drivers.append(driver)
+        return driver
+
+    def fetch_company_link(self, url):
+        """
+        Load a supplier page and wait until the company link is rendered.
+
+        Args:
+            url (str): The supplier page.
+
+        Returns:
+            str or None: The company link, or None if it didn't appear in time.
+        """
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        driver = self._acquire()
+        try:
+            driver.get(url)
+            element = WebDriverWait(driver, self.timeout).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, COMPANY_LINK_SELECTOR))
+            )
+            return element.get_attribute("href")
+        except (TimeoutException, WebDriverException) as e:
+            print(f"Browser could not find company link on {url}: {e.__class__.__name__}")
+            return None
+        finally:
+            self._idle.put(driver)
+
+    def close(self):
+        for driver in self._drivers:
+            driver.quit()
+        self._drivers = []
+        self._started = 0
+
+
+async def fetch_company_links(cdr_links, concurrency=DEFAULT_CONCURRENCY, host_interval=DEFAULT_HOST_INTERVAL,
+                              retries=DEFAULT_RETRIES, browser_pool=None, cache=None):
+    """
+    Fetch the company link for every CDR link, at most `concurrency` at a time.
+
+    Args:
+        cdr_links (iterable): Supplier page URLs. Duplicates are fetched once.
+        concurrency (int): Maximum number of pages in flight.
+        host_interval (float): Minimum seconds between requests to the same host.
+        retries (int): Retries per page for failed HTTP requests.
+        browser_pool (BrowserPool or None): Fallback for pages where the link is not in
+            the served HTML. Without a pool those pages get "N/A".
+        cache (dict or None): Maps CDR links to {'company_link', 'etag', 'last_modified'}
+            from earlier runs. Cached pages are fetched conditionally and a 304 reuses
+            the cached company link. Updated in place with the new results; a lookup
+            that failed (the page couldn't be fetched or the browser found nothing)
+            keeps the cached link and gets a 'failed_at' time instead of validators.
+
+    Returns:
+        dict: Maps each CDR link to its company link, or "N/A" if none was found.
+    """
+    links = list(dict.fromkeys(link for link in cdr_links if link))
+    semaphore = asyncio.Semaphore(concurrency)
+    throttle = HostThrottle(host_interval)
+    timeout = aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    cache = cache if cache is not None else {}
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector, headers={'User-Agent': USER_AGENT}) as session:
+        async def fetch_one(link):
+            cached = cache.get(link, {})
+            async with semaphore:
+                page = await fetch_page(session, link, throttle, retries,
+                                        etag=cached.get('etag'), last_modified=cached.get('last_modified'))
+            if page is not None and page.status == 304:
+                print(f"Unchanged: {link}")
+                return link, cached.get('company_link', "N/A")
+
+            company_link = parse_company_link(page.text) if page else None
+            if company_link is None and browser_pool is not None and page is not None:
+                company_link = await asyncio.to_thread(browser_pool.fetch_company_link, link)
+            if company_link is None and (page is None or browser_pool is not None):
+                # The page couldn't be fetched, or the browser timed out: perhaps only this
+                # time, so keep what an earlier run found and try again on the next run
+                company_link = cached.get('company_link', "N/A")
+                print(f"Could not get company link for {link}, keeping {company_link}")
+                cache[link] = {
+                    'company_link': company_link,
+                    'etag': None,
+                    'last_modified': None,
+                    'failed_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                }
+                return link, company_link
+
+            company_link = company_link or "N/A"
+            print(f"Found company link: {company_link} ({link})")
+            cache[link] = {
+                'company_link': company_link,
+                'etag': page.etag,
+                'last_modified': page.last_modified,
+            }
+            return link, company_link
+
+        results = await asyncio.gather(*(fetch_one(link) for link in links))
+    return dict(results)
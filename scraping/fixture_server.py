@@ -0,0 +1,238 @@
+"""
+fixture_server.py
+
+A local HTTP server that mimics the cdr.fyi pages the scrapers read, so they can be
+tested and benchmarked offline.
+
+Routes:
+    /leaderboards?page=N   A leaderboard table page with "View" links.
+    /supplier/<slug>       A supplier page with the company link.
+    /map                   A page embedding the map app in an iframe, like the real one.
+    /map/app               A static stand-in for the map app (data/map_fixture.html).
+
+Every page carries an ETag and answers a matching If-None-Match with 304.
+
+Run it on its own with:
+    python -m scraping.fixture_server [--port 8765] [--latency 0.2] [--search-delay 0.3]
+"""
+
+import argparse
+import csv
+import hashlib
+import html
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_CSV = 'cdr_suppliers_with_links_and_company.csv'
+DEFAULT_LOCATIONS_CSV = 'company_locations.csv'
+MAP_TEMPLATE = os.path.join(os.path.dirname(__file__), 'data', 'map_fixture.html')
+LEADERBOARD_PAGE_SIZE = 10
+
+
+def load_fixture_suppliers(csv_path=DEFAULT_CSV):
+    """
+    Read the suppliers the fixture server should serve.
+
+    Args:
+        csv_path (str): A CSV with the columns Name, Tons Delivered, Tons Sold, Method,
+            CDR_Link and Company_Link.
+
+    Returns:
+        list: One dictionary per supplier, with a 'slug' taken from its CDR_Link.
+    """
+    suppliers = []
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            row = {(key or '').strip(): (value or '').strip() for key, value in row.items()}
+            if not row.get('Name') or not row.get('CDR_Link'):
+                continue
+            row['slug'] = urlsplit(row['CDR_Link']).path.rstrip('/').rsplit('/', 1)[-1]
+            suppliers.append(row)
+    return suppliers
+
+
+def load_fixture_locations(csv_path=DEFAULT_LOCATIONS_CSV):
+    """
+    Read the companies the map stand-in should list.
+
+    Args:
+        csv_path (str): A CSV with the columns name and geo_address, as written by
+            cdr-iframe-scraper.py. Companies without an address are left off the map.
+
+    Returns:
+        list: One {'name', 'geo_address'} dictionary per company.
+    """
+    if not os.path.exists(csv_path):
+        return []
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        return [
+            {'name': row['name'].strip(), 'geo_address': row['geo_address'].strip()}
+            for row in csv.DictReader(f)
+            if row.get('name') and row.get('geo_address') and row['geo_address'] != "Address not found"
+        ]
+
+
+def map_page(locations, search_delay):
+    with open(MAP_TEMPLATE, encoding='utf-8') as f:
+        template = f.read()
+    # Escape "</" so an address can't end the script block
+    data = json.dumps(locations).replace('</', '<\\/')
+    return template.replace('__LOCATIONS__', data).replace('__SEARCH_DELAY__', str(int(search_delay * 1000)))
+
+
+def map_embed_page():
+    return """<!DOCTYPE html>
+<html><head><title>Supplier map</title></head>
+<body><h1>Supplier map</h1><iframe src="/map/app" width="1200" height="800"></iframe></body></html>"""
+
+
+def supplier_page(supplier):
+    company_link = supplier.get('Company_Link')
+    link = f'<a class="text-muted-foreground" href="{html.escape(company_link)}">{html.escape(company_link)}</a>' \
+        if company_link and company_link != 'N/A' else ''
+    return f"""<!DOCTYPE html>
+<html><head><title>{html.escape(supplier['Name'])} | CDR.fyi</title></head>
+<body><main><h1>{html.escape(supplier['Name'])}</h1>{link}
+<p>Tons delivered: {html.escape(supplier.get('Tons Delivered', ''))}</p></main></body></html>"""
+
+
+def leaderboard_page(suppliers, page):
+    start = (page - 1) * LEADERBOARD_PAGE_SIZE
+    rows = "".join(
+        f"<tr><td>{html.escape(s['Name'])}</td><td>{html.escape(s.get('Tons Delivered', ''))}</td>"
+        f"<td>{html.escape(s.get('Tons Sold', ''))}</td><td>{html.escape(s.get('Method', ''))}</td>"
+        f"<td><a href=\"/supplier/{s['slug']}\">View</a></td></tr>"
+        for s in suppliers[start:start + LEADERBOARD_PAGE_SIZE]
+    )
+    num_pages = max(1, -(-len(suppliers) // LEADERBOARD_PAGE_SIZE))
+    buttons = "".join(f"<li><button>{n}</button></li>" for n in range(1, num_pages + 1))
+    return f"""<!DOCTYPE html>
+<html><head><title>Leaderboards | CDR.fyi</title></head>
+<body><table><thead><tr><th>Name</th><th>Tons Delivered</th><th>Tons Sold</th><th>Method</th><th></th></tr></thead>
+<tbody>{rows}</tbody></table><nav><ul>{buttons}</ul></nav></body></html>"""
+
+
+def make_handler(suppliers, latency=0.0, fail_every=0, locations=(), search_delay=0.0):
+    """
+    Build a request handler class serving the given suppliers.
+
+    Args:
+        suppliers (list): Suppliers as returned by load_fixture_suppliers.
+        latency (float): Seconds to wait before answering, to mimic a remote server.
+        fail_every (int): If set, every n-th request gets a 503 to exercise retries.
+        locations (list): Companies listed on the map, as returned by load_fixture_locations.
+        search_delay (float): Seconds the map takes to show search results.
+
+    Returns:
+        type: A BaseHTTPRequestHandler subclass.
+    """
+    counter = {'requests': 0}
+    lock = threading.Lock()
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                counter['requests'] += 1
+                request_number = counter['requests']
+            if latency:
+                time.sleep(latency)
+            if fail_every and request_number % fail_every == 0:
+                self.send_response(503)
+                self.send_header('Retry-After', '0')
+                self.end_headers()
+                return
+
+            url = urlsplit(self.path)
+            # Looked up per request so tests can add, remove or edit suppliers while serving
+            by_slug = {s['slug']: s for s in suppliers}
+            if url.path == '/leaderboards':
+                try:
+                    page = int(parse_qs(url.query).get('page', ['1'])[0])
+                except ValueError:
+                    page = 1
+                body = leaderboard_page(suppliers, page)
+            elif url.path == '/map':
+                body = map_embed_page()
+            elif url.path == '/map/app':
+                body = map_page(list(locations), search_delay)
+            elif url.path.startswith('/supplier/') and url.path[len('/supplier/'):] in by_slug:
+                body = supplier_page(by_slug[url.path[len('/supplier/'):]])
+            else:
+                self.send_error(404)
+                return
+
+            payload = body.encode('utf-8')
+            etag = '"' + hashlib.sha1(payload).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    FixtureHandler.counter = counter
+    return FixtureHandler
+
+
+def start_fixture_server(suppliers=None, latency=0.0, fail_every=0, host='127.0.0.1', port=0,
+                         locations=None, search_delay=0.0):
+    """
+    Start the fixture server in a background thread.
+
+    Args:
+        suppliers (list or None): Suppliers to serve, by default the ones in DEFAULT_CSV.
+        latency (float): Seconds to wait before answering each request.
+        fail_every (int): If set, every n-th request gets a 503.
+        host (str): Interface to bind.
+        port (int): Port to bind, 0 picks a free one.
+        locations (list or None): Companies on the map, by default the ones in DEFAULT_LOCATIONS_CSV.
+        search_delay (float): Seconds the map takes to show search results.
+
+    Returns:
+        tuple: (server, base_url). Call server.shutdown() when done; the number of
+               requests served is in server.RequestHandlerClass.counter['requests'].
+    """
+    if suppliers is None:
+        suppliers = load_fixture_suppliers()
+    if locations is None:
+        locations = load_fixture_locations()
+    server = ThreadingHTTPServer((host, port), make_handler(suppliers, latency, fail_every, locations, search_delay))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve offline copies of the cdr.fyi pages.")
+    parser.add_argument('--csv', default=DEFAULT_CSV)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--fail-every', type=int, default=0)
+    parser.add_argument('--locations-csv', default=DEFAULT_LOCATIONS_CSV)
+    parser.add_argument('--search-delay', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, base_url = start_fixture_server(load_fixture_suppliers(args.csv), args.latency, args.fail_every,
+                                            port=args.port, locations=load_fixture_locations(args.locations_csv),
+                                            search_delay=args.search_delay)
+    print(f"Serving cdr.fyi fixtures on {base_url} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+"""
+gazetteer.py
+
+Offline geocoding of free-text addresses against a bundled gazetteer of country,
+region and city centroids.
+
+The gazetteer is compiled from data/gazetteer.tsv into data/gazetteer.bin: parallel
+arrays of coordinates and parent links plus a sorted token index mapping every
+normalised name and alias to the places it names. Loading it is a handful of
+array reads and resolving an address takes a few binary searches, so most
+supplier addresses are answered without touching the network.
+
+Run `python -m scraping.gazetteer build` after editing the TSV.
+"""
+
+import argparse
+import bisect
+import os
+import re
+import struct
+import sys
+import unicodedata
+from array import array
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+SOURCE_PATH = os.path.join(DATA_DIR, 'gazetteer.tsv')
+GAZETTEER_PATH = os.path.join(DATA_DIR, 'gazetteer.bin')
+
+MAGIC = b'NZCGAZ01'
+HEADER = struct.Struct('<III')
+NO_PARENT = 0xFFFF
+
+KINDS = ('country', 'region', 'city')
+COUNTRY, REGION, CITY = range(3)
+# Longest place name, in tokens, that is looked up ("Santa Cruz de la Sierra")
+MAX_SPAN = 5
+
+# Weight of each kind of match when deciding which country an address is in
+NAME_WEIGHTS = {COUNTRY: 3, REGION: 2, CITY: 2}
+CODE_WEIGHTS = {COUNTRY: 2, REGION: 1, CITY: 1}
+
+# How precise a coordinate is, from best to worst. "address" comes from a geocoding
+# provider, "exact" from an address that already was a coordinate pair.
+PRECISIONS = ('exact', 'address', 'city', 'region', 'country')
+
+Location = namedtuple('Location', ['latitude', 'longitude', 'precision'])
+NOT_FOUND = Location(None, None, None)
+
+COORDINATES_RE = re.compile(r'^\s*(-?\d{1,2}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)\s*$')
+POSTCODE_RE = re.compile(r'^[A-Z]?\d[\dA-Z-]*$')
+
+
+def normalize_token(token):
+    """Casefold a token and strip accents and dots, so "Zürich" matches "zurich" and "N.J." matches "nj"."""
+    token = unicodedata.normalize('NFKD', token.casefold())
+    return ''.join(c for c in token if c.isalnum() and not unicodedata.combining(c))
+
+
+def split_tokens(text):
+    """Split a name or address component into raw tokens."""
+    return [token for token in re.split(r"[^\w.'’]+", text) if token.strip(".'’")]
+
+
+def name_key(name):
+    """The index key of a place name: its normalised tokens joined by spaces."""
+    return ' '.join(filter(None, (normalize_token(token) for token in split_tokens(name))))
+
+
+def is_code(alias):
+    """Aliases like "CA", "NSW" or "N.J." only match when written in capitals in an address."""
+    letters = alias.replace('.', '')
+    return letters.isupper() and letters.isalpha() and len(letters) <= 3
+
+
+class Gazetteer:
+    """
+    Country, region and city centroids with a token index over their names.
+
+    Args:
+        names (list): Display name of every place.
+        latitudes, longitudes (array): Centroids, float32.
+        kinds (array): COUNTRY, REGION or CITY per place.
+        countries (array): Index of each place's country (a country points to itself).
+        regions (array): Index of each city's region, NO_PARENT if unknown.
+        keys (list): Sorted index keys.
+        key_offsets (array): Postings of keys[i] are postings[key_offsets[i]:key_offsets[i + 1]].
+        postings (array): Place index * 2, plus 1 if the key is a capitalised code.
+    """
+
+    def __init__(self, names, latitudes, longitudes, kinds, countries, regions, keys, key_offsets, postings):
+        self.names = names
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.kinds = kinds
+        self.countries = countries
+        self.regions = regions
+        self.keys = keys
+        self.key_offsets = key_offsets
+        self.postings = postings
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, key):
+        """
+        Find the places a normalised key names.
+
+        Returns:
+            list: (place index, is_code) pairs.
+        """
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return []
+        return [(p >> 1, bool(p & 1)) for p in self.postings[self.key_offsets[i]:self.key_offsets[i + 1]]]
+
+    def location(self, place, precision=None):
+        return Location(round(self.latitudes[place], 5), round(self.longitudes[place], 5),
+                        precision or KINDS[self.kinds[place]])
+
+    def _matches(self, address):
+        """Every (position, place, is_code, is_last_component, end position) an address mentions."""
+        components = [c for c in re.split(r'[,;()]|\s-\s', address) if c.strip()]
+        matches = []
+        position = 0
+        for c, component in enumerate(components):
+            raw = split_tokens(component)
+            tokens = [normalize_token(token) for token in raw]
+            for start in range(len(tokens)):
+                for end in range(min(len(tokens), start + MAX_SPAN), start, -1):
+                    places = self.lookup(' '.join(tokens[start:end]))
+                    if not places:
+                        continue
+                    single_capitals = end - start == 1 and is_code(raw[start])
+                    # "CA 95405" is California, a lone trailing "CA" is Canada
+                    before_postcode = end < len(raw) and POSTCODE_RE.match(raw[end]) is not None
+                    for place, code in places:
+                        if code and not single_capitals:
+                            continue
+                        if code and before_postcode and self.kinds[place] == COUNTRY:
+                            continue
+                        matches.append((position + start, place, code, c == len(components) - 1, position + end))
+                    break
+            position += len(tokens)
+        return matches
+
+    def resolve(self, address):
+        """
+        Resolve a free-text address to the most precise place it names.
+
+        The country is decided first, by weighing every country, region and city the
+        address mentions; then the last city in that country is used, or failing
+        that its region, or the country itself. A name shared by a city and its
+        region ("New York") counts as the city only when the region is named again
+        later in the address. A city is not returned when the address also names a
+        region or country it isn't in ("Paris, TX"); that region or country is.
+
+        Args:
+            address (str): The address as scraped.
+
+        Returns:
+            Location: (latitude, longitude, precision), or NOT_FOUND.
+        """
+        if not address or not isinstance(address, str):
+            return NOT_FOUND
+        coordinates = COORDINATES_RE.match(address)
+        if coordinates:
+            latitude, longitude = float(coordinates.group(1)), float(coordinates.group(2))
+            if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+                return Location(latitude, longitude, 'exact')
+
+        matches = self._matches(address)
+        if not matches:
+            return NOT_FOUND
+
+        scores = defaultdict(lambda: [0, 0, -1])
+        for position, place, code, last, _ in matches:
+            kind = self.kinds[place]
+            score = scores[self.countries[place]]
+            score[0] += (CODE_WEIGHTS if code else NAME_WEIGHTS)[kind] + (kind == COUNTRY and last)
+            score[1] += 1
+            score[2] = max(score[2], position)
+        country = max(scores, key=lambda c: scores[c])
+
+        in_country = [(position, place) for position, place, _, _, _ in matches if self.countries[place] == country]
+        region_positions = defaultdict(list)
+        for position, place in in_country:
+            if self.kinds[place] == REGION:
+                region_positions[place].append(position)
+
+        cities = []
+        for position, place in in_country:
+            if self.kinds[place] != CITY:
+                continue
+            region = self.regions[place]
+            if region != NO_PARENT and position in region_positions.get(region, ()):
+                if not any(p > position for p in region_positions[region]):
+                    continue
+            cities.append((region != NO_PARENT and region in region_positions, position, place))
+        if cities:
+            # "Paris, TX" names a region the chosen Paris isn't in, so it probably means
+            # another town of that name: the city isn't trusted and the most specific
+            # area the address names outside the country is used instead. Names that
+            # also mean a place in the country ("MA") or are part of a longer name
+            # there ("Wales" in "New South Wales") don't count.
+            covered = {token for position, place, _, _, end in matches if self.countries[place] == country
+                       for token in range(position, end)}
+            disagreeing = [(self.kinds[place] == REGION, position, place) for position, place, _, _, end in matches
+                           if self.kinds[place] != CITY and self.countries[place] != country
+                           and not covered.issuperset(range(position, end))]
+            if disagreeing:
+                return self.location(max(disagreeing)[2])
+            return self.location(max(cities)[2])
+        if region_positions:
+            return self.location(max(region_positions, key=lambda r: max(region_positions[r])))
+        return self.location(country)
+
+
+def read_source(path=SOURCE_PATH):
+    """
+    Read the gazetteer source TSV.
+
+    Columns are kind, name, aliases (separated by "|"), country code, region (name or
+    alias of a region in the same country, for cities) and latitude/longitude.
+    Lines starting with "#" are comments.
+
+    Returns:
+        list: One dict per place.
+    """
+    places = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            kind, name, aliases, country, region, latitude, longitude = line.rstrip('\n').split('\t')
+            places.append({
+                'kind': kind, 'name': name, 'aliases': [a for a in aliases.split('|') if a],
+                'country': country, 'region': region,
+                'latitude': float(latitude), 'longitude': float(longitude),
+            })
+    return places
+
+
+def read_geonames_cities(path, min_population=15000):
+    """
+    Read cities from a GeoNames dump such as cities15000.txt, to extend the bundled
+    gazetteer beyond the hand-picked cities.
+
+    Returns:
+        list: Places in the same form as read_source.
+    """
+    places = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if fields[6] != 'P' or int(fields[14] or 0) < min_population:
+                continue
+            places.append({
+                'kind': 'city', 'name': fields[1], 'aliases': [fields[2]] if fields[2] != fields[1] else [],
+                'country': fields[8], 'region': '',
+                'latitude': float(fields[4]), 'longitude': float(fields[5]),
+            })
+    return places
+
+
+def build_gazetteer(places):
+    """
+    Compile places into a Gazetteer. Countries must come before the places in them,
+    and regions before their cities.
+    """
+    names, kinds, countries, regions = [], array('B'), array('H'), array('H')
+    latitudes, longitudes = array('f'), array('f')
+    index = defaultdict(set)
+    country_ids, region_ids = {}, {}
+
+    for place in places:
+        i = len(names)
+        kind = KINDS.index(place['kind'])
+        if kind == COUNTRY:
+            country_ids[place['country']] = i
+        if place['country'] not in country_ids:
+            raise ValueError(f"{place['name']}: unknown country {place['country']}")
+        region = NO_PARENT
+        if place['region']:
+            region = region_ids.get((place['country'], name_key(place['region'])), NO_PARENT)
+            if region == NO_PARENT:
+                raise ValueError(f"{place['name']}: unknown region {place['region']}")
+
+        names.append(place['name'])
+        kinds.append(kind)
+        countries.append(country_ids[place['country']])
+        regions.append(region)
+        latitudes.append(place['latitude'])
+        longitudes.append(place['longitude'])
+
+        aliases = [place['name'], *place['aliases']] + ([place['country']] if kind == COUNTRY else [])
+        for alias in aliases:
+            index[name_key(alias)].add(i * 2 + is_code(alias))
+            if kind == REGION:
+                region_ids[(place['country'], name_key(alias))] = i
+
+    keys = sorted(index)
+    key_offsets, postings = array('I', [0]), array('I')
+    for key in keys:
+        postings.extend(sorted(index[key]))
+        key_offsets.append(len(postings))
+    return Gazetteer(names, latitudes, longitudes, kinds, countries, regions, keys, key_offsets, postings)
+
+
+def _arrays(gazetteer):
+    return (gazetteer.latitudes, gazetteer.longitudes, gazetteer.kinds, gazetteer.countries,
+            gazetteer.regions, gazetteer.key_offsets, gazetteer.postings)
+
+
+def save_gazetteer(gazetteer, path=GAZETTEER_PATH):
+    """Write a gazetteer in the compact binary format read by load_gazetteer."""
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(len(gazetteer.names), len(gazetteer.keys), len(gazetteer.postings)))
+        for values in _arrays(gazetteer):
+            if sys.byteorder == 'big':
+                values = array(values.typecode, values)
+                values.byteswap()
+            values.tofile(f)
+        for strings in (gazetteer.names, gazetteer.keys):
+            blob = '\n'.join(strings).encode('utf-8')
+            f.write(struct.pack('<I', len(blob)))
+            f.write(blob)
+
+
+@lru_cache(maxsize=None)
+def load_gazetteer(path=GAZETTEER_PATH):
+    """
+    Load a compiled gazetteer, once per process.
+
+    Args:
+        path (str): The .bin file, by default the bundled one.
+
+    Returns:
+        Gazetteer
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a gazetteer file")
+        count, key_count, posting_count = HEADER.unpack(f.read(HEADER.size))
+        lengths = (count, count, count, count, count, key_count + 1, posting_count)
+        arrays = []
+        for typecode, length in zip('ffBHHII', lengths):
+            values = array(typecode)
+            values.fromfile(f, length)
+            if sys.byteorder == 'big':
+                values.byteswap()
+            arrays.append(values)
+        strings = []
+        for _ in range(2):
+            (size,) = struct.unpack('<I', f.read(4))
+            strings.append(f.read(size).decode('utf-8').split('\n'))
+    latitudes, longitudes, kinds, countries, regions, key_offsets, postings = arrays
+    return Gazetteer(strings[0], latitudes, longitudes, kinds, countries, regions, strings[1], key_offsets, postings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the offline gazetteer.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Compile the TSV into the binary gazetteer")
+    build.add_argument('--source', default=SOURCE_PATH)
+    build.add_argument('--geonames', help="Also include cities from a GeoNames dump (e.g. cities15000.txt)")
+    build.add_argument('--output', default=GAZETTEER_PATH)
+    resolve = subparsers.add_parser('resolve', help="Resolve addresses with the bundled gazetteer")
+    resolve.add_argument('addresses', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        places = read_source(args.source)
+        if args.geonames:
+            places += read_geonames_cities(args.geonames)
+        gazetteer = build_gazetteer(places)
+        save_gazetteer(gazetteer, args.output)
+        print(f"Wrote {len(gazetteer)} places and {len(gazetteer.keys)} names to {args.output} "
+              f"({os.path.getsize(args.output) / 1024:.1f} KiB)")
+    else:
+        gazetteer = load_gazetteer()
+        for address in args.addresses:
+            print(f"{address!r}: {gazetteer.resolve(address)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""
+geocoding.py
+
+Geocoding of supplier addresses with a persistent cache.
+
+Results (including "not found") are stored in SQLite keyed by the normalised address,
+so a rerun only contacts the provider for addresses it has never seen. Uncached
+addresses are looked up concurrently, paced by a token bucket per provider so the
+batch runs at exactly the rate the provider allows instead of sleeping a fixed
+time before every call.
+
+Before that, addresses are resolved against the offline gazetteer: an address it
+places in a known city needs no network at all, and one the provider can't resolve
+still gets its region or country centroid. Every result carries a precision flag
+("exact", "address", "city", "region" or "country") saying which of these it is.
+"""
+
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from datetime import datetime, timezone
+
+import aiohttp
+
+from scraping.gazetteer import NOT_FOUND, Location, load_gazetteer
+
+CACHE_PATH = 'geocode_cache.sqlite3'
+USER_AGENT = 'CompanyLocationGeocoder/1.0'  # Required by Nominatim
+# Written by cdr-iframe-scraper.py when it finds no address, never sent to a provider
+PLACEHOLDER_ADDRESSES = {"Address not found", "Error occurred", "Error extracting address"}
+# Gazetteer results precise enough to skip the provider
+FAST_PATH_PRECISIONS = ('exact', 'city')
+
+
+def normalize_address(address):
+    """
+    Normalise an address for use as a cache key.
+
+    Case, Unicode form, whitespace and spacing around commas are ignored, so
+    "Main St 1 ,  Oslo" and "main st 1, oslo" share a cache entry.
+
+    Args:
+        address (str): The address as scraped.
+
+    Returns:
+        str: The normalised address.
+    """
+    address = unicodedata.normalize('NFKC', str(address)).casefold()
+    address = re.sub(r'\s*,\s*', ', ', address)
+    address = re.sub(r'\s+', ' ', address)
+    return address.strip(' ,.;')
+
+
+class TokenBucket:
+    """
+    Rate limiter allowing `rate` calls per second on average and bursts of up to
+    `capacity` calls.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = None
+        self._loop = None
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        # The bucket outlives event loops (each geocode_batch call runs its own)
+        if self._loop is not asyncio.get_running_loop():
+            self._loop = asyncio.get_running_loop()
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._tokens = 1
+                self._updated = time.monotonic()
+            self._tokens -= 1
+
+
+class GeocodeCache:
+    """
+    SQLite-backed cache of geocoding results.
+
+    Only provider results are stored. A cached NOT_FOUND means the provider could not
+    resolve the address; it is kept so reruns don't ask again.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS geocodes (
+                address_key TEXT PRIMARY KEY,
+                address TEXT NOT NULL,
+                provider TEXT NOT NULL,
+                latitude REAL,
+                longitude REAL,
+                created_at TEXT NOT NULL,
+                precision TEXT
+            )"""
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(geocodes)")}
+        if 'precision' not in columns:
+            # Caches written before results had a precision hold provider results only
+            self._conn.execute("ALTER TABLE geocodes ADD COLUMN precision TEXT")
+            self._conn.execute("UPDATE geocodes SET precision = 'address' WHERE latitude IS NOT NULL")
+        self._conn.commit()
+
+    def get(self, address):
+        """
+        Look up an address.
+
+        Args:
+            address (str): The address, normalised or not.
+
+        Returns:
+            Location or None: The cached result, possibly NOT_FOUND, or None if the
+                              address is not cached.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT latitude, longitude, precision FROM geocodes WHERE address_key = ?",
+                (normalize_address(address),)
+            ).fetchone()
+        return Location(*row) if row else None
+
+    def set(self, address, provider, location):
+        """Store the result of a lookup."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocodes "
+                "(address_key, address, provider, latitude, longitude, created_at, precision) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (normalize_address(address), address, provider, location.latitude, location.longitude,
+                 datetime.now(timezone.utc).isoformat(timespec='seconds'), location.precision),
+            )
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class NominatimProvider:
+    """OpenStreetMap's Nominatim, limited to one request per second by its usage policy."""
+
+    name = 'nominatim'
+
+    def __init__(self, rate=1.0):
+        self.bucket = TokenBucket(rate)
+
+    async def geocode(self, session, address):
+        params = {'q': address, 'format': 'json', 'limit': 1}
+        async with session.get("https://nominatim.openstreetmap.org/search", params=params,
+                               headers={'User-Agent': USER_AGENT}) as response:
+            data = await response.json(content_type=None)
+        if data:
+            return float(data[0]['lat']), float(data[0]['lon'])
+        return None, None
+
+
+class GoogleProvider:
+    """
+    Google Maps Geocoding API. More reliable and faster than Nominatim, but requires
+    an API key and may have associated costs.
+    """
+
+    name = 'google'
+
+    def __init__(self, api_key, rate=10.0):
+        self.api_key = api_key
+        self.bucket = TokenBucket(rate, capacity=rate)
+
+    async def geocode(self, session, address):
+        params = {'address': address, 'key': self.api_key}
+        async with session.get("https://maps.googleapis.com/maps/api/geocode/json", params=params) as response:
+            data = await response.json(content_type=None)
+        if data.get('status') == 'OK' and data.get('results'):
+            location = data['results'][0]['geometry']['location']
+            return location['lat'], location['lng']
+        if data.get('status') != 'ZERO_RESULTS':
+            raise RuntimeError(f"Google geocoding failed with status {data.get('status')}")
+        return None, None
+
+
+class StandInProvider:
+    """
+    Local provider for tests and benchmarks. Answers from `known` if given, otherwise
+    with stable pseudo-coordinates derived from the address, and counts its calls.
+    """
+
+    name = 'stand-in'
+
+    def __init__(self, known=None, rate=1000.0, latency=0.0):
+        self.known = {normalize_address(k): v for k, v in (known or {}).items()}
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self.latency = latency
+        self.calls = 0
+
+    async def geocode(self, session, address):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        key = normalize_address(address)
+        if self.known:
+            return self.known.get(key, (None, None))
+        digest = hashlib.sha1(key.encode('utf-8')).digest()
+        return (digest[0] / 255 * 180 - 90, digest[1] / 255 * 360 - 180)
+
+
+class Geocoder:
+    """
+    Looks addresses up in the cache and the offline gazetteer first and asks the
+    provider for the rest.
+
+    Args:
+        provider: A provider such as NominatimProvider.
+        cache (GeocodeCache or None): Defaults to the cache in CACHE_PATH.
+        gazetteer (Gazetteer or None): Defaults to the bundled gazetteer.
+        fast_path (tuple): Gazetteer precisions accepted without asking the provider.
+            Pass () to only use the gazetteer as a fallback.
+    """
+
+    def __init__(self, provider, cache=None, gazetteer=None, fast_path=FAST_PATH_PRECISIONS):
+        self.provider = provider
+        self.cache = cache if cache is not None else GeocodeCache()
+        self.gazetteer = gazetteer if gazetteer is not None else load_gazetteer()
+        self.fast_path = fast_path
+
+    async def _lookup(self, session, address, fallback):
+        await self.provider.bucket.acquire()
+        try:
+            latitude, longitude = await self.provider.geocode(session, address)
+        except Exception as e:
+            # Don't cache errors, the address is tried again next run
+            print(f"Error geocoding address {address}: {e}")
+            return fallback
+        location = Location(latitude, longitude, 'address') if latitude is not None else NOT_FOUND
+        self.cache.set(address, self.provider.name, location)
+        if latitude is None:
+            print(f"Could not geocode address: {address}")
+            return fallback
+        return location
+
+    async def geocode_batch_async(self, addresses, concurrency=10):
+        """
+        Geocode many addresses, running uncached lookups concurrently at the
+        provider's rate.
+
+        Args:
+            addresses (iterable): Addresses to geocode. Empty values are skipped,
+                placeholders map to NOT_FOUND and duplicates (after normalisation)
+                are looked up once.
+            concurrency (int): Maximum number of lookups in flight.
+
+        Returns:
+            dict: Maps each address to a Location, NOT_FOUND if unresolved.
+        """
+        results = {}
+        pending = {}
+        fallbacks = {}
+        cached_count = offline_count = 0
+        for address in addresses:
+            if not address or not isinstance(address, str) or address in results:
+                continue
+            if address in PLACEHOLDER_ADDRESSES:
+                results[address] = NOT_FOUND
+                continue
+            cached = self.cache.get(address)
+            if cached is not None and cached.latitude is not None:
+                results[address] = cached
+                cached_count += 1
+                continue
+            offline = self.gazetteer.resolve(address)
+            if offline.precision in self.fast_path:
+                results[address] = offline
+                offline_count += 1
+            elif cached is not None:
+                # The provider already failed on this address
+                results[address] = offline
+                cached_count += 1
+            else:
+                key = normalize_address(address)
+                pending.setdefault(key, []).append(address)
+                fallbacks[key] = offline
+
+        if pending:
+            print(f"{cached_count} addresses cached, {offline_count} resolved offline, "
+                  f"geocoding {len(pending)} with {self.provider.name}...")
+            semaphore = asyncio.Semaphore(concurrency)
+            timeout = aiohttp.ClientTimeout(total=30)
+
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async def geocode_one(key, originals):
+                    async with semaphore:
+                        location = await self._lookup(session, originals[0], fallbacks[key])
+                    for original in originals:
+                        results[original] = location
+
+                await asyncio.gather(*(geocode_one(key, originals) for key, originals in pending.items()))
+        return results
+
+    def geocode_batch(self, addresses, concurrency=10):
+        """Synchronous wrapper around geocode_batch_async."""
+        return asyncio.run(self.geocode_batch_async(addresses, concurrency))
+
+    def geocode(self, address):
+        """
+        Geocode a single address.
+
+        Returns:
+            Location: (latitude, longitude, precision), NOT_FOUND if it could not be resolved.
+        """
+        return self.geocode_batch([address]).get(address, NOT_FOUND)
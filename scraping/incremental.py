@@ -0,0 +1,134 @@
+"""
+incremental.py
+
+Fingerprints of previously scraped suppliers, so a refresh can tell which suppliers
+were added, removed or changed and only fetch details for those.
+
+The store is a JSON file with three sections:
+    suppliers: per supplier (keyed by CDR_Link, or Name if there is none) the last
+               seen values, their fingerprint and when the supplier was last seen.
+    pages:     ETag/Last-Modified and parsed rows per leaderboard page.
+    links:     ETag/Last-Modified and company link per supplier page, plus the
+               fingerprint of the supplier when the link was fetched, and
+               'failed_at' if that lookup failed (it is then tried again).
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+STORE_PATH = 'supplier_fingerprints.json'
+CHANGES_PATH = 'supplier_changes.json'
+FINGERPRINT_FIELDS = ['Name', 'Tons Delivered', 'Tons Sold', 'Method', 'CDR_Link']
+
+
+def supplier_key(row):
+    return row.get('CDR_Link') or row['Name']
+
+
+def supplier_fingerprint(row):
+    """
+    Hash the scraped fields of a supplier.
+
+    Args:
+        row (dict): A supplier row with the FINGERPRINT_FIELDS columns.
+
+    Returns:
+        str: A hex digest that changes whenever one of the fields changes.
+    """
+    values = "\x1f".join(str(row.get(field) or '') for field in FINGERPRINT_FIELDS)
+    return hashlib.sha1(values.encode('utf-8')).hexdigest()
+
+
+class FingerprintStore:
+    """The persisted fingerprints, see the module docstring for the layout."""
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        data = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        self.suppliers = data.get('suppliers', {})
+        self.pages = data.get('pages', {})
+        self.links = data.get('links', {})
+
+    def save(self):
+        """Write the store atomically, so an interrupted run never leaves a broken file."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'suppliers': self.suppliers, 'pages': self.pages, 'links': self.links}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def update(self, rows, seen_at=None):
+        """
+        Record a fresh scrape and compare it with the previous one.
+
+        Args:
+            rows (list): Supplier dictionaries with the FINGERPRINT_FIELDS columns.
+            seen_at (str or None): Timestamp to record as last seen, defaults to now.
+
+        Returns:
+            dict: The diff, with 'added' and 'removed' (lists of names) and 'changed'
+                  (a list of {'name', 'fields': {column: [old, new]}}).
+        """
+        seen_at = seen_at or datetime.now(timezone.utc).isoformat(timespec='seconds')
+        previous = self.suppliers
+        current = {}
+        diff = {'added': [], 'removed': [], 'changed': []}
+
+        for row in rows:
+            key = supplier_key(row)
+            values = {field: row.get(field) for field in FINGERPRINT_FIELDS}
+            fingerprint = supplier_fingerprint(row)
+            old = previous.get(key)
+            if old is None:
+                diff['added'].append(row['Name'])
+            elif old['fingerprint'] != fingerprint:
+                changed = {
+                    field: [old['values'].get(field), values[field]]
+                    for field in FINGERPRINT_FIELDS
+                    if old['values'].get(field) != values[field]
+                }
+                diff['changed'].append({'name': row['Name'], 'fields': changed})
+            current[key] = {'values': values, 'fingerprint': fingerprint, 'last_seen': seen_at}
+
+        for key, old in previous.items():
+            if key not in current:
+                diff['removed'].append(old['values']['Name'])
+                self.links.pop(key, None)
+
+        self.suppliers = current
+        return diff
+
+    def needs_company_link(self, row):
+        """
+        Tell whether a supplier's page has to be fetched again.
+
+        Args:
+            row (dict): A supplier row.
+
+        Returns:
+            bool: False if the company link was fetched when the supplier looked
+                  exactly like this, True otherwise or if that lookup failed.
+        """
+        cached = self.links.get(supplier_key(row))
+        return (cached is None or 'failed_at' in cached
+                or cached.get('fingerprint') != supplier_fingerprint(row))
+
+
+def write_changes(diff, path=CHANGES_PATH):
+    """
+    Save a diff from FingerprintStore.update as JSON and print a summary.
+
+    Args:
+        diff (dict): The diff to save.
+        path (str): Where to write it.
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(diff, f, ensure_ascii=False, indent=2)
+    print(
+        f"Changes since last run: {len(diff['added'])} added, {len(diff['removed'])} removed, "
+        f"{len(diff['changed'])} changed (saved to '{path}')"
+    )
@@ -0,0 +1,102 @@
+"""
+leaderboard.py
+
+Parsing and fetching of the cdr.fyi supplier leaderboard.
+"""
+
+import asyncio
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+from .company_links import (
+    DEFAULT_HOST_INTERVAL,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    USER_AGENT,
+    HostThrottle,
+    fetch_page,
+)
+
+COLUMNS = ['Name', 'Tons Delivered', 'Tons Sold', 'Method', 'CDR_Link']
+
+
+def parse_leaderboard_rows(html, base_url):
+    """
+    Extract the supplier rows from a leaderboard page.
+
+    Args:
+        html (str): The page source.
+        base_url (str): Prefix for the relative "View" links.
+
+    Returns:
+        list: One list per supplier with the values in COLUMNS order.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find("table")
+    if table is None or table.find("tbody") is None:
+        return []
+
+    rows = []
+    for row in table.find("tbody").find_all("tr"):
+        cols = row.find_all("td")
+        if not cols:
+            continue
+
+        # Hämta vanlig text från kolumnerna
+        row_data = [col.get_text(strip=True) for col in cols]
+
+        # Hämta länken från <a>-taggen istället för "View"
+        view_link_tag = row.find("a", string="View")
+        row_data[-1] = base_url + view_link_tag.get("href") if view_link_tag else None
+        rows.append(row_data)
+    return rows
+
+
+async def fetch_leaderboard(base_url, pages, page_cache=None, host_interval=DEFAULT_HOST_INTERVAL, retries=DEFAULT_RETRIES):
+    """
+    Fetch leaderboard pages over plain HTTP, for servers that render the table
+    server-side (such as the local fixture server).
+
+    Args:
+        base_url (str): The site to fetch from, e.g. "http://127.0.0.1:8765".
+        pages (int): Number of pages to fetch.
+        page_cache (dict or None): Maps page URLs to {'rows', 'etag', 'last_modified'} from
+            earlier runs. Pages are fetched conditionally and a 304 reuses the cached rows.
+            Updated in place.
+        host_interval (float): Minimum seconds between requests.
+        retries (int): Retries per page.
+
+    Returns:
+        list or None: All rows in page order, or None if a page had no table (the
+                      site needs a browser).
+    """
+    page_cache = page_cache if page_cache is not None else {}
+    throttle = HostThrottle(host_interval)
+    timeout = aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT)
+
+    async with aiohttp.ClientSession(timeout=timeout, headers={'User-Agent': USER_AGENT}) as session:
+        async def fetch_one(page_number):
+            url = f"{base_url}/leaderboards?page={page_number}"
+            cached = page_cache.get(url, {})
+            page = await fetch_page(session, url, throttle, retries,
+                                    etag=cached.get('etag'), last_modified=cached.get('last_modified'))
+            if page is None:
+                return None
+            if page.status == 304:
+                print(f"📄 Page {page_number} unchanged")
+                return cached['rows']
+            print(f"📄 Scraped page {page_number}")
+            rows = parse_leaderboard_rows(page.text, base_url)
+            page_cache[url] = {'rows': rows, 'etag': page.etag, 'last_modified': page.last_modified}
+            return rows
+
+        # Check the first page before fetching the rest, a client-side rendered site has no table
+        first = await fetch_one(1)
+        if not first:
+            return None
+        results = [first] + await asyncio.gather(*(fetch_one(n) for n in range(2, pages + 1)))
+
+    if any(rows is None for rows in results):
+        return None
+    return [row for rows in results for row in rows]
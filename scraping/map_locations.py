@@ -0,0 +1,309 @@
+"""
+map_locations.py
+
+Scraping of supplier addresses ("Geo Address Text") from the CDR map app.
+
+The map is searched company by company in headless browsers. Every step waits for
+the element it needs (the search result, the address panel) instead of sleeping, and
+the company list is shared by several browsers working through one queue. Each
+result is appended to a checkpoint file as soon as it is known, so an interrupted
+run picks up where it stopped.
+"""
+
+import csv
+import json
+import os
+import queue
+import threading
+import time
+
+from scraping.company_links import setup_driver
+
+MAP_URL = "https://app.nocodemapapp.com/app/XfChjmld8U5pw7ohNesh"
+CHECKPOINT_PATH = 'company_locations.checkpoint.jsonl'
+DEFAULT_WORKERS = 3
+DEFAULT_TIMEOUT = 15
+DEFAULT_SEARCH_TIMEOUT = 5
+
+SEARCH_INPUT = "input[placeholder='Search by name or location...']"
+RESULT_CARD = "button.MuiCardActionArea-root"
+SHOW_LIST_XPATH = "//button[contains(.,'Show list')]"
+COOKIE_ACCEPT_XPATH = ("//button[contains(translate(., 'ACEPT', 'acept'), 'accept') "
+                       "or contains(translate(., 'AGRE', 'agre'), 'agree')]")
+GEO_ADDRESS_XPATH = ("//li[contains(@class, 'MuiListItem-root')][contains(@class, 'MuiListItem-divider')]"
+                     "//div[contains(text(), 'Geo Address Text')]/following-sibling::div")
+
+# Same strings as the old script wrote, geocoding.PLACEHOLDER_ADDRESSES skips them
+ADDRESS_NOT_FOUND = "Address not found"
+ERROR_OCCURRED = "Error occurred"
+
+
+def _matches_name(text, name):
+    return ' '.join(name.split()).casefold() in ' '.join(text.split()).casefold()
+
+
+class MapSession:
+    """
+    One browser looking up companies on the map.
+
+    Args:
+        driver: A Selenium webdriver, owned (and quit) by the session.
+        map_url (str): The map app, or a page embedding it in an iframe.
+        timeout (int): Seconds to wait for the map to load and panels to open.
+        search_timeout (int): Seconds to wait for a company to show up in the results.
+    """
+
+    def __init__(self, driver, map_url=MAP_URL, timeout=DEFAULT_TIMEOUT, search_timeout=DEFAULT_SEARCH_TIMEOUT):
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        self.driver = driver
+        self.map_url = map_url
+        self.timeout = timeout
+        self.search_timeout = search_timeout
+        self.wait = WebDriverWait(driver, timeout)
+
+    def open(self):
+        """Load the map, switch into its iframe, accept cookies and open the list."""
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+
+        self.driver.get(self.map_url)
+        self.wait.until(lambda d: d.find_elements(By.CSS_SELECTOR, SEARCH_INPUT) or d.find_elements(By.TAG_NAME, "iframe"))
+        self._accept_cookies()
+        if not self.driver.find_elements(By.CSS_SELECTOR, SEARCH_INPUT):
+            for iframe in self.driver.find_elements(By.TAG_NAME, "iframe"):
+                self.driver.switch_to.frame(iframe)
+                try:
+                    self.wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, SEARCH_INPUT)))
+                    break
+                except TimeoutException:
+                    self.driver.switch_to.default_content()
+            self._accept_cookies()
+
+        try:
+            show_list = self.wait.until(EC.element_to_be_clickable((By.XPATH, SHOW_LIST_XPATH)))
+            self._click(show_list)
+        except TimeoutException:
+            print("'Show list' button not found, continuing without it")
+        self.wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, SEARCH_INPUT)))
+
+    def _accept_cookies(self):
+        from selenium.webdriver.common.by import By
+
+        for button in self.driver.find_elements(By.XPATH, COOKIE_ACCEPT_XPATH):
+            if button.is_displayed():
+                self._click(button)
+                return
+
+    def _click(self, element):
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            element.click()
+        except WebDriverException:
+            # Covered by an overlay, let the page handle the click itself
+            self.driver.execute_script("arguments[0].click();", element)
+
+    def lookup(self, name):
+        """
+        Search for a company and read its address.
+
+        Args:
+            name (str): The company name as listed on the leaderboard.
+
+        Returns:
+            str: The address, or ADDRESS_NOT_FOUND.
+        """
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.action_chains import ActionChains
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.common.keys import Keys
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        search = self.wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, SEARCH_INPUT)))
+        search.clear()
+        search.send_keys(name, Keys.RETURN)
+
+        def result_card(driver):
+            for card in driver.find_elements(By.CSS_SELECTOR, RESULT_CARD):
+                if _matches_name(card.text, name):
+                    return card
+            return False
+
+        try:
+            card = WebDriverWait(self.driver, self.search_timeout).until(result_card)
+        except TimeoutException:
+            return ADDRESS_NOT_FOUND
+        self._click(card)
+
+        try:
+            address = self.wait.until(EC.visibility_of_element_located((By.XPATH, GEO_ADDRESS_XPATH))).text.strip()
+        except TimeoutException:
+            address = ''
+
+        # Close the details so the next search starts from the list
+        ActionChains(self.driver).send_keys(Keys.ESCAPE).perform()
+        try:
+            self.wait.until(EC.invisibility_of_element_located((By.XPATH, GEO_ADDRESS_XPATH)))
+        except TimeoutException:
+            self.open()
+        return address or ADDRESS_NOT_FOUND
+
+    def close(self):
+        self.driver.quit()
+
+
+def open_map_session(map_url=MAP_URL, headless=True):
+    """Start a browser and open the map in it."""
+    session = MapSession(setup_driver(headless=headless, window_size="1920,1080"), map_url)
+    try:
+        session.open()
+    except Exception:
+        session.close()
+        raise
+    return session
+
+
+class LocationCheckpoint:
+    """
+    Results of the current run, one JSON line per company, appended as they come in.
+
+    The latest result per company is kept in `results`. Companies that failed with
+    ERROR_OCCURRED are not done, so a resumed run tries them again.
+    """
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        self.results = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short when the previous run was killed
+                    self.results[result['name']] = result
+        self._file = open(path, 'a', encoding='utf-8')
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write('\n')
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def is_done(self, name):
+        return name in self.results and self.results[name]['geo_address'] != ERROR_OCCURRED
+
+    def add(self, result):
+        with self._lock:
+            self._file.write(json.dumps(result, ensure_ascii=False) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.results[result['name']] = result
+
+    def close(self):
+        self._file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+def scrape_locations(companies, map_url=MAP_URL, workers=DEFAULT_WORKERS, headless=True,
+                     checkpoint_path=CHECKPOINT_PATH, session_factory=None):
+    """
+    Look up the address of every company, skipping those already in the checkpoint.
+
+    Args:
+        companies (list): Dicts with 'name', 'tons' and 'method'.
+        map_url (str): The map to search.
+        workers (int): Number of browsers searching in parallel.
+        headless (bool): Run the browsers without windows.
+        checkpoint_path (str): Where finished companies are recorded.
+        session_factory (callable or None): Returns an opened session with lookup(name)
+            and close(); by default a headless Chrome on map_url.
+
+    Returns:
+        list: One result per company in input order, with 'name', 'geo_address',
+              'tons_delivered' and 'method'. Companies no browser got to are left out.
+              The checkpoint is removed once every company is done.
+    """
+    if session_factory is None:
+        def session_factory():
+            return open_map_session(map_url, headless)
+
+    checkpoint = LocationCheckpoint(checkpoint_path)
+    pending = queue.Queue()
+    for company in companies:
+        if not checkpoint.is_done(company['name']):
+            pending.put(company)
+    total = pending.qsize()
+    print(f"{len(companies) - total} companies already in {checkpoint_path}, looking up {total} "
+          f"with {min(workers, total)} browsers")
+    progress = {'done': 0}
+    progress_lock = threading.Lock()
+    start = time.perf_counter()
+
+    def work(worker):
+        try:
+            session = session_factory()
+        except Exception as e:
+            print(f"Browser {worker} could not open the map: {e}")
+            return
+        try:
+            while True:
+                try:
+                    company = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    geo_address = session.lookup(company['name'])
+                except Exception as e:
+                    print(f"Error during search for {company['name']}: {e}")
+                    geo_address = ERROR_OCCURRED
+                    try:
+                        session.open()
+                    except Exception:
+                        pending.put(company)
+                        return
+                checkpoint.add({
+                    'name': company['name'],
+                    'geo_address': geo_address,
+                    'tons_delivered': company['tons'],
+                    'method': company['method'],
+                })
+                with progress_lock:
+                    progress['done'] += 1
+                    count = progress['done']
+                print(f"[{count}/{total}] {company['name']}: {geo_address}")
+        finally:
+            session.close()
+
+    # No browser is started when every company is already in the checkpoint
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(min(max(1, workers), total))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if total:
+        elapsed = time.perf_counter() - start
+        print(f"Looked up {progress['done']} companies in {elapsed:.1f} s ({progress['done'] / elapsed:.2f}/s)")
+
+    results = [checkpoint.results[c['name']] for c in companies if c['name'] in checkpoint.results]
+    if all(checkpoint.is_done(c['name']) for c in companies):
+        checkpoint.remove()
+    else:
+        checkpoint.close()
+    return results
+
+
+def write_locations(results, path='company_locations.csv'):
+    """Write lookup results in the format geocode-script.py reads."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['name', 'geo_address', 'tons_delivered', 'method'])
+        writer.writeheader()
+        writer.writerows(results)
@@ -0,0 +1,345 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import urllib.request
+
+from django.test import SimpleTestCase
+
+from .company_links import fetch_company_links
+from .fixture_server import start_fixture_server
+from .gazetteer import NOT_FOUND, load_gazetteer
+from .geocoding import GeocodeCache, Geocoder, StandInProvider
+from .incremental import FingerprintStore, supplier_fingerprint, supplier_key
+from .map_locations import ADDRESS_NOT_FOUND, LocationCheckpoint, _matches_name, scrape_locations
+
+SUPPLIER = {'Name': 'Example Carbon', 'Tons Delivered': '10', 'Tons Sold': '20', 'Method': 'Biochar',
+            'CDR_Link': 'https://www.cdr.fyi/supplier/example-carbon'}
+
+
+def closed_port_url(path):
+    """A URL on localhost where nothing listens, so every fetch fails."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}{path}"
+
+
+class FailedLookupTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store_path = os.path.join(directory.name, 'store.json')
+
+    def test_failed_lookup_is_retried_on_the_next_run(self):
+        link = closed_port_url('/supplier/example-carbon')
+        cache = {}
+        links = asyncio.run(fetch_company_links([link], retries=0, cache=cache))
+        self.assertEqual(links, {link: "N/A"})
+        self.assertIn('failed_at', cache[link])
+
+        store = FingerprintStore(self.store_path)
+        store.links[supplier_key(SUPPLIER)] = dict(cache[link], fingerprint=supplier_fingerprint(SUPPLIER))
+        store.save()
+        self.assertTrue(FingerprintStore(self.store_path).needs_company_link(SUPPLIER))
+
+    def test_failed_lookup_keeps_the_earlier_link(self):
+        link = closed_port_url('/supplier/example-carbon')
+        cache = {link: {'company_link': 'https://example.com', 'etag': '"abc"', 'last_modified': None}}
+        links = asyncio.run(fetch_company_links([link], retries=0, cache=cache))
+        self.assertEqual(links, {link: 'https://example.com'})
+        # No validators, so the next run fetches the whole page instead of trusting a 304
+        self.assertIsNone(cache[link]['etag'])
+
+
+def fixture_suppliers():
+    return [{'Name': f'Supplier {n}', 'slug': f'supplier-{n}', 'Tons Delivered': str(n), 'Tons Sold': str(2 * n),
+             'Method': 'Biochar', 'Company_Link': f'https://supplier-{n}.example.com' if n % 3 else ''}
+            for n in range(1, 7)]
+
+
+class CompanyLinkFixtureTests(SimpleTestCase):
+    """The fetcher against the local stand-in for cdr.fyi, which sends ETags and answers 304."""
+
+    def setUp(self):
+        self.suppliers = fixture_suppliers()
+        self.serve()
+
+    def serve(self, **kwargs):
+        self.server, base_url = start_fixture_server(self.suppliers, locations=[], **kwargs)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.links = [f"{base_url}/supplier/{s['slug']}" for s in self.suppliers]
+
+    def fetch(self, cache, **kwargs):
+        # The fetcher reports every page with print
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            links = asyncio.run(fetch_company_links(self.links, host_interval=0, cache=cache, **kwargs))
+        return links, output.getvalue()
+
+    def requests(self):
+        return self.server.RequestHandlerClass.counter['requests']
+
+    def test_unchanged_pages_reuse_the_cached_link(self):
+        cache = {}
+        first, _ = self.fetch(cache)
+        self.assertEqual(first, {link: s['Company_Link'] or "N/A" for link, s in zip(self.links, self.suppliers)})
+        self.assertTrue(all(cache[link]['etag'] for link in self.links))
+
+        # Only a 304 can bring back what is in the cache instead of what the page says
+        for link in self.links:
+            cache[link]['company_link'] = 'https://cached.example.com'
+        requests = self.requests()
+        second, output = self.fetch(cache)
+        self.assertEqual(self.requests() - requests, len(self.links))
+        self.assertEqual(output.count("Unchanged:"), len(self.links))
+        self.assertEqual(set(second.values()), {'https://cached.example.com'})
+
+    def test_changed_page_is_read_again(self):
+        cache = {}
+        self.fetch(cache)
+        etag = cache[self.links[0]]['etag']
+        self.suppliers[0]['Company_Link'] = 'https://moved.example.com'
+
+        links, output = self.fetch(cache)
+        self.assertEqual(links[self.links[0]], 'https://moved.example.com')
+        self.assertNotEqual(cache[self.links[0]]['etag'], etag)
+        self.assertEqual(output.count("Unchanged:"), len(self.links) - 1)
+
+    def test_failed_requests_are_retried(self):
+        self.serve(fail_every=2)
+        links, _ = self.fetch({}, retries=3)
+        self.assertEqual(links, {link: s['Company_Link'] or "N/A" for link, s in zip(self.links, self.suppliers)})
+        self.assertGreater(self.requests(), len(self.links))
+
+
+class GazetteerConflictTests(SimpleTestCase):
+    """A city is only trusted when the rest of the address agrees with its country."""
+
+    def setUp(self):
+        self.gazetteer = load_gazetteer()
+
+    def test_city_in_another_state(self):
+        for address, region in [("Paris, TX", 'Texas'), ("Birmingham, AL 35203", 'Alabama'),
+                                ("London, ON", 'Ontario'), ("Hamburg, NY 14075", 'New York')]:
+            with self.subTest(address=address):
+                location = self.gazetteer.resolve(address)
+                self.assertEqual(location.precision, 'region')
+                self.assertEqual(location, self.gazetteer.resolve(region))
+
+    def test_agreeing_address_keeps_the_city(self):
+        for address in ["Paris, France", "Birmingham, UK", "Cambridge, MA", "Austin, TX", "New York, NY",
+                        "25 Bligh St, Sydney, New South Wales, AU"]:
+            with self.subTest(address=address):
+                self.assertEqual(self.gazetteer.resolve(address).precision, 'city')
+
+    def test_conflicting_address_is_sent_to_the_provider(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        cache = GeocodeCache(os.path.join(directory.name, 'geocodes.sqlite3'))
+        self.addCleanup(cache.close)
+        provider = StandInProvider({"Paris, TX": (33.66, -95.56)})
+        results = Geocoder(provider, cache=cache).geocode_batch(["Paris, TX", "Paris, France"])
+        self.assertEqual(provider.calls, 1)
+        self.assertEqual(results["Paris, TX"], (33.66, -95.56, 'address'))
+        self.assertEqual(results["Paris, France"].precision, 'city')
+
+
+class FailingProvider(StandInProvider):
+    async def geocode(self, session, address):
+        self.calls += 1
+        raise OSError("connection reset")
+
+
+class GeocodeCacheTests(SimpleTestCase):
+    """Reruns are answered from the cache; the provider is only asked about new addresses."""
+
+    # Not precise enough in the gazetteer (a country at best), so they go to the provider
+    ADDRESSES = ["Musterstrasse 5, 12345 Kleinstadt, Germany", "Industrivägen 3, 59 Norrby, Sweden",
+                 "Unit 7, Old Mill Estate, Nowhere"]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_path = os.path.join(directory.name, 'geocodes.sqlite3')
+
+    def geocode(self, provider, addresses):
+        cache = GeocodeCache(self.cache_path)
+        try:
+            # The geocoder reports progress with print
+            with contextlib.redirect_stdout(io.StringIO()):
+                return Geocoder(provider, cache=cache).geocode_batch(addresses)
+        finally:
+            cache.close()
+
+    def test_second_run_makes_no_provider_calls(self):
+        first_provider = StandInProvider()
+        first = self.geocode(first_provider, self.ADDRESSES)
+        self.assertEqual(first_provider.calls, 3)
+        self.assertTrue(all(location.precision == 'address' for location in first.values()))
+
+        second_provider = StandInProvider()
+        # Spelled differently, but the same addresses after normalisation
+        second = self.geocode(second_provider, [address.upper() + " " for address in self.ADDRESSES])
+        self.assertEqual(second_provider.calls, 0)
+        self.assertEqual(list(second.values()), list(first.values()))
+
+    def test_not_found_is_cached(self):
+        germany = load_gazetteer().resolve("Germany")
+        provider = StandInProvider(known={"somewhere else": (1.0, 2.0)})
+        first = self.geocode(provider, self.ADDRESSES)
+        self.assertEqual(provider.calls, 3)
+        # The gazetteer's country is the fallback
+        self.assertEqual(first[self.ADDRESSES[0]], germany)
+        self.assertEqual(first[self.ADDRESSES[2]], NOT_FOUND)
+        cache = GeocodeCache(self.cache_path)
+        self.addCleanup(cache.close)
+        self.assertEqual(cache.get(self.ADDRESSES[0]), NOT_FOUND)
+
+        provider = StandInProvider()
+        second = self.geocode(provider, self.ADDRESSES)
+        self.assertEqual(provider.calls, 0)
+        self.assertEqual(second, first)
+
+    def test_errors_are_not_cached(self):
+        provider = FailingProvider()
+        self.geocode(provider, self.ADDRESSES[:1])
+        self.assertEqual(provider.calls, 1)
+
+        provider = StandInProvider()
+        self.assertEqual(self.geocode(provider, self.ADDRESSES[:1])[self.ADDRESSES[0]].precision, 'address')
+        self.assertEqual(provider.calls, 1)
+
+    def test_duplicates_are_looked_up_once(self):
+        provider = StandInProvider()
+        results = self.geocode(provider, [self.ADDRESSES[0], self.ADDRESSES[0].lower(), "", None,
+                                          "Address not found"])
+        self.assertEqual(provider.calls, 1)
+        self.assertEqual(results[self.ADDRESSES[0]], results[self.ADDRESSES[0].lower()])
+        self.assertEqual(results["Address not found"], NOT_FOUND)
+
+
+MAP_LOCATIONS = [{'name': f'Company {n}', 'geo_address': f'{n} Example Street, Stockholm, Sweden'}
+                 for n in range(1, 11)] + [{'name': 'Quote Co', 'geo_address': 'Storgatan 1 </script> "A", Lund'}]
+
+
+def has_chrome():
+    return any(shutil.which(name) for name in ('google-chrome', 'google-chrome-stable', 'chromium',
+                                               'chromium-browser'))
+
+
+class FixtureMapSession:
+    """
+    Looks up companies on the map stand-in without a browser, searching the locations
+    the served page embeds the way its script does.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.lookups = []
+        self.open()
+
+    def open(self):
+        with urllib.request.urlopen(f"{self.base_url}/map/app") as response:
+            page = response.read().decode('utf-8')
+        self.locations = json.loads(re.search(r'const LOCATIONS = (.*);', page).group(1))
+
+    def lookup(self, name):
+        self.lookups.append(name)
+        query = name.strip().lower()
+        cards = [location for location in self.locations if query in location['name'].lower()][:10]
+        for location in cards:
+            if _matches_name(location['name'], name):
+                return location['geo_address']
+        return ADDRESS_NOT_FOUND
+
+    def close(self):
+        pass
+
+
+class MapScraperTests(SimpleTestCase):
+    """The sharded map scraper against the map stand-in served by the fixture server."""
+
+    def setUp(self):
+        self.server, self.base_url = start_fixture_server([], locations=MAP_LOCATIONS, search_delay=0.05)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint_path = os.path.join(directory.name, 'checkpoint.jsonl')
+        self.companies = [{'name': location['name'], 'tons': '1', 'method': 'Biochar'} for location in MAP_LOCATIONS]
+        self.companies.append({'name': 'Not On The Map', 'tons': '2', 'method': 'DAC'})
+        self.expected = {location['name']: location['geo_address'] for location in MAP_LOCATIONS}
+        self.expected['Not On The Map'] = ADDRESS_NOT_FOUND
+
+    def scrape(self, **kwargs):
+        # The scraper reports progress with print
+        with contextlib.redirect_stdout(io.StringIO()):
+            return scrape_locations(self.companies, checkpoint_path=self.checkpoint_path, **kwargs)
+
+    def test_companies_are_shared_between_workers(self):
+        sessions = []
+        lock = threading.Lock()
+
+        def session_factory():
+            session = FixtureMapSession(self.base_url)
+            with lock:
+                sessions.append(session)
+            return session
+
+        results = self.scrape(workers=3, session_factory=session_factory)
+        self.assertEqual([r['name'] for r in results], [c['name'] for c in self.companies])
+        self.assertEqual({r['name']: r['geo_address'] for r in results}, self.expected)
+        self.assertEqual(len(sessions), 3)
+        lookups = [name for session in sessions for name in session.lookups]
+        self.assertCountEqual(lookups, [c['name'] for c in self.companies])
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_resumed_run_skips_finished_companies(self):
+        checkpoint = LocationCheckpoint(self.checkpoint_path)
+        for company in self.companies[:4]:
+            checkpoint.add({'name': company['name'], 'geo_address': self.expected[company['name']],
+                            'tons_delivered': company['tons'], 'method': company['method']})
+        checkpoint.close()
+        sessions = []
+
+        def session_factory():
+            session = FixtureMapSession(self.base_url)
+            sessions.append(session)
+            return session
+
+        results = self.scrape(workers=1, session_factory=session_factory)
+        self.assertEqual({r['name']: r['geo_address'] for r in results}, self.expected)
+        self.assertEqual(sessions[0].lookups, [c['name'] for c in self.companies[4:]])
+
+    def test_finished_checkpoint_starts_no_browser(self):
+        checkpoint = LocationCheckpoint(self.checkpoint_path)
+        for company in self.companies:
+            checkpoint.add({'name': company['name'], 'geo_address': self.expected[company['name']],
+                            'tons_delivered': company['tons'], 'method': company['method']})
+        checkpoint.close()
+
+        sessions = []
+
+        def session_factory():
+            sessions.append(FixtureMapSession(self.base_url))
+            return sessions[-1]
+
+        results = self.scrape(workers=3, session_factory=session_factory)
+        self.assertEqual(sessions, [])
+        self.assertEqual({r['name']: r['geo_address'] for r in results}, self.expected)
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    @unittest.skipUnless(has_chrome(), "needs Chrome")
+    def test_browsers_read_the_map_page(self):
+        results = self.scrape(map_url=f"{self.base_url}/map", workers=2)
+        self.assertEqual({r['name']: r['geo_address'] for r in results}, self.expected)
+        self.assertFalse(os.path.exists(self.checkpoint_path))
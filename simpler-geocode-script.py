@@ -1,38 +1,5 @@
 import pandas as pd
-import requests
-import time
-
-def geocode_address(address):
-    """
-    Convert an address to latitude and longitude using Nominatim API (OpenStreetMap)
-    """
-    # Respect Nominatim's usage policy with a delay between requests
-    time.sleep(1)
-    
-    try:
-        base_url = "https://nominatim.openstreetmap.org/search"
-        params = {
-            'q': address,
-            'format': 'json',
-            'limit': 1
-        }
-        headers = {
-            'User-Agent': 'CompanyLocationGeocoder/1.0'  # Required by Nominatim
-        }
-        
-        response = requests.get(base_url, params=params, headers=headers)
-        data = response.json()
-        
-        if data and len(data) > 0:
-            lat = float(data[0]['lat'])
-            lon = float(data[0]['lon'])
-            return lat, lon
-        else:
-            print(f"Could not geocode address: {address}")
-            return None, None
-    except Exception as e:
-        print(f"Error geocoding address {address}: {e}")
-        return None, None
+from scraping.geocoding import NOT_FOUND, Geocoder, NominatimProvider
 
 # Read the input CSV files
 print("Reading CSV files...")
@@ -88,46 +55,32 @@ if missing_location_cols:
 print("\nUpdated column names in suppliers CSV:", suppliers_df.columns.tolist())
 print("Updated column names in locations CSV:", locations_df.columns.tolist())
 
-# Create a dictionary to store geocoded locations to avoid redundant lookups
-geocoded_locations = {}
+print("\nStarting geocoding process. Addresses already in geocode_cache.sqlite3 or in a city the offline gazetteer knows are not looked up again...")
 
-print("\nStarting geocoding process. This may take several minutes...")
+# Geocode every address in one batch, at Nominatim's rate limit
+geocoded_locations = Geocoder(NominatimProvider()).geocode_batch(locations_df['geo_address'].tolist())
 
-# Geocode each address
 coordinates = []
-for index, row in locations_df.iterrows():
-    company_name = row['Name']
-    address = row['geo_address']
-    
+for company_name, address in zip(locations_df['Name'], locations_df['geo_address']):
     if pd.isna(address) or address == '':
         print(f"Warning: No address for {company_name}, skipping")
         continue
-    
-    # Skip if we've already geocoded this address
-    if address in geocoded_locations:
-        lat, lon = geocoded_locations[address]
-    else:
-        # Geocode the address
-        lat, lon = geocode_address(address)
-        geocoded_locations[address] = (lat, lon)
-    
+
+    location = geocoded_locations.get(address, NOT_FOUND)
     coordinates.append({
         'Name': company_name,
-        'latitude': lat,
-        'longitude': lon,
+        'latitude': location.latitude,
+        'longitude': location.longitude,
+        'precision': location.precision,
         'geo_address': address
     })
-    
-    # Progress update every 10 entries
-    if (index + 1) % 10 == 0:
-        print(f"Processed {index + 1}/{len(locations_df)} addresses")
 
 # Convert to DataFrame
 coordinates_df = pd.DataFrame(coordinates)
 
 # Merge the suppliers data with the coordinates data
 print("\nMerging data...")
-result_df = pd.merge(suppliers_df, coordinates_df[['Name', 'latitude', 'longitude', 'geo_address']], 
+result_df = pd.merge(suppliers_df, coordinates_df[['Name', 'latitude', 'longitude', 'precision', 'geo_address']], 
                      on='Name', how='left')
 
 # Check for suppliers that weren't matched
@@ -147,7 +100,7 @@ result_df['location'] = result_df.apply(
 
 # Reorder columns to match the requested format
 try:
-    final_df = result_df[['Name', 'Tons Delivered', 'Tons Sold', 'Method', 'CDR_Link', 'Company_Link', 'location']]
+    final_df = result_df[['Name', 'Tons Delivered', 'Tons Sold', 'Method', 'CDR_Link', 'Company_Link', 'location', 'precision']]
 except KeyError as e:
     print(f"Error selecting columns: {e}")
     print("Available columns:", result_df.columns.tolist())
@@ -1,75 +1,102 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
+import argparse
+import asyncio
+
 import pandas as pd
-import time
 
-# Set up Chrome in headless mode
-options = webdriver.ChromeOptions()
-options.add_argument("--headless")
-driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+from scraping.incremental import STORE_PATH, FingerprintStore, write_changes
+from scraping.leaderboard import COLUMNS, fetch_leaderboard, parse_leaderboard_rows
+
+CDR_BASE_URL = "https://www.cdr.fyi"
+
+
+def scrape_leaderboard_with_browser(base_url, pages):
+    """
+    Scrape the leaderboard by clicking through its pages in a headless Chrome.
+
+    Args:
+        base_url (str): The site to scrape.
+        pages (int): Number of pages to scrape.
 
-url = "https://www.cdr.fyi/leaderboards"
-driver.get(url)
-wait = WebDriverWait(driver, 15)
+    Returns:
+        list: All rows in page order.
+    """
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException
+    from webdriver_manager.chrome import ChromeDriverManager
 
-# Wait for the table to load initially
-wait.until(EC.presence_of_element_located((By.TAG_NAME, "table")))
+    # Set up Chrome in headless mode
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")
+    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
 
-all_data = []
+    driver.get(f"{base_url}/leaderboards")
+    wait = WebDriverWait(driver, 15)
 
-for page in range(1, 20):  # Pages 1 through 19
-    print(f"📄 Scraping page {page}...")
+    # Wait for the table to load initially
+    wait.until(EC.presence_of_element_located((By.TAG_NAME, "table")))
 
-    # Wait for the page number button and click it
+    all_data = []
     try:
-        button_xpath = f"//nav//ul//li/button[normalize-space(text())='{page}']"
-        page_button = wait.until(EC.element_to_be_clickable((By.XPATH, button_xpath)))
-        page_button.click()
-    except TimeoutException:
-        print(f"❌ Page {page} button not found.")
-        break
-
-    # Wait a bit for table to update
-    time.sleep(2)
-
-    # Grab the updated table
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-    table = soup.find("table")
-    rows = table.find("tbody").find_all("tr")
-
-    for row in rows:
-        cols = row.find_all("td")
-        if not cols:
-            continue
-
-        # Hämta vanlig text från kolumnerna
-        row_data = [col.get_text(strip=True) for col in cols]
-
-        # Hämta länken från <a>-taggen istället för "View"
-        view_link_tag = row.find("a", string="View")
-        if view_link_tag:
-            relative_link = view_link_tag.get("href")
-            row_data[-1] = "https://www.cdr.fyi" + relative_link  # Ersätt sista kolumnen (View) med hela länken
-        else:
-            row_data[-1] = None
-
-        all_data.append(row_data)
-
-# Done
-driver.quit()
-
-# Definiera kolumnerna
-columns = ['Name', 'Tons Delivered', 'Tons Sold', 'Method', 'CDR_Link']
-
-# Skapa DataFrame
-final_df = pd.DataFrame(all_data, columns=columns)
-
-# Spara som CSV
-final_df.to_csv("cdr_suppliers_with_links.csv", index=False)
-print("✅ All 19 pages scraped and saved to 'cdr_suppliers_with_links.csv'")
+        for page in range(1, pages + 1):
+            print(f"📄 Scraping page {page}...")
+            first_row = driver.find_element(By.CSS_SELECTOR, "table tbody tr")
+
+            # Wait for the page number button and click it
+            try:
+                button_xpath = f"//nav//ul//li/button[normalize-space(text())='{page}']"
+                page_button = wait.until(EC.element_to_be_clickable((By.XPATH, button_xpath)))
+                page_button.click()
+            except TimeoutException:
+                print(f"❌ Page {page} button not found.")
+                break
+
+            # Wait until the table has been re-rendered (page 1 is already showing)
+            if page > 1:
+                try:
+                    wait.until(EC.staleness_of(first_row))
+                except TimeoutException:
+                    print(f"⚠️ Table did not update for page {page}, reading it anyway.")
+
+            all_data.extend(parse_leaderboard_rows(driver.page_source, base_url))
+    finally:
+        driver.quit()
+    return all_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape the cdr.fyi supplier leaderboard.")
+    parser.add_argument('--pages', type=int, default=19)
+    parser.add_argument('--output', default="cdr_suppliers_with_links.csv")
+    parser.add_argument('--base-url', default=CDR_BASE_URL)
+    parser.add_argument('--incremental', action='store_true',
+                        help="Fetch pages conditionally, record fingerprints and write a diff of changed suppliers")
+    parser.add_argument('--store', default=STORE_PATH, help="Fingerprint store to use with --incremental")
+    args = parser.parse_args()
+
+    store = FingerprintStore(args.store) if args.incremental else None
+
+    # Plain HTTP is enough when the table is rendered server-side, otherwise use a browser
+    rows = asyncio.run(fetch_leaderboard(args.base_url, args.pages, store.pages if store else None))
+    if rows is None:
+        print("Leaderboard needs JavaScript, scraping it with a browser...")
+        rows = scrape_leaderboard_with_browser(args.base_url, args.pages)
+
+    # Skapa DataFrame
+    final_df = pd.DataFrame(rows, columns=COLUMNS)
+
+    # Spara som CSV
+    final_df.to_csv(args.output, index=False)
+    print(f"✅ {len(final_df)} suppliers scraped and saved to '{args.output}'")
+
+    if store is not None:
+        diff = store.update(final_df.astype(object).where(final_df.notna(), None).to_dict(orient='records'))
+        store.save()
+        write_changes(diff)
+
+
+if __name__ == "__main__":
+    main()
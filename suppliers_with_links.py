@@ -1,56 +1,79 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
+import argparse
+import asyncio
+
 import pandas as pd
-import time
-from bs4 import BeautifulSoup
 
-# Setup Chrome in headless mode
-options = Options()
-options.add_argument("--headless")
-driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+from scraping.company_links import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_HOST_INTERVAL,
+    BrowserPool,
+    fetch_company_links,
+)
+from scraping.incremental import STORE_PATH, FingerprintStore, supplier_key, supplier_fingerprint
+
+CDR_BASE_URL = "https://www.cdr.fyi"
 
-# Read the CSV file that already contains CDR_Link
-df = pd.read_csv("cdr_suppliers_with_links.csv")
 
-# Create a list to store new data
-company_links = []
+def main():
+    parser = argparse.ArgumentParser(description="Fetch the company link for every supplier's CDR_Link.")
+    parser.add_argument('--input', default="cdr_suppliers_with_links.csv")
+    parser.add_argument('--output', default="cdr_suppliers_with_links_and_company.csv")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--host-interval', type=float, default=DEFAULT_HOST_INTERVAL,
+                        help="Minimum seconds between requests to the same host")
+    parser.add_argument('--browsers', type=int, default=2,
+                        help="Headless browsers for pages that need JavaScript (0 disables the fallback)")
+    parser.add_argument('--base-url', default=CDR_BASE_URL,
+                        help="Fetch from another host, e.g. the local fixture server")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Skip suppliers that haven't changed since their link was fetched")
+    parser.add_argument('--store', default=STORE_PATH, help="Fingerprint store to use with --incremental")
+    args = parser.parse_args()
 
-# Function to fetch the Company Link from a CDR-Link
-def fetch_company_link(cdr_link):
-    driver.get(cdr_link)
-    time.sleep(2)  # Wait for the page to load properly
+    # Read the CSV file that already contains CDR_Link
+    df = pd.read_csv(args.input)
+    rows = df.astype(object).where(df.notna(), None).to_dict(orient='records')
+    fetch_links = [row['CDR_Link'].replace(CDR_BASE_URL, args.base_url, 1) if row['CDR_Link'] else None for row in rows]
 
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-    
-    # Fetch the company link based on the specific class (or other attributes)
+    store = FingerprintStore(args.store) if args.incremental else None
+    cache = {}
+    to_fetch = []
+    for row, link in zip(rows, fetch_links):
+        if not link:
+            continue
+        if store is None or store.needs_company_link(row):
+            to_fetch.append(link)
+        if store is not None and supplier_key(row) in store.links:
+            cache[link] = store.links[supplier_key(row)]
+    if store is not None:
+        print(f"{len(to_fetch)} of {len(rows)} suppliers are new or changed")
+
+    browser_pool = BrowserPool(size=args.browsers) if args.browsers > 0 else None
     try:
-        company_link_tag = soup.find("a", class_="text-muted-foreground")
-        company_link = company_link_tag.get("href") if company_link_tag else "N/A"
-        print(f"Found company link: {company_link}")
-    except AttributeError:
-        company_link = "N/A"
-        print('Company link not found.')
-    
-    return company_link
-
-# Loop through all CDR_Link entries and fetch the Company_Link
-for index, row in df.iterrows():
-    cdr_link = row['CDR_Link']
-    if cdr_link:
-        print(f"Scraping Company Link for index {index} and link: {cdr_link}")
-        company_link = fetch_company_link(cdr_link)
-    else:
-        company_link = "N/A"
-    company_links.append(company_link)
-
-# Add Company_Link as a new column in the DataFrame
-df['Company_Link'] = company_links
-
-# Close the browser
-driver.quit()
-
-# Save the updated DataFrame to a new CSV file
-df.to_csv("cdr_suppliers_with_links_and_company.csv", index=False)
-print("✅ All data scraped and saved to 'cdr_suppliers_with_links_and_company.csv'")
+        asyncio.run(fetch_company_links(
+            to_fetch,
+            concurrency=args.concurrency,
+            host_interval=args.host_interval,
+            browser_pool=browser_pool,
+            cache=cache,
+        ))
+    finally:
+        if browser_pool is not None:
+            browser_pool.close()
+
+    if store is not None:
+        for row, link in zip(rows, fetch_links):
+            if link in cache:
+                store.links[supplier_key(row)] = dict(cache[link], fingerprint=supplier_fingerprint(row))
+        store.save()
+
+    # Add Company_Link as a new column in the DataFrame
+    df['Company_Link'] = [cache[link]['company_link'] if link in cache else "N/A" for link in fetch_links]
+
+    # Save the updated DataFrame to a new CSV file
+    df.to_csv(args.output, index=False)
+    print(f"✅ All data scraped and saved to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()